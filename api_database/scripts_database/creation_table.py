@@ -59,12 +59,19 @@ with conn.cursor() as cursor:
     ci_name VARCHAR(100),
     location_full VARCHAR(300),
     resulted_embeddings VARCHAR(MAX),
+    embedding VARBINARY(MAX),
     cluster_number INT,
     problem_title VARCHAR(300),
-    model VARCHAR(50)
+    model VARCHAR(50),
+    input_hash CHAR(64),
+    centroid_distance FLOAT,
+    runner_up_cluster INT,
+    runner_up_distance FLOAT
     )"""
 
     cursor.execute(create_table_query)
+    # Lookup of the stored predictions of an incident (idempotent predictions of api_ia)
+    cursor.execute("CREATE INDEX ix_predictions_lookup ON predictions (incident_number, model, input_hash)")
     
     
 conn.close()
\ No newline at end of file
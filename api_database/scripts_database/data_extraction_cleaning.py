@@ -2,8 +2,9 @@ import pandas as pd
 import re 
 import os 
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
 import pyodbc
+# Run from the root of the repository (or with it in PYTHONPATH), e.g. `python -m api_database.scripts_database.data_extraction_cleaning`
+from api_ia.clustering_model.utils import create_sql_server_engine, bulk_load
 
 load_dotenv() 
 
@@ -16,11 +17,8 @@ username = os.getenv("AZURE_DATABASE_USERNAME")
 password = os.getenv("AZURE_DATABASE_PASSWORD")
 
 # Connection to Azure databases
-azure_connection_string = f"mssql+pyodbc://{username}:{password}@{server}/{database}?driver=ODBC+Driver+17+for+SQL+Server"
-engine = create_engine(azure_connection_string)
-
-azure_connection_string_raw = f"mssql+pyodbc://{username}:{password}@{server}/{database_raw}?driver=ODBC+Driver+17+for+SQL+Server"
-engine_raw = create_engine(azure_connection_string_raw)
+engine = create_sql_server_engine(database)
+engine_raw = create_sql_server_engine(database_raw)
 
 def filter_dataframe(df) -> pd.DataFrame:
     """
@@ -132,10 +130,10 @@ ci_name = clean_column_names(ci_name)
 ### IMPORT AND AGREGATION ### 
 
 # Save clean incidents in the new database
-df.to_sql('incidents',con=engine, if_exists='append',index=False)
+bulk_load(df, 'incidents', engine, if_exists='append')
 
 # Save clean ci location on the database
-ci_name.to_sql('ci_location',con=engine, if_exists='append',index=False)
+bulk_load(ci_name, 'ci_location', engine, if_exists='append')
 
 
 conn = pyodbc.connect('DRIVER='+driver+';SERVER=tcp:'+server+';PORT=1433;DATABASE='+database+';UID='+username+';PWD='+ password)
@@ -0,0 +1,114 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Groups concurrent single-item calls into batches processed by one function call.
+
+    Each call to `submit()` queues its item and waits for its result. A background worker takes the first
+    waiting item, collects the items arriving in the next `max_wait_ms` milliseconds (up to `max_batch_size`
+    items), processes them with a single call to `process_batch` and hands each result back to its caller.
+    This trades at most `max_wait_ms` of latency for the throughput of batched inference.
+
+    Args:
+        process_batch (callable): Function taking a list of items and returning the list of their results, in order.
+        max_batch_size (int): Maximum number of items per batch.
+        max_wait_ms (float): Maximum number of milliseconds the first item of a batch waits for others.
+        timeout (float): Default maximum number of seconds a caller waits for its result.
+    """
+
+    def __init__(self, process_batch, max_batch_size=32, max_wait_ms=5, timeout=30):
+        self._process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+
+    def submit(self, item, timeout=None):
+        """
+        Processes an item as part of the next batch and returns its result.
+
+        Args:
+            item: The item to process.
+            timeout (float): Maximum number of seconds to wait for the result. Defaults to the timeout of the batcher.
+
+        Returns:
+            The result of the item.
+
+        Raises:
+            TimeoutError: If the result is not ready in time. The item is dropped if its batch has not started yet.
+            Exception: The exception raised by `process_batch` for the batch of the item.
+        """
+        self._ensure_started()
+        future = Future()
+        self._queue.put((item, future))
+        try:
+            return future.result(self.timeout if timeout is None else timeout)
+        except TimeoutError:
+            future.cancel()
+            raise
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait_ms / 1000
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        # Items whose caller gave up before the batch started are dropped
+        batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        items = [item for item, _ in batch]
+        try:
+            results = list(self._process_batch(items))
+            if len(results) != len(items):
+                # The results cannot be matched to their items: none of them is handed back
+                raise RuntimeError(f"process_batch returned {len(results)} results for {len(items)} items")
+        except Exception as exc:
+            logger.warning("Micro-batch of %d items failed", len(items), exc_info=True)
+            for _, future in batch:
+                future.set_exception(exc)
+            return
+        self.batches += 1
+        self.items += len(items)
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+    def stats(self):
+        """
+        Returns the number of batches processed and their mean size.
+
+        Returns:
+            dict: The batcher statistics.
+        """
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+        }
@@ -1,8 +1,11 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text
+from sqlalchemy import create_engine, Column, Integer, Float, String, Text, LargeBinary, Table, MetaData, Index, select, bindparam, text
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
+from sqlalchemy.dialects.mssql import VARBINARY
 import string
 import random
 import os
+import threading
+import json
 from sqlalchemy.exc import IntegrityError
 from datetime import datetime
 
@@ -29,11 +32,34 @@ def create_sql_server_engine():
     CONNECTION_STRING = f"DRIVER={driver};SERVER={server};DATABASE={database};UID={username};PWD={password}"
 
     # Create engine and session
-    engine = create_engine(f"mssql+pyodbc:///?odbc_connect={CONNECTION_STRING}")
+    engine = create_engine(f"mssql+pyodbc:///?odbc_connect={CONNECTION_STRING}", fast_executemany=True)
     return engine
 
-engine = create_sql_server_engine()
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """
+    Returns the process-wide SQL Server engine, creating it on first use.
+
+    The engine (and the `pyodbc` driver it imports) is not created when the module is imported, so importing
+    the API does no database work. Sessions created with `SessionLocal` are bound to it.
+
+    Returns:
+        sqlalchemy.engine.base.Engine: SQLAlchemy engine connected to the SQL Server database.
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = create_sql_server_engine()
+                SessionLocal.configure(bind=_engine)
+    return _engine
+
+
+# Bound to the engine by `get_engine()`
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
 
 # Define base class for SQLAlchemy models
 class Base(DeclarativeBase):
@@ -44,23 +70,40 @@ class DBpredictions(Base):
     __tablename__ = "predictions"
 
     prediction_id = Column(String(255), primary_key=True, index=True)
-    incident_number = Column(String,unique=True,index=True)
+    incident_number = Column(String(250),unique=True,index=True)
     creation_date = Column(String)
     description = Column(String)
     category_full = Column(String)
     ci_name = Column(String)
     location_full = Column(String)
+    # Legacy JSON text embeddings, only set on rows not migrated yet (see migrate_embeddings.py)
     resulted_embeddings = Column(Text)
+    # Binary embeddings (see api_ia.embeddings.codec)
+    embedding = Column(LargeBinary().with_variant(VARBINARY("max"), "mssql"))
     cluster_number = Column(Integer)
     problem_title = Column(String)
-    model = Column(String)
+    model = Column(String(50))
+    # Distance to the assigned centroid and second nearest cluster, to flag low-confidence assignments
+    centroid_distance = Column(Float)
+    runner_up_cluster = Column(Integer)
+    runner_up_distance = Column(Float)
+    # Hash of the incident text, the encoder and the model version (see find_db_predictions)
+    input_hash = Column(String(64))
 
+    __table_args__ = (Index("ix_predictions_lookup", "incident_number", "model", "input_hash"),)
 
-# Create tables in the database
-Base.metadata.create_all(bind=engine)
+
+# Create tables in the database and add the columns and indexes missing from an existing predictions table
+# (called when the API warms up, not at import time)
+def init_db():
+    from api_ia.api.migrations import migrate_predictions_table
+
+    Base.metadata.create_all(bind=get_engine())
+    migrate_predictions_table(get_engine())
 
 # Dependency to get the database session
 def get_db():
+    get_engine()
     db = SessionLocal()
     try:
         yield db
@@ -78,9 +121,9 @@ def create_db_prediction(prediction: dict, db: SessionLocal) -> DBpredictions:
     """
     Create or update a prediction in the database based on the provided dictionary.
 
-    This function checks if a prediction with the given `incident_number` already exists:
-    - If it exists, updates the existing record with the new values.
-    - If it does not exist, creates a new record with a generated ID.
+    The prediction goes through the same set-based upsert as `create_db_predictions`:
+    - If a prediction with the given `incident_number` exists, it is updated with the new values.
+    - If it does not exist, a new record is created with a generated ID.
 
     Args:
         prediction (dict): A dictionary containing prediction data, including 'incident_number'.
@@ -93,22 +136,146 @@ def create_db_prediction(prediction: dict, db: SessionLocal) -> DBpredictions:
         ValueError: If there is an issue inserting a new prediction due to a database integrity error.
     """
     incident_number = prediction.get("incident_number")
-    existing_prediction = db.query(DBpredictions).filter(DBpredictions.incident_number == incident_number).first()
+    try:
+        create_db_predictions([prediction], db)
+    except ValueError:
+        raise ValueError(f"Failed to insert prediction with incident_number: {incident_number}")
+    return db.query(DBpredictions).filter(DBpredictions.incident_number == incident_number).first()
+
+
+def create_db_predictions(predictions: list, db: SessionLocal) -> int:
+    """
+    Create or update several predictions in the database with a single set-based upsert, in one transaction.
+
+    This function:
+    1. Keeps the last prediction of each incident number and generates an ID for each of them (only used for new records).
+    2. On SQL Server, inserts the rows into a temporary staging table and MERGEs it into the predictions table.
+       On databases supporting `INSERT ... ON CONFLICT` (SQLite, PostgreSQL), upserts the rows with a single statement.
+    3. Commits everything at once.
+
+    All the predictions are expected to have the same keys: a key missing from one of them is written as NULL.
+
+    Args:
+        predictions (list): A list of dictionaries containing prediction data, each including 'incident_number'.
+        db (SessionLocal): SQLAlchemy session object used for database operations.
+
+    Returns:
+        int: The number of distinct incident numbers written.
+
+    Raises:
+        ValueError: If the transaction fails due to a database integrity error.
+    """
+    predictions_by_incident = {prediction.get("incident_number"): prediction for prediction in predictions}
+    if not predictions_by_incident:
+        return 0
 
-    if existing_prediction:
-        for key, value in prediction.items():
-            setattr(existing_prediction, key, value)
+    columns = [column for column in DBpredictions.__table__.columns.keys() if column != "prediction_id"]
+    keys = [column for column in columns if any(column in prediction for prediction in predictions_by_incident.values())]
+    rows = [
+        {"prediction_id": generate_id(), **{key: prediction.get(key) for key in keys}}
+        for prediction in predictions_by_incident.values()
+    ]
+
+    try:
+        if db.get_bind().dialect.name == "mssql":
+            _merge_predictions(rows, keys, db)
+        else:
+            _upsert_predictions(rows, keys, db)
         db.commit()
-        db.refresh(existing_prediction)
-        return existing_prediction
+    except IntegrityError:
+        db.rollback()
+        raise ValueError(f"Failed to insert a batch of {len(rows)} predictions")
+    return len(rows)
+
+
+def _merge_predictions(rows: list, keys: list, db: SessionLocal) -> None:
+    """
+    Upserts prediction rows on SQL Server through a temporary staging table and a MERGE statement.
+    """
+    table = DBpredictions.__table__
+    staging = Table(
+        "#predictions_staging", MetaData(),
+        *[Column(name, table.c[name].type) for name in ["prediction_id"] + keys]
+    )
+    connection = db.connection()
+    staging.create(connection)
+    connection.execute(staging.insert(), rows)
+
+    update_keys = [key for key in keys if key != "incident_number"]
+    update_clause = f"WHEN MATCHED THEN UPDATE SET {', '.join(f'target.{key} = source.{key}' for key in update_keys)}" if update_keys else ""
+    insert_columns = ", ".join(["prediction_id"] + keys)
+    insert_values = ", ".join(f"source.{key}" for key in ["prediction_id"] + keys)
+    connection.execute(text(f"""
+    MERGE {table.name} WITH (HOLDLOCK) AS target
+    USING {staging.name} AS source
+    ON target.incident_number = source.incident_number
+    {update_clause}
+    WHEN NOT MATCHED THEN INSERT ({insert_columns}) VALUES ({insert_values});
+    """))
+    staging.drop(connection)
+
+
+def _upsert_predictions(rows: list, keys: list, db: SessionLocal) -> None:
+    """
+    Upserts prediction rows with INSERT ... ON CONFLICT on the incident number (SQLite, PostgreSQL).
+    """
+    table = DBpredictions.__table__
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    statement = insert(table)
+    update_keys = [key for key in keys if key != "incident_number"]
+    if update_keys:
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.incident_number],
+            set_={key: statement.excluded[key] for key in update_keys},
+        )
     else:
-        prediction_id = generate_id()
-        db_prediction = DBpredictions(prediction_id=prediction_id, **prediction)
-        db.add(db_prediction)
-        try:
-            db.commit()
-        except IntegrityError:
-            db.rollback()
-            raise ValueError(f"Failed to insert prediction with incident_number: {incident_number}")
-        db.refresh(db_prediction)
-        return db_prediction
\ No newline at end of file
+        statement = statement.on_conflict_do_nothing(index_elements=[table.c.incident_number])
+    db.execute(statement, rows)
+
+
+def find_db_predictions(incident_numbers: list, model: str, db: SessionLocal) -> dict:
+    """
+    Retrieves the stored predictions of several incidents for a model with a single indexed query.
+
+    On SQL Server, the incident numbers are sent as one JSON parameter (read with OPENJSON), since a statement
+    accepts at most 2100 parameters. Other databases get an `IN` list.
+
+    Args:
+        incident_numbers (list): The incident numbers to look up.
+        model (str): The name of the model that made the predictions.
+        db (SessionLocal): SQLAlchemy session object used for database operations.
+
+    Returns:
+        dict: A mapping {incident number: row}, where each row has the `input_hash`, `cluster_number`,
+            `problem_title`, `embedding`, `centroid_distance`, `runner_up_cluster` and `runner_up_distance`
+            of the stored prediction.
+    """
+    incident_numbers = list(dict.fromkeys(incident_numbers))
+    if not incident_numbers:
+        return {}
+
+    table = DBpredictions.__table__
+    if db.get_bind().dialect.name == "mssql":
+        statement = text(f"""
+        SELECT p.incident_number, p.input_hash, p.cluster_number, p.problem_title, p.embedding,
+        p.centroid_distance, p.runner_up_cluster, p.runner_up_distance
+        FROM {table.name} AS p
+        JOIN OPENJSON(:incident_numbers) WITH (incident_number VARCHAR(250) '$') AS lookup
+        ON p.incident_number = lookup.incident_number
+        WHERE p.model = :model
+        """)
+        rows = db.execute(statement, {"incident_numbers": json.dumps(incident_numbers), "model": model}).all()
+    else:
+        statement = (
+            select(
+                table.c.incident_number, table.c.input_hash, table.c.cluster_number, table.c.problem_title, table.c.embedding,
+                table.c.centroid_distance, table.c.runner_up_cluster, table.c.runner_up_distance,
+            )
+            .where(table.c.incident_number.in_(bindparam("incident_numbers", expanding=True)), table.c.model == bindparam("model"))
+        )
+        rows = db.execute(statement, {"incident_numbers": incident_numbers, "model": model}).all()
+
+    return {row.incident_number: row._asdict() for row in rows}
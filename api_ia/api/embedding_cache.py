@@ -0,0 +1,234 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from dotenv import load_dotenv
+from api_ia.api.encoder import get_encoder
+from api_ia.embeddings.keys import embedding_key
+
+load_dotenv()
+
+
+class DiskEmbeddingStore:
+    """
+    Append-only on-disk store of float32 embeddings, read through a memory map.
+
+    The directory holds three files:
+    - `meta.json`: the embedding dimension;
+    - `vectors.f32`: the raw float32 vectors, one row per embedding;
+    - `keys.txt`: the cache key of each row, one per line.
+
+    Vectors are written before their key, so a crash while writing never leaves a key pointing to a partial row;
+    the rows left incomplete by a crash are dropped when the store is opened.
+
+    Args:
+        path (str): Directory of the store. Created if it does not exist.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._vectors_path = os.path.join(path, "vectors.f32")
+        self._keys_path = os.path.join(path, "keys.txt")
+        self._meta_path = os.path.join(path, "meta.json")
+        self._lock = threading.Lock()
+        self._index = {}
+        self._mmap = None
+        self.dim = None
+
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path) as f:
+                self.dim = json.load(f)["dim"]
+        if self.dim is not None:
+            self._recover()
+
+    def _recover(self):
+        """
+        Drops the rows left incomplete by a crash, so that the vectors and the keys stay aligned.
+
+        A crash between the write of a vector and the write of its key leaves an orphan vector, and a crash
+        while writing either file leaves a partial row or line. Only the rows with both a complete vector and a
+        complete key are kept: both files are truncated to them, so that the next row appended gets the same
+        position in both files.
+        """
+        n_vectors = os.path.getsize(self._vectors_path) // (4 * self.dim) if os.path.exists(self._vectors_path) else 0
+        keys = []
+        if os.path.exists(self._keys_path):
+            with open(self._keys_path) as f:
+                keys = [line[:-1] for line in f if line.endswith("\n")]
+        n_rows = min(n_vectors, len(keys))
+        keys = keys[:n_rows]
+
+        with open(self._vectors_path, "ab") as f:
+            f.truncate(n_rows * 4 * self.dim)
+        with open(self._keys_path, "w") as f:
+            f.writelines(key + "\n" for key in keys)
+        self._index = {key: row for row, key in enumerate(keys)}
+
+    def __len__(self):
+        return len(self._index)
+
+    def get(self, key):
+        """
+        Returns the embedding stored for the given key, or None.
+        """
+        row = self._index.get(key)
+        if row is None:
+            return None
+        mmap = self._mmap
+        if mmap is None or row >= mmap.shape[0]:
+            with self._lock:
+                mmap = self._mmap = np.memmap(self._vectors_path, dtype=np.float32, mode="r").reshape(-1, self.dim)
+        return np.array(mmap[row])
+
+    def put(self, key, embedding):
+        """
+        Appends an embedding to the store. Keys already stored are ignored.
+        """
+        embedding = np.asarray(embedding, dtype=np.float32).ravel()
+        with self._lock:
+            if key in self._index:
+                return
+            if self.dim is None:
+                self.dim = embedding.shape[0]
+                with open(self._meta_path, "w") as f:
+                    json.dump({"dim": self.dim}, f)
+            elif embedding.shape[0] != self.dim:
+                raise ValueError(f"Embedding dimension {embedding.shape[0]} does not match the store dimension {self.dim}")
+            with open(self._vectors_path, "ab") as f:
+                f.write(embedding.tobytes())
+            with open(self._keys_path, "a") as f:
+                f.write(key + "\n")
+            self._index[key] = len(self._index)
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache, so that repeated incident texts skip transformer inference.
+
+    Embeddings are keyed by a hash of the normalized text and the encoder model ID. The first tier is an
+    in-process LRU of at most `max_entries` embeddings; the optional second tier is a `DiskEmbeddingStore`
+    that survives restarts. Hits and misses are counted.
+
+    Args:
+        model_id (str): The identifier of the encoder model, part of every key.
+        max_entries (int): Maximum number of embeddings kept in memory. 0 disables the memory tier.
+        disk_path (str): Optional directory of the on-disk tier.
+    """
+
+    def __init__(self, model_id, max_entries=10000, disk_path=None):
+        self.model_id = model_id
+        self.max_entries = max_entries
+        self.disk = DiskEmbeddingStore(disk_path) if disk_path else None
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls, model_id):
+        """
+        Creates a cache configured from the EMBEDDING_CACHE_SIZE and EMBEDDING_CACHE_DIR environment variables.
+        """
+        return cls(
+            model_id=model_id,
+            max_entries=int(os.getenv("EMBEDDING_CACHE_SIZE", 10000)),
+            disk_path=os.getenv("EMBEDDING_CACHE_DIR") or None,
+        )
+
+    def _get(self, key):
+        with self._lock:
+            embedding = self._memory.get(key)
+            if embedding is not None:
+                self._memory.move_to_end(key)
+                return embedding
+        if self.disk is not None:
+            embedding = self.disk.get(key)
+            if embedding is not None:
+                self._remember(key, embedding)
+        return embedding
+
+    def _remember(self, key, embedding):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._memory[key] = embedding
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def encode(self, docs, encode):
+        """
+        Returns the embeddings of the documents, computing only the ones missing from the cache.
+
+        Missing documents are deduplicated and encoded with a single call to `encode`.
+
+        Args:
+            docs (list[str]): The documents to encode.
+            encode (callable): Function taking a list of documents and returning a float32 array of embeddings.
+
+        Returns:
+            np.ndarray: A float32 array of shape (len(docs), embedding_dim).
+        """
+        if len(docs) == 0:
+            return np.empty((0, 0), dtype=np.float32)
+        keys = [embedding_key(doc, self.model_id) for doc in docs]
+        embeddings = [self._get(key) for key in keys]
+
+        missing = {}
+        for i, (key, embedding) in enumerate(zip(keys, embeddings)):
+            if embedding is None:
+                missing.setdefault(key, []).append(i)
+
+        # Duplicates of a missing document within the batch are encoded once, so they count as hits
+        with self._lock:
+            self.hits += len(docs) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            missing_keys = list(missing)
+            computed = np.asarray(encode([docs[missing[key][0]] for key in missing_keys]), dtype=np.float32)
+            for key, embedding in zip(missing_keys, computed):
+                self._remember(key, embedding)
+                if self.disk is not None:
+                    self.disk.put(key, embedding)
+                for i in missing[key]:
+                    embeddings[i] = embedding
+
+        return np.vstack(embeddings).astype(np.float32, copy=False)
+
+    def stats(self):
+        """
+        Returns the hit and miss counters and the size of each tier.
+
+        Returns:
+            dict: The cache statistics.
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "memory_entries": len(self._memory),
+            "disk_entries": len(self.disk) if self.disk is not None else 0,
+        }
+
+
+_embedding_cache = None
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """
+    Returns the process-wide embedding cache of the shared encoder, creating it from the environment on first use.
+
+    Returns:
+        EmbeddingCache: The shared embedding cache.
+    """
+    global _embedding_cache
+    if _embedding_cache is None:
+        with _embedding_cache_lock:
+            if _embedding_cache is None:
+                _embedding_cache = EmbeddingCache.from_env(get_encoder().model_name)
+    return _embedding_cache
@@ -0,0 +1,114 @@
+import os
+import threading
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DEFAULT_ENCODER_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+
+
+def _optional_int(value):
+    return int(value) if value not in (None, "") else None
+
+
+class EncoderService:
+    """
+    Long-lived SentenceTransformer encoder shared by all requests of the API.
+
+    The model weights and tokenizer are loaded once, on `load()` or on the first call to `encode()`.
+    Calls to `encode()` are serialized with a lock so that concurrent requests from uvicorn's threadpool
+    never run the model at the same time (torch already parallelizes a single call over its own threads).
+
+    Args:
+        model_name (str): Name of the SentenceTransformer model to load.
+        device (str): Device to run the model on ('cpu', 'cuda', ...). None lets sentence-transformers choose.
+        max_seq_length (int): Maximum number of tokens per document. None keeps the model default.
+        num_threads (int): Number of torch intra-op threads. None keeps the torch default.
+    """
+
+    def __init__(self, model_name=DEFAULT_ENCODER_MODEL, device=None, max_seq_length=None, num_threads=None):
+        self.model_name = model_name
+        self.device = device
+        self.max_seq_length = max_seq_length
+        self.num_threads = num_threads
+        self._model = None
+        self._load_lock = threading.Lock()
+        self._encode_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """
+        Creates an encoder configured from the ENCODER_MODEL, ENCODER_DEVICE, ENCODER_MAX_SEQ_LENGTH
+        and ENCODER_NUM_THREADS environment variables.
+
+        Returns:
+            EncoderService: The configured (not yet loaded) encoder.
+        """
+        return cls(
+            model_name=os.getenv("ENCODER_MODEL", DEFAULT_ENCODER_MODEL),
+            device=os.getenv("ENCODER_DEVICE") or None,
+            max_seq_length=_optional_int(os.getenv("ENCODER_MAX_SEQ_LENGTH")),
+            num_threads=_optional_int(os.getenv("ENCODER_NUM_THREADS")),
+        )
+
+    @property
+    def is_loaded(self):
+        return self._model is not None
+
+    def load(self):
+        """
+        Loads the SentenceTransformer model if it is not loaded yet. Safe to call several times.
+
+        Returns:
+            EncoderService: The encoder itself.
+        """
+        if self._model is not None:
+            return self
+        with self._load_lock:
+            if self._model is None:
+                import torch
+                from sentence_transformers import SentenceTransformer
+
+                if self.num_threads:
+                    torch.set_num_threads(self.num_threads)
+                model = SentenceTransformer(self.model_name, device=self.device)
+                if self.max_seq_length:
+                    model.max_seq_length = self.max_seq_length
+                self._model = model
+        return self
+
+    def encode(self, docs, batch_size=32):
+        """
+        Encodes a list of documents into embeddings.
+
+        Args:
+            docs (list[str] | pd.Series): The documents to encode.
+            batch_size (int): Number of documents encoded per forward pass.
+
+        Returns:
+            np.ndarray: A float32 array of shape (len(docs), embedding_dim).
+        """
+        self.load()
+        with self._encode_lock:
+            embeddings = self._model.encode(list(docs), batch_size=batch_size)
+        return np.asarray(embeddings, dtype=np.float32)
+
+
+_encoder = None
+_encoder_lock = threading.Lock()
+
+
+def get_encoder():
+    """
+    Returns the process-wide encoder, creating it from the environment on first use.
+
+    Returns:
+        EncoderService: The shared encoder.
+    """
+    global _encoder
+    if _encoder is None:
+        with _encoder_lock:
+            if _encoder is None:
+                _encoder = EncoderService.from_env()
+    return _encoder
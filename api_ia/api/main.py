@@ -1,13 +1,22 @@
 
 from fastapi import FastAPI, Request, HTTPException
-from api_ia.api.utils import PredictionOuput, PredictionInput, predict_cluster, get_model_path
-from api_ia.api.database import get_db, create_db_prediction
+from api_ia.api.utils import PredictionOuput, PredictionInput, SimilarIncident, predict_cluster, predict_clusters, prediction_input_hash, get_cached_model_path, cluster_titles, similar_incidents, find_similar_incidents
+from api_ia.api.encoder import get_encoder
+from api_ia.api.embedding_cache import get_embedding_cache
+from api_ia.embeddings.codec import encode_embedding, decode_embedding
+from api_ia.api.database import get_db, get_engine, create_db_predictions, find_db_predictions, SessionLocal, init_db
+from api_ia.api.persistence import PredictionWriter
+from api_ia.api.warmup import WarmUp
+from api_ia.api.similar import IndexNotReady
+from api_ia.api.metrics import stage_metrics
 from fastapi import Depends
 from sqlalchemy.orm import Session
 import os 
 from dotenv import load_dotenv
-import json
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
+from contextlib import asynccontextmanager
+from typing import List
 
 
 load_dotenv()
@@ -15,7 +24,85 @@ load_dotenv()
 
 API_IA_SECRET_KEY = os.getenv('API_IA_SECRET_KEY')
 
-app = FastAPI()
+N_CLUSTER = 40
+MODEL_NAME = f"kmeans_{N_CLUSTER}"
+
+# Write-behind mode: predictions are saved by a background worker instead of before the response
+PREDICTIONS_WRITE_BEHIND = os.getenv("PREDICTIONS_WRITE_BEHIND", "false").lower() == "true"
+# Idempotent predictions: incidents already predicted from the same inputs are returned from the database
+PREDICTIONS_SHORT_CIRCUIT = os.getenv("PREDICTIONS_SHORT_CIRCUIT", "true").lower() == "true"
+
+
+def write_predictions(records: list) -> None:
+    """
+    Saves a batch of prediction records with a dedicated database session (used by the write-behind worker).
+
+    Args:
+        records (list): The prediction records.
+    """
+    get_engine()
+    db = SessionLocal()
+    try:
+        with stage_metrics.stage("db_write"):
+            create_db_predictions(records, db)
+    finally:
+        db.close()
+
+
+prediction_writer = PredictionWriter.from_env(write_predictions)
+
+stage_metrics.register_gauge("write_behind_queue_depth", lambda: prediction_writer.metrics()["queue_depth"])
+stage_metrics.register_counter("embedding_cache_hits", lambda: get_embedding_cache().stats()["hits"])
+stage_metrics.register_counter("embedding_cache_misses", lambda: get_embedding_cache().stats()["misses"])
+stage_metrics.register_gauge("similar_index_size", lambda: similar_incidents.size)
+
+
+def warm_up_inference() -> None:
+    """
+    Runs one dummy prediction through the whole inference path (encoder, cluster assignment, titles), without saving it.
+    """
+    dummy_incident = PredictionInput(
+        incident_number="warm-up",
+        creation_date="",
+        description="Trigger: Host has been restarted",
+        category_full="Incidents/Infrastructure/System",
+        ci_name="warm-up",
+        location_full="warm-up",
+    )
+    predict_clusters(get_cached_model_path(MODEL_NAME),[dummy_incident],titles_table=f"{MODEL_NAME}_clusters_title")
+
+
+warm_up = WarmUp([
+    ("database", init_db),
+    ("encoder", lambda: get_encoder().load()),
+    # Resolving the model URI for the first time also loads the centroids and the cluster titles of the model
+    ("model", lambda: get_cached_model_path(MODEL_NAME)),
+    ("titles", lambda: cluster_titles.ensure(get_cached_model_path(MODEL_NAME), f"{MODEL_NAME}_clusters_title")),
+    ("dummy_inference", warm_up_inference),
+])
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Creates the long-lived services shared by all requests when the API starts.
+
+    The warm-up (database tables, encoder, clustering model, cluster titles and one dummy inference) runs in
+    the background, so that `/health/live` answers right away and `/health/ready` once everything is loaded.
+    In write-behind mode, the prediction writer is started here and the predictions still queued are written on shutdown.
+
+    Parameters:
+        app (FastAPI): The application being started.
+    """
+    app.state.encoder = get_encoder()
+    warm_up.start_in_background()
+    if PREDICTIONS_WRITE_BEHIND:
+        prediction_writer.start()
+    yield
+    prediction_writer.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 # Apply CORS middleware to allow documentation access without API key
@@ -40,7 +127,7 @@ async def verify_api_key(request: Request, call_next):
     Returns:
         The HTTP response after verifying the API key.
     """
-    if request.url.path != "/docs" and request.url.path != "/openapi.json":
+    if request.url.path not in ("/docs", "/openapi.json", "/health/live", "/health/ready", "/metrics"):
         api_key = request.headers.get("X-API-Key")
         if api_key != API_IA_SECRET_KEY:
             raise HTTPException(status_code=401, detail="Accès non autorisé")
@@ -48,47 +135,291 @@ async def verify_api_key(request: Request, call_next):
     return response
 
 
+@app.get("/health/live")
+def health_live() -> dict:
+    """
+    Liveness probe: answers as soon as the API process is up, without API key.
+
+    Returns:
+        dict: The liveness status.
+    """
+    return {"status": "alive"}
+
+
+@app.get("/health/ready")
+def health_ready():
+    """
+    Readiness probe: answers 200 once the warm-up is done, 503 before, without API key.
+
+    The response reports how long each warm-up phase took, and the error of the failed phase if any.
+
+    Returns:
+        JSONResponse: The warm-up status.
+    """
+    status = warm_up.status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics() -> str:
+    """
+    Exposes the per-stage latency histograms and counters in the Prometheus text format, without API key.
+
+    Returns:
+        str: The metrics.
+    """
+    return stage_metrics.render_prometheus()
+
+
 @app.post("/predict", response_model=PredictionOuput)
 def predict(
     incident: PredictionInput, 
+    sync: bool = False,
+    force: bool = False,
     db: Session = Depends(get_db)
     ) -> PredictionOuput:
     """
     Predicts the cluster for a given incident and saves the prediction to the database.
 
     This endpoint:
-    1. Loads a KMeans model based on a fixed cluster number.
-    2. Uses the model to predict the cluster of the given incident.
-    3. Creates or updates the prediction record in the database.
-    4. Returns the prediction results.
+    1. Gets a KMeans model based on a fixed cluster number (URI cached from MLflow, model loaded once per version by the model registry).
+    2. Returns the stored prediction if the incident was already predicted from the same text by the same model version.
+    3. Otherwise, uses the model to predict the cluster of the given incident.
+    4. Creates or updates the prediction record in the database with a single upsert (in the background in write-behind mode).
+    5. Returns the prediction results.
 
     Args:
         incident (PredictionInput): Input data for the prediction, including incident details.
+        sync (bool): Saves the prediction before returning, even in write-behind mode (read-after-write).
+        force (bool): Predicts the incident again even if a matching prediction is stored.
         db (Session): SQLAlchemy session object for database interactions, provided by dependency injection.
 
     Returns:
-        PredictionOuput: The prediction result including the cluster number, problem title, and resulting embeddings.
+        PredictionOuput: The prediction result including the cluster number, problem title, resulting embeddings, distance to the centroid and runner-up cluster.
     """
-    n_cluster = 40
-    model_name = f"kmeans_{n_cluster}"
-    model_path = get_model_path(model_name)
+    with stage_metrics.stage("model_path"):
+        model_path = get_cached_model_path(MODEL_NAME)
     
-    prediction = predict_cluster(model_path,incident)
+    [prediction], records = predict_incidents(model_path, [incident], db, force)
 
     # MLops: Save prediction to database
-    prediction_dict = {
+    save_predictions(records, db, sync)
+
+    return prediction
+
+
+@app.post("/predict/batch", response_model=List[PredictionOuput])
+def predict_batch(
+    incidents: List[PredictionInput], 
+    sync: bool = False,
+    force: bool = False,
+    db: Session = Depends(get_db)
+    ) -> List[PredictionOuput]:
+    """
+    Predicts the clusters for a list of incidents and saves all the predictions to the database.
+
+    This endpoint:
+    1. Gets the KMeans model, like the `/predict` endpoint.
+    2. Looks up the stored predictions of all the incidents with a single query, and keeps those predicted from the same text by the same model version.
+    3. Encodes the other incidents with a single call to the encoder and predicts their clusters on the whole embedding matrix.
+    4. Creates or updates their prediction records in a single database transaction (in the background in write-behind mode).
+    5. Returns the prediction results, in the same order as the incidents.
+
+    Args:
+        incidents (List[PredictionInput]): The incidents to predict.
+        sync (bool): Saves the predictions before returning, even in write-behind mode (read-after-write).
+        force (bool): Predicts all the incidents again even if matching predictions are stored.
+        db (Session): SQLAlchemy session object for database interactions, provided by dependency injection.
+
+    Returns:
+        List[PredictionOuput]: The prediction results including the cluster number, problem title, resulting embeddings, distance to the centroid and runner-up cluster.
+    """
+    with stage_metrics.stage("model_path"):
+        model_path = get_cached_model_path(MODEL_NAME)
+
+    predictions, records = predict_incidents(model_path, incidents, db, force)
+
+    # MLops: Save predictions to database
+    save_predictions(records, db, sync)
+
+    return predictions
+
+
+@app.post("/similar", response_model=List[SimilarIncident])
+def similar(incident: PredictionInput, k: int = 10, n_probe: int = None) -> List[SimilarIncident]:
+    """
+    Returns the past incidents most similar to an incident.
+
+    This endpoint:
+    1. Computes the embedding of the incident.
+    2. Searches the in-memory IVF index of the model, whose lists are the KMeans clusters: only the incidents
+       of the `n_probe` clusters nearest to the incident are compared to it.
+    3. Returns the `k` nearest incidents (training dataset and past predictions), most similar first.
+
+    The index is built from the database in the background when a model version is activated (at warm-up,
+    then on each model switch), and the index of the previous version is searched until the new one is built;
+    new predictions are added to it as they are made.
+
+    Args:
+        incident (PredictionInput): The incident.
+        k (int): Number of similar incidents to return.
+        n_probe (int): Number of clusters scanned. Defaults to SIMILAR_N_PROBE (4).
+
+    Returns:
+        List[SimilarIncident]: The incident numbers of the similar incidents and their squared L2 distance to the incident.
+
+    Raises:
+        HTTPException: 503 if the index is not built yet.
+    """
+    with stage_metrics.stage("model_path"):
+        model_path = get_cached_model_path(MODEL_NAME)
+    try:
+        neighbours = find_similar_incidents(model_path, MODEL_NAME, incident, k=k, n_probe=n_probe)
+    except IndexNotReady as exc:
+        raise HTTPException(status_code=503, detail=str(exc))
+    return [SimilarIncident(incident_number=incident_number, distance=distance) for incident_number, distance in neighbours]
+
+
+def predict_incidents(model_path: str, incidents: List[PredictionInput], db: Session, force: bool = False) -> tuple:
+    """
+    Predicts incidents, reusing the stored predictions of the incidents already predicted from the same inputs.
+
+    This function:
+    1. Computes the input hash of each incident (cleaned text, encoder and model version).
+    2. Unless `force` is set or PREDICTIONS_SHORT_CIRCUIT=false, looks up the stored predictions of the incidents
+       with a single query and reuses those whose input hash matches, without running the inference.
+    3. Predicts the other incidents (a single incident goes through `predict_cluster`, and its micro-batching).
+
+    Args:
+        model_path (str): The URI of the model artifact.
+        incidents (List[PredictionInput]): The incidents to predict.
+        db (Session): SQLAlchemy session object used for the lookup.
+        force (bool): Predicts all the incidents, even those with a matching stored prediction.
+
+    Returns:
+        tuple: The predictions, in the same order as the incidents, and the records of the new predictions to save.
+    """
+    input_hashes = [prediction_input_hash(incident, model_path) for incident in incidents]
+    predictions = [None] * len(incidents)
+
+    if PREDICTIONS_SHORT_CIRCUIT and not force:
+        with stage_metrics.stage("lookup"):
+            stored = find_db_predictions([incident.incident_number for incident in incidents], MODEL_NAME, db)
+        for i, (incident, input_hash) in enumerate(zip(incidents, input_hashes)):
+            row = stored.get(incident.incident_number)
+            if row is not None and row["input_hash"] == input_hash and row["embedding"] is not None:
+                predictions[i] = PredictionOuput(
+                    cluster_number=row["cluster_number"],
+                    problem_title=row["problem_title"],
+                    resulted_embeddings=[decode_embedding(row["embedding"]).tolist()],
+                    centroid_distance=row["centroid_distance"],
+                    runner_up_cluster=row["runner_up_cluster"],
+                    runner_up_distance=row["runner_up_distance"],
+                )
+
+    missing = [i for i, prediction in enumerate(predictions) if prediction is None]
+    stage_metrics.increment("short_circuited_predictions", len(incidents) - len(missing))
+    titles_table = f"{MODEL_NAME}_clusters_title"
+    if len(missing) == 1:
+        new_predictions = [predict_cluster(model_path,incidents[missing[0]],titles_table=titles_table)]
+    else:
+        new_predictions = predict_clusters(model_path,[incidents[i] for i in missing],titles_table=titles_table)
+    for i, prediction in zip(missing, new_predictions):
+        predictions[i] = prediction
+
+    if missing:
+        # New predictions become searchable right away if the similar-incident index is built
+        similar_incidents.add(model_path, [incidents[i].incident_number for i in missing], [predictions[i].resulted_embeddings[0] for i in missing])
+
+    records = [prediction_record(incidents[i], predictions[i], MODEL_NAME, input_hashes[i]) for i in missing]
+    return predictions, records
+
+
+def save_predictions(records: list, db: Session, sync: bool = False) -> None:
+    """
+    Saves prediction records, either synchronously or through the write-behind queue.
+
+    In write-behind mode (PREDICTIONS_WRITE_BEHIND=true) and unless `sync` is set, the records are queued and
+    written by the background worker. Records that cannot be queued because the queue is full are written
+    synchronously.
+
+    Args:
+        records (list): The prediction records.
+        db (Session): SQLAlchemy session object used for synchronous writes.
+        sync (bool): Writes the records before returning.
+    """
+    if PREDICTIONS_WRITE_BEHIND and not sync:
+        records = prediction_writer.submit(records)
+    if records:
+        with stage_metrics.stage("db_write"):
+            create_db_predictions(records, db)
+
+
+def prediction_record(incident: PredictionInput, prediction: PredictionOuput, model_name: str, input_hash: str = None) -> dict:
+    """
+    Builds the row saved in the predictions table for an incident and its prediction.
+
+    Args:
+        incident (PredictionInput): The predicted incident.
+        prediction (PredictionOuput): The prediction of the incident.
+        model_name (str): The name of the model that made the prediction.
+        input_hash (str): The hash of the prediction inputs (see `prediction_input_hash`).
+
+    Returns:
+        dict: The prediction record.
+    """
+    return {
         "incident_number": incident.incident_number,
         "creation_date": incident.creation_date,
         "description": incident.description, 
         "category_full": incident.category_full,
         "ci_name": incident.ci_name, 
         "location_full": incident.location_full,
-        "resulted_embeddings": json.dumps(prediction.resulted_embeddings),
+        "embedding": encode_embedding(prediction.resulted_embeddings),
         "cluster_number": int(prediction.cluster_number),
         "problem_title": prediction.problem_title,
-        "model":model_name
+        "centroid_distance": prediction.centroid_distance,
+        "runner_up_cluster": prediction.runner_up_cluster,
+        "runner_up_distance": prediction.runner_up_distance,
+        "model":model_name,
+        "input_hash": input_hash,
     }
-    
-    create_db_prediction(prediction_dict, db)
 
-    return PredictionOuput(cluster_number=prediction.cluster_number, problem_title=prediction.problem_title,resulted_embeddings=prediction.resulted_embeddings)
\ No newline at end of file
+
+@app.post("/admin/titles/refresh")
+def refresh_titles() -> dict:
+    """
+    Reloads the problem titles of the active model from the database.
+
+    The titles are otherwise kept in memory and only reloaded when the model version changes. This endpoint
+    is meant to be called after the cluster titles table has been updated.
+
+    Returns:
+        dict: The model URI and table the titles belong to, and the number of titles loaded.
+    """
+    titles = cluster_titles.refresh()
+    if titles is None:
+        raise HTTPException(status_code=409, detail="No cluster titles loaded yet")
+    return {"model_uri": cluster_titles.model_uri, "table": cluster_titles.table, "n_titles": len(titles)}
+
+
+@app.get("/admin/embedding-cache")
+def embedding_cache_stats() -> dict:
+    """
+    Returns the hit and miss counters of the embedding cache and the number of embeddings it holds.
+
+    Returns:
+        dict: The embedding cache statistics.
+    """
+    return get_embedding_cache().stats()
+
+
+@app.get("/admin/write-behind")
+def write_behind_metrics() -> dict:
+    """
+    Returns the queue depth and flush latencies of the write-behind prediction writer.
+
+    Returns:
+        dict: The prediction writer metrics.
+    """
+    return {"enabled": PREDICTIONS_WRITE_BEHIND, **prediction_writer.metrics()}
@@ -0,0 +1,191 @@
+import bisect
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class LatencyHistogram:
+    """
+    Cumulative latency histogram of one stage, in the Prometheus format (buckets, sum and count).
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.errors = 0
+
+    def observe(self, seconds, error=False):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+        if error:
+            self.errors += 1
+
+
+class StageMetrics:
+    """
+    Per-stage latency histograms and counters of the inference path, exposed in the Prometheus text format.
+
+    Each stage (model path resolution, model loading, encoding, cluster assignment, title lookup, database
+    write...) is timed with `stage()`. When OpenTelemetry is configured (the `opentelemetry` package is installed
+    and OTEL_EXPORTER_OTLP_ENDPOINT is set), each stage is also recorded as a span. When the metrics are
+    disabled, `stage()` returns a shared no-op context manager.
+
+    Args:
+        enabled (bool): Records the metrics.
+        otel_enabled (bool): Records the stages as OpenTelemetry spans.
+    """
+
+    def __init__(self, enabled=True, otel_enabled=False):
+        self.enabled = enabled
+        self._histograms = {}
+        self._counters = {}
+        self._counter_callbacks = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+        self._tracer = None
+        if enabled and otel_enabled:
+            try:
+                from opentelemetry import trace
+                self._tracer = trace.get_tracer("api_ia")
+            except ImportError:
+                self._tracer = None
+
+    @classmethod
+    def from_env(cls):
+        """
+        Creates the metrics configured from the API_METRICS_ENABLED and OTEL_EXPORTER_OTLP_ENDPOINT environment variables.
+        """
+        return cls(
+            enabled=os.getenv("API_METRICS_ENABLED", "true").lower() == "true",
+            otel_enabled=bool(os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")),
+        )
+
+    def stage(self, name):
+        """
+        Times a stage of the inference path.
+
+        Args:
+            name (str): Name of the stage.
+
+        Returns:
+            A context manager timing the code it wraps.
+        """
+        if not self.enabled:
+            return nullcontext()
+        return self._timed_stage(name)
+
+    @contextmanager
+    def _timed_stage(self, name):
+        span = self._tracer.start_as_current_span(f"api_ia.{name}") if self._tracer is not None else nullcontext()
+        start = time.perf_counter()
+        error = False
+        try:
+            with span:
+                yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                histogram = self._histograms.get(name)
+                if histogram is None:
+                    histogram = self._histograms[name] = LatencyHistogram()
+                histogram.observe(elapsed, error)
+
+    def increment(self, name, value=1):
+        """
+        Increments a counter, e.g. the number of predicted incidents.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def register_gauge(self, name, callback):
+        """
+        Registers a gauge whose value is read from `callback` when the metrics are rendered.
+        """
+        self._gauges[name] = callback
+
+    def register_counter(self, name, callback):
+        """
+        Registers a counter maintained elsewhere (e.g. the embedding cache hits), whose total is read from
+        `callback` when the metrics are rendered. The total must only ever increase.
+        """
+        self._counter_callbacks[name] = callback
+
+    @staticmethod
+    def _read(name, callback):
+        """
+        Reads the value of a metric callback, NaN if it fails, so that one failing metric does not fail the others.
+        """
+        try:
+            return float(callback())
+        except Exception:
+            logger.warning("Metric '%s' could not be read", name, exc_info=True)
+            return float("nan")
+
+    @staticmethod
+    def _format(value):
+        """
+        Formats a metric value, integral values without a decimal point and NaN as Prometheus spells it.
+        """
+        if value != value:
+            return "NaN"
+        return str(int(value)) if float(value).is_integer() else str(value)
+
+    def render_prometheus(self):
+        """
+        Renders every metric in the Prometheus text exposition format.
+
+        Returns:
+            str: The metrics.
+        """
+        lines = []
+        with self._lock:
+            histograms = {name: (list(h.counts), h.sum, h.count, h.errors, h.buckets) for name, h in self._histograms.items()}
+            counters = dict(self._counters)
+
+        if histograms:
+            lines.append("# HELP api_ia_stage_latency_seconds Latency of each stage of the inference path.")
+            lines.append("# TYPE api_ia_stage_latency_seconds histogram")
+            for name, (counts, total, count, _, buckets) in sorted(histograms.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f'api_ia_stage_latency_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'api_ia_stage_latency_seconds_bucket{{stage="{name}",le="+Inf"}} {count}')
+                lines.append(f'api_ia_stage_latency_seconds_sum{{stage="{name}"}} {total}')
+                lines.append(f'api_ia_stage_latency_seconds_count{{stage="{name}"}} {count}')
+            lines.append("# HELP api_ia_stage_errors_total Number of failed calls of each stage.")
+            lines.append("# TYPE api_ia_stage_errors_total counter")
+            for name, (_, _, _, errors, _) in sorted(histograms.items()):
+                lines.append(f'api_ia_stage_errors_total{{stage="{name}"}} {errors}')
+
+        counters.update({name: self._read(name, callback) for name, callback in self._counter_callbacks.items()})
+        for name, value in sorted(counters.items()):
+            lines.append(f"# TYPE api_ia_{name}_total counter")
+            lines.append(f"api_ia_{name}_total {self._format(value)}")
+
+        for name, callback in sorted(self._gauges.items()):
+            lines.append(f"# TYPE api_ia_{name} gauge")
+            lines.append(f"api_ia_{name} {self._format(self._read(name, callback))}")
+
+        return "\n".join(lines) + "\n"
+
+
+stage_metrics = StageMetrics.from_env()
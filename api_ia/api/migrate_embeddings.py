@@ -0,0 +1,57 @@
+from sqlalchemy import select, update, bindparam
+from api_ia.api.database import DBpredictions, get_engine
+from api_ia.api.migrations import add_embedding_column
+from api_ia.embeddings.codec import encode_embedding, decode_embedding
+
+
+def migrate_embeddings(engine, batch_size=1000, dtype=None):
+    """
+    Converts the JSON text embeddings of the predictions table into the binary format.
+
+    This function:
+    1. Adds the `embedding` column if needed.
+    2. Reads the rows that still only have a JSON embedding, `batch_size` rows at a time.
+    3. Writes their binary embedding and clears the JSON text, one transaction per batch.
+
+    The migration can be interrupted and run again: rows already migrated are skipped.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): Engine connected to the database holding the predictions table.
+        batch_size (int): Number of rows converted per transaction.
+        dtype (str): 'float32' or 'float16'. Defaults to the EMBEDDING_STORAGE_DTYPE environment variable.
+
+    Returns:
+        int: The number of migrated rows.
+    """
+    add_embedding_column(engine)
+
+    table = DBpredictions.__table__
+    pending = (
+        select(table.c.prediction_id, table.c.resulted_embeddings)
+        .where(table.c.embedding.is_(None), table.c.resulted_embeddings.is_not(None))
+        .limit(batch_size)
+    )
+    migrate_row = (
+        update(table)
+        .where(table.c.prediction_id == bindparam("row_id"))
+        .values(embedding=bindparam("row_embedding"), resulted_embeddings=None)
+    )
+
+    n_migrated = 0
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(pending).all()
+            if not rows:
+                break
+            connection.execute(migrate_row, [
+                {"row_id": prediction_id, "row_embedding": encode_embedding(decode_embedding(json_embedding), dtype)}
+                for prediction_id, json_embedding in rows
+            ])
+        n_migrated += len(rows)
+        print(f"{n_migrated} predictions migrated")
+
+    return n_migrated
+
+
+if __name__ == "__main__":
+    migrate_embeddings(get_engine())
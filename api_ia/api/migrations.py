@@ -0,0 +1,125 @@
+import logging
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import DBAPIError
+from api_ia.api.database import DBpredictions
+
+logger = logging.getLogger(__name__)
+
+
+def add_column(engine, name):
+    """
+    Adds a column of the `DBpredictions` model to the predictions table if it does not exist yet.
+
+    Another API instance warming up at the same time may add the column first: the error of the second
+    ALTER TABLE is then ignored.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): Engine connected to the database holding the predictions table.
+        name (str): The name of the column.
+
+    Returns:
+        bool: True if the column was added, False if it already existed.
+    """
+    def exists():
+        return name in [column["name"] for column in inspect(engine).get_columns(DBpredictions.__tablename__)]
+
+    if exists():
+        return False
+    column_type = DBpredictions.__table__.c[name].type.compile(dialect=engine.dialect)
+    # SQL Server does not accept the COLUMN keyword in ALTER TABLE ... ADD
+    add_keyword = "ADD" if engine.dialect.name == "mssql" else "ADD COLUMN"
+    try:
+        with engine.begin() as connection:
+            connection.execute(text(f"ALTER TABLE {DBpredictions.__tablename__} {add_keyword} {name} {column_type} NULL"))
+    except DBAPIError:
+        if not exists():
+            raise
+        return False
+    return True
+
+
+def add_index(engine, name):
+    """
+    Creates an index of the `DBpredictions` model on the predictions table if it does not exist yet.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): Engine connected to the database holding the predictions table.
+        name (str): The name of the index.
+
+    Returns:
+        bool: True if the index was created, False if it already existed.
+    """
+    def exists():
+        return name in [index["name"] for index in inspect(engine).get_indexes(DBpredictions.__tablename__)]
+
+    if exists():
+        return False
+    index = next(index for index in DBpredictions.__table__.indexes if index.name == name)
+    try:
+        index.create(engine)
+    except DBAPIError:
+        if not exists():
+            raise
+        return False
+    return True
+
+
+def add_embedding_column(engine):
+    """
+    Adds the binary `embedding` column of the predictions (see `migrate_embeddings.py` for the conversion of
+    the JSON embeddings of the existing rows).
+    """
+    return add_column(engine, "embedding")
+
+
+def add_lookup_index(engine):
+    """
+    Adds the `input_hash` column and the index used to look up the stored predictions of an incident.
+    """
+    added = add_column(engine, "input_hash")
+    return add_index(engine, "ix_predictions_lookup") or added
+
+
+def add_assignment_confidence_columns(engine):
+    """
+    Adds the distance to the centroid and the runner-up cluster columns of the predictions.
+    """
+    added = [add_column(engine, name) for name in ("centroid_distance", "runner_up_cluster", "runner_up_distance")]
+    return any(added)
+
+
+# Changes made to the predictions table after its creation, in order. `create_all` does not alter an existing
+# table, so they are applied by `migrate_predictions_table`; each of them does nothing once applied.
+PREDICTIONS_MIGRATIONS = [
+    ("embedding", add_embedding_column),
+    ("lookup_index", add_lookup_index),
+    ("assignment_confidence", add_assignment_confidence_columns),
+]
+
+
+def migrate_predictions_table(engine):
+    """
+    Brings an existing predictions table up to date with the `DBpredictions` model.
+
+    Called when the API warms up (see `init_db`), before any prediction is read or written, and safe to run
+    on every start.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): Engine connected to the database holding the predictions table.
+
+    Returns:
+        list: The names of the migrations that changed the table.
+    """
+    applied = []
+    for name, migration in PREDICTIONS_MIGRATIONS:
+        if migration(engine):
+            logger.info("Predictions table migration '%s' applied", name)
+            applied.append(name)
+    return applied
+
+
+if __name__ == "__main__":
+    from api_ia.api.database import get_engine
+
+    logging.basicConfig(level=logging.INFO)
+    migrate_predictions_table(get_engine())
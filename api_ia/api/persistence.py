@@ -0,0 +1,178 @@
+import logging
+import os
+import queue
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class PredictionWriter:
+    """
+    Write-behind queue for predictions, so that the database write latency is not part of the response time.
+
+    Prediction records are put in a bounded in-process queue and a background worker writes them in batches,
+    as soon as `batch_size` records are waiting or `flush_interval` seconds have passed. `stop()` flushes what
+    is left in the queue. A batch that fails is retried `max_retries` times, then dropped and counted.
+
+    Args:
+        write_batch (callable): Function writing a list of prediction records to the database.
+        max_queue_size (int): Maximum number of records waiting in the queue.
+        batch_size (int): Maximum number of records written per batch.
+        flush_interval (float): Maximum number of seconds a record waits before being written.
+        max_retries (int): Number of times a failed batch is retried.
+    """
+
+    def __init__(self, write_batch, max_queue_size=10000, batch_size=500, flush_interval=1.0, max_retries=3):
+        self._write_batch = write_batch
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.written = 0
+        self.failed = 0
+        self.flushes = 0
+        self.last_flush_seconds = 0.0
+        self.total_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+
+    @classmethod
+    def from_env(cls, write_batch):
+        """
+        Creates a writer configured from the PREDICTIONS_QUEUE_SIZE, PREDICTIONS_FLUSH_SIZE and
+        PREDICTIONS_FLUSH_INTERVAL environment variables.
+        """
+        return cls(
+            write_batch,
+            max_queue_size=int(os.getenv("PREDICTIONS_QUEUE_SIZE", 10000)),
+            batch_size=int(os.getenv("PREDICTIONS_FLUSH_SIZE", 500)),
+            flush_interval=float(os.getenv("PREDICTIONS_FLUSH_INTERVAL", 1.0)),
+        )
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """
+        Starts the background worker.
+
+        Returns:
+            PredictionWriter: The writer itself.
+        """
+        if not self.is_running:
+            self._thread = threading.Thread(target=self._run, name="prediction-writer", daemon=True)
+            self._thread.start()
+        return self
+
+    def submit(self, records, timeout=0.1):
+        """
+        Queues prediction records to be written in the background.
+
+        Args:
+            records (list): The prediction records.
+            timeout (float): Maximum number of seconds to wait for room in the queue, per record.
+
+        Returns:
+            list: The records that could not be queued, because the writer is not running or the queue stayed
+                full. The caller is expected to write them synchronously.
+        """
+        if not self.is_running:
+            return list(records)
+        for i, record in enumerate(records):
+            try:
+                self._queue.put(record, timeout=timeout)
+            except queue.Full:
+                return list(records[i:])
+        return []
+
+    def stop(self, timeout=30):
+        """
+        Stops the background worker after writing every queued record.
+
+        Args:
+            timeout (float): Maximum number of seconds to wait for the worker.
+        """
+        if not self.is_running:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    record = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if record is _STOP:
+                    stopping = True
+                    break
+                batch.append(record)
+            if batch:
+                self._flush(batch)
+
+        # Records queued after the stop marker
+        batch = []
+        while True:
+            try:
+                record = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if record is not _STOP:
+                batch.append(record)
+        for i in range(0, len(batch), self.batch_size):
+            self._flush(batch[i:i + self.batch_size])
+
+    def _flush(self, batch):
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            try:
+                self._write_batch(batch)
+            except Exception:
+                logger.warning("Failed to write %d predictions (attempt %d)", len(batch), attempt + 1, exc_info=True)
+                continue
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.written += len(batch)
+                self.flushes += 1
+                self.last_flush_seconds = elapsed
+                self.total_flush_seconds += elapsed
+                self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+            return
+        logger.error("Dropping %d predictions after %d failed attempts", len(batch), self.max_retries + 1)
+        with self._lock:
+            self.failed += len(batch)
+
+    def metrics(self):
+        """
+        Returns the queue depth and the flush counters and latencies.
+
+        Returns:
+            dict: The writer metrics.
+        """
+        with self._lock:
+            return {
+                "running": self.is_running,
+                "queue_depth": self._queue.qsize(),
+                "written": self.written,
+                "failed": self.failed,
+                "flushes": self.flushes,
+                "last_flush_seconds": self.last_flush_seconds,
+                "mean_flush_seconds": self.total_flush_seconds / self.flushes if self.flushes else 0.0,
+                "max_flush_seconds": self.max_flush_seconds,
+            }
@@ -0,0 +1,136 @@
+import threading
+from api_ia.clustering_model.centroids import CentroidAssigner, load_centroids
+
+
+def load_assignment_model(model_uri):
+    """
+    Loads the NumPy cluster assignment engine of a model.
+
+    The centroid artifact logged next to the model (`<model_uri>_centroids`) is used when it exists. Runs logged
+    before it existed fall back to the `cluster_centers_` of the sklearn model.
+
+    Args:
+        model_uri (str): The URI of the model artifact (e.g. 'azureml://.../kmeans_40').
+
+    Returns:
+        CentroidAssigner: The assignment engine of the model.
+    """
+    import mlflow
+    from mlflow.exceptions import MlflowException
+
+    try:
+        local_path = mlflow.artifacts.download_artifacts(artifact_uri=model_uri + "_centroids")
+        return load_centroids(local_path)
+    except (MlflowException, OSError):
+        model = mlflow.sklearn.load_model(model_uri)
+        return CentroidAssigner(model.cluster_centers_, metadata={"source": model_uri})
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of loaded models, keyed by model URI.
+
+    Each model version is loaded only once and kept in memory, so the `/predict` endpoint no longer
+    fetches and unpickles the artifact on every call. A new version can be loaded in the background
+    and then made active with a single reference swap: requests already running keep the model
+    object they started with, new requests get the new one.
+
+    Args:
+        loader (callable): Function taking a model URI and returning a loaded model. Defaults to `load_assignment_model`.
+    """
+
+    def __init__(self, loader=load_assignment_model):
+        self._loader = loader
+        self._models = {}
+        self._load_locks = {}
+        self._lock = threading.Lock()
+        # (model_uri, model) tuple, replaced as a whole so readers always see a consistent pair
+        self._active = None
+        # URI of the model active before the last switch, kept in the cache until the following switch
+        self._previous_uri = None
+
+    def get(self, model_uri):
+        """
+        Returns the model for the given URI, loading it on first use.
+
+        Concurrent callers asking for the same URI wait for a single load instead of each loading the artifact.
+
+        Args:
+            model_uri (str): The URI of the model artifact.
+
+        Returns:
+            The loaded model.
+        """
+        model = self._models.get(model_uri)
+        if model is not None:
+            return model
+
+        with self._lock:
+            load_lock = self._load_locks.setdefault(model_uri, threading.Lock())
+
+        with load_lock:
+            model = self._models.get(model_uri)
+            if model is None:
+                model = self._loader(model_uri)
+                self._models[model_uri] = model
+        return model
+
+    def activate(self, model_uri):
+        """
+        Loads the given model version if needed and makes it the active one.
+
+        The switch is atomic. The previously active model stays in the cache until the following switch, so
+        requests still holding its URI do not reload it; older models are dropped from the cache, and requests
+        still holding a reference to them finish normally.
+
+        Args:
+            model_uri (str): The URI of the model artifact to activate.
+
+        Returns:
+            The newly active model.
+        """
+        model = self.get(model_uri)
+        with self._lock:
+            previous = self._active
+            if previous is not None and previous[0] != model_uri:
+                self._previous_uri = previous[0]
+            self._active = (model_uri, model)
+            for uri in list(self._models):
+                if uri not in (model_uri, self._previous_uri):
+                    self._models.pop(uri, None)
+                    self._load_locks.pop(uri, None)
+        return model
+
+    def activate_in_background(self, model_uri):
+        """
+        Loads and activates a model version in a daemon thread, without blocking the caller.
+
+        Args:
+            model_uri (str): The URI of the model artifact to activate.
+
+        Returns:
+            threading.Thread: The started thread.
+        """
+        thread = threading.Thread(target=self.activate, args=(model_uri,), daemon=True)
+        thread.start()
+        return thread
+
+    @property
+    def active(self):
+        """
+        Returns the active `(model_uri, model)` pair, or None if no model has been activated yet.
+        """
+        return self._active
+
+    def clear(self):
+        """
+        Drops every cached model and the active model.
+        """
+        with self._lock:
+            self._models.clear()
+            self._load_locks.clear()
+            self._active = None
+            self._previous_uri = None
+
+
+model_registry = ModelRegistry()
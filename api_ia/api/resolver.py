@@ -0,0 +1,103 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ModelPathResolver:
+    """
+    Caches the model URI resolved from MLflow and refreshes it in the background.
+
+    The best run is resolved once and its URI cached for `ttl` seconds. Once the TTL has expired, the next
+    call still returns the cached URI immediately and starts a single background refresh. If MLflow is slow
+    or unreachable, the last known good URI keeps being served and the refresh is retried after
+    `retry_interval` seconds. Only the very first resolution, when nothing is cached yet, is synchronous.
+
+    Args:
+        resolve (callable): Function without arguments returning the current model URI.
+        ttl (float): Number of seconds a resolved URI is considered fresh.
+        retry_interval (float): Number of seconds to wait before retrying a failed refresh.
+        on_change (callable): Optional function called with the new URI, from the refresh thread, before the
+            new URI is served (e.g. to load the new model version).
+    """
+
+    def __init__(self, resolve, ttl=600, retry_interval=30, on_change=None, clock=time.monotonic):
+        self._resolve = resolve
+        self.ttl = ttl
+        self.retry_interval = retry_interval
+        self._on_change = on_change
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._refreshing = False
+        # (model_uri, next_refresh_at) tuple, replaced as a whole
+        self._state = None
+
+    def get(self):
+        """
+        Returns the cached model URI, starting a background refresh if it is stale.
+
+        Returns:
+            str: The model URI.
+
+        Raises:
+            Exception: If nothing is cached yet and the first resolution fails.
+        """
+        state = self._state
+        if state is None:
+            with self._lock:
+                if self._state is None:
+                    model_uri = self._resolve()
+                    if self._on_change is not None:
+                        self._on_change(model_uri)
+                    self._state = (model_uri, self._clock() + self.ttl)
+            return self._state[0]
+
+        model_uri, next_refresh_at = state
+        if self._clock() >= next_refresh_at:
+            self.refresh_in_background()
+        return model_uri
+
+    def refresh_in_background(self):
+        """
+        Starts a background refresh, unless one is already running.
+
+        Returns:
+            threading.Thread: The started thread, or None if a refresh was already running.
+        """
+        with self._lock:
+            if self._refreshing:
+                return None
+            self._refreshing = True
+        thread = threading.Thread(target=self.refresh, daemon=True)
+        thread.start()
+        return thread
+
+    def refresh(self):
+        """
+        Resolves the model URI again and publishes it, keeping the previous URI if the resolution fails.
+
+        Returns:
+            str: The model URI served after the refresh.
+        """
+        previous = self._state
+        try:
+            model_uri = self._resolve()
+            if self._on_change is not None and (previous is None or previous[0] != model_uri):
+                self._on_change(model_uri)
+            self._state = (model_uri, self._clock() + self.ttl)
+        except Exception:
+            logger.warning("Model URI refresh failed, keeping the last known URI", exc_info=True)
+            if previous is not None:
+                self._state = (previous[0], self._clock() + self.retry_interval)
+        finally:
+            with self._lock:
+                self._refreshing = False
+        return self._state[0] if self._state is not None else None
+
+    @property
+    def model_uri(self):
+        """
+        Returns the cached model URI without triggering any resolution, or None if nothing is cached.
+        """
+        return self._state[0] if self._state is not None else None
@@ -0,0 +1,152 @@
+import logging
+import os
+import threading
+from dotenv import load_dotenv
+from api_ia.clustering_model.ivf import IVFIndex
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+class IndexNotReady(RuntimeError):
+    """
+    Raised when no similar-incident index is built yet.
+    """
+
+
+class SimilarIncidentIndex:
+    """
+    IVF index of the past incidents of the active clustering model, used to find similar incidents.
+
+    The index is built in the background when a model version is activated, from the incidents returned by
+    `loader` (training dataset and past predictions), with the centroids of the model as coarse lists. Until
+    the index of a new version is published, searches keep using the index of the previous version, so no
+    request waits for the database. New predictions are added to it incrementally, including those made while
+    it is being built.
+
+    Args:
+        loader (callable): Function taking a model run name and returning the (incident numbers, embedding matrix) to index.
+        dtype (str): Storage type of the vectors, 'float32' or 'int8'.
+        n_probe (int): Default number of lists scanned per query.
+    """
+
+    def __init__(self, loader, dtype="float32", n_probe=4):
+        self._loader = loader
+        self.dtype = dtype
+        self.n_probe = n_probe
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        # (model_uri, index) tuple, replaced as a whole on each rebuild
+        self._state = (None, None)
+        # URI of the index being built, and the predictions it will be given once built
+        self._building = None
+        self._pending = []
+
+    @classmethod
+    def from_env(cls, loader):
+        """
+        Creates the index configured from the SIMILAR_INDEX_DTYPE and SIMILAR_N_PROBE environment variables.
+        """
+        return cls(
+            loader,
+            dtype=os.getenv("SIMILAR_INDEX_DTYPE", "float32"),
+            n_probe=int(os.getenv("SIMILAR_N_PROBE", 4)),
+        )
+
+    def build(self, model_uri, model_run, cluster_centers):
+        """
+        Builds the index of the given model version and publishes it, unless it is already built.
+
+        Args:
+            model_uri (str): The URI of the model.
+            model_run (str): The name of the model run, used to find its training dataset.
+            cluster_centers (np.ndarray): The centroid matrix of the model.
+
+        Returns:
+            IVFIndex: The index.
+        """
+        with self._build_lock:
+            current_uri, index = self._state
+            if index is not None and current_uri == model_uri:
+                return index
+            with self._lock:
+                if self._building != model_uri:
+                    self._building, self._pending = model_uri, []
+            try:
+                index = IVFIndex(cluster_centers, dtype=self.dtype)
+                incident_numbers, embeddings = self._loader(model_run)
+                index.add(incident_numbers, embeddings)
+                with self._lock:
+                    for pending_numbers, pending_embeddings in self._pending:
+                        index.add(pending_numbers, pending_embeddings)
+                    self._state = (model_uri, index)
+            finally:
+                with self._lock:
+                    self._building, self._pending = None, []
+        logger.info("Similar-incident index of %s built with %d incidents", model_uri, len(index))
+        return index
+
+    def build_in_background(self, model_uri, model_run, cluster_centers):
+        """
+        Builds the index of the given model version in a daemon thread, unless it is built or being built.
+
+        Returns:
+            threading.Thread: The started thread, or None if there was nothing to start.
+        """
+        with self._lock:
+            if self._building is not None or self._state[0] == model_uri:
+                return None
+            self._building = model_uri
+
+        def build():
+            try:
+                self.build(model_uri, model_run, cluster_centers)
+            except Exception:
+                logger.warning("Similar-incident index build failed", exc_info=True)
+
+        thread = threading.Thread(target=build, name="similar-index", daemon=True)
+        thread.start()
+        return thread
+
+    def add(self, model_uri, incident_numbers, embeddings):
+        """
+        Adds new predictions to the index if it is built, or being built, for the given model version. Does
+        nothing otherwise: they are read from the database when the index is built.
+
+        Args:
+            model_uri (str): The URI of the model that made the predictions.
+            incident_numbers (list): The incident numbers.
+            embeddings (array-like): The embedding matrix of the incidents, in the same order.
+        """
+        with self._lock:
+            current_uri, index = self._state
+            if index is not None and current_uri == model_uri:
+                index.add(incident_numbers, embeddings)
+            elif self._building == model_uri:
+                self._pending.append((list(incident_numbers), embeddings))
+
+    def search(self, model_uri, model_run, cluster_centers, query, k=10, n_probe=None):
+        """
+        Finds the past incidents nearest to a query embedding.
+
+        If the index of the given model version is not built, its build is started in the background and the
+        index of the previous version is searched meanwhile.
+
+        Returns:
+            list: Up to `k` (incident number, squared L2 distance) pairs, nearest first.
+
+        Raises:
+            IndexNotReady: If no index is built yet.
+        """
+        current_uri, index = self._state
+        if current_uri != model_uri:
+            self.build_in_background(model_uri, model_run, cluster_centers)
+        if index is None:
+            raise IndexNotReady("The similar-incident index is being built")
+        return index.search(query, k=k, n_probe=n_probe or self.n_probe)
+
+    @property
+    def size(self):
+        index = self._state[1]
+        return len(index) if index is not None else 0
@@ -0,0 +1,82 @@
+import threading
+from concurrent.futures import TimeoutError
+import pytest
+from api_ia.api.batcher import MicroBatcher
+
+
+def test_concurrent_submits_are_batched():
+    """
+    Test that concurrent calls are processed together and that each caller gets its own result.
+    """
+    batches = []
+
+    def process_batch(items):
+        batches.append(list(items))
+        return [item * 10 for item in items]
+
+    batcher = MicroBatcher(process_batch, max_batch_size=8, max_wait_ms=200)
+    results = {}
+
+    def call(i):
+        results[i] = batcher.submit(i)
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == {i: i * 10 for i in range(8)}
+    assert len(batches) < 8
+    assert batcher.stats()["items"] == 8
+
+
+def test_batch_errors_are_raised_to_callers():
+    """
+    Test that an exception raised while processing a batch is raised to its callers.
+    """
+    def process_batch(items):
+        raise RuntimeError("encoder failure")
+
+    batcher = MicroBatcher(process_batch, max_wait_ms=1)
+    with pytest.raises(RuntimeError):
+        batcher.submit(1, timeout=5)
+
+
+def test_missing_results_fail_their_callers():
+    """
+    Test that callers fail instead of hanging when process_batch returns fewer results than items, and that
+    a caller giving up drops its item.
+    """
+    batcher = MicroBatcher(lambda items: items[:-1], max_batch_size=2, max_wait_ms=200)
+    errors = []
+
+    def call(i):
+        try:
+            batcher.submit(i, timeout=5)
+        except RuntimeError as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(errors) == 2
+
+    release = threading.Event()
+    processed = []
+
+    def slow_batch(items):
+        processed.extend(items)
+        release.wait(5)
+        return items
+
+    slow = MicroBatcher(slow_batch, max_batch_size=1, max_wait_ms=1, timeout=0.05)
+    with pytest.raises(TimeoutError):
+        slow.submit("running")
+    with pytest.raises(TimeoutError):
+        slow.submit("queued")
+    release.set()
+    assert slow.submit("next", timeout=5) == "next"
+    assert processed == ["running", "next"]
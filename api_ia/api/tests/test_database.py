@@ -1,7 +1,11 @@
-from sqlalchemy import create_engine, StaticPool
+from sqlalchemy import create_engine, StaticPool, inspect, text
 from sqlalchemy.orm import sessionmaker, Session
-from api_ia.api.database import Base, create_db_prediction, DBpredictions
+from api_ia.api.database import Base, create_db_prediction, create_db_predictions, find_db_predictions, DBpredictions
+from api_ia.api.migrate_embeddings import migrate_embeddings
+from api_ia.api.migrations import migrate_predictions_table
+from api_ia.embeddings.codec import encode_embedding, decode_embedding
 from typing import Generator
+import numpy as np
 import pytest
 
 
@@ -43,4 +47,93 @@ def test_create_prediction(session:Session) -> None:
     assert prediction_in_db.description == "description test"
     assert prediction_in_db.cluster_number == 4
     assert prediction_in_db.problem_title == "example title"
-    assert prediction_in_db.model == "test_model"
\ No newline at end of file
+    assert prediction_in_db.model == "test_model"
+
+
+def test_create_predictions(session:Session) -> None: 
+    create_db_prediction({"incident_number": "inc1", "cluster_number": 1, "problem_title": "old title", "model": "test_model"}, session)
+
+    mock_predictions = [
+        {"incident_number": "inc1", "cluster_number": 2, "problem_title": "new title", "model": "test_model"},
+        {"incident_number": "inc2", "cluster_number": 3, "problem_title": "title 3", "model": "test_model"},
+        {"incident_number": "inc3", "cluster_number": 4, "problem_title": "title 4", "model": "test_model"},
+    ]
+
+    n_predictions = create_db_predictions(mock_predictions, session)
+
+    assert n_predictions == 3
+    assert session.query(DBpredictions).count() == 3
+    updated_prediction = session.query(DBpredictions).filter(DBpredictions.incident_number == "inc1").first()
+    assert updated_prediction.cluster_number == 2
+    assert updated_prediction.problem_title == "new title"
+
+
+def test_embedding_codec() -> None:
+    embedding = [[0.1, -0.2, 0.3]]
+
+    encoded = encode_embedding(embedding)
+    encoded_half = encode_embedding(embedding, dtype="float16")
+
+    assert len(encoded) == 2 + 3 * 4
+    assert len(encoded_half) == 2 + 3 * 2
+    assert np.allclose(decode_embedding(encoded), [0.1, -0.2, 0.3])
+    assert np.allclose(decode_embedding(encoded_half), [0.1, -0.2, 0.3], atol=1e-3)
+    # Legacy JSON text is still readable
+    assert np.allclose(decode_embedding("[[0.1, -0.2, 0.3]]"), [0.1, -0.2, 0.3])
+
+
+def test_migrate_embeddings(session:Session) -> None: 
+    create_db_predictions([
+        {"incident_number": "inc1", "resulted_embeddings": "[[0.1, 0.2]]", "model": "test_model"},
+        {"incident_number": "inc2", "resulted_embeddings": "[[0.3, 0.4]]", "model": "test_model"},
+        {"incident_number": "inc3", "embedding": encode_embedding([0.5, 0.6]), "model": "test_model"},
+    ], session)
+
+    n_migrated = migrate_embeddings(session.get_bind(), batch_size=1)
+    session.expire_all()
+
+    assert n_migrated == 2
+    migrated_prediction = session.query(DBpredictions).filter(DBpredictions.incident_number == "inc2").first()
+    assert migrated_prediction.resulted_embeddings is None
+    assert np.allclose(decode_embedding(migrated_prediction.embedding), [0.3, 0.4])
+    assert migrate_embeddings(session.get_bind()) == 0
+
+
+def test_migrate_predictions_table() -> None: 
+    engine = create_engine("sqlite:///:memory:", connect_args={"check_same_thread":False}, poolclass=StaticPool)
+    # Predictions table as created before the binary embeddings
+    with engine.begin() as connection:
+        connection.execute(text(
+            "CREATE TABLE predictions (prediction_id VARCHAR(255) PRIMARY KEY, incident_number VARCHAR(250) UNIQUE, creation_date VARCHAR, "
+            "description VARCHAR, category_full VARCHAR, ci_name VARCHAR, location_full VARCHAR, resulted_embeddings TEXT, "
+            "cluster_number INTEGER, problem_title VARCHAR, model VARCHAR(50))"
+        ))
+
+    assert migrate_predictions_table(engine) == ["embedding", "lookup_index", "assignment_confidence"]
+    assert migrate_predictions_table(engine) == []
+
+    columns = {column["name"] for column in inspect(engine).get_columns("predictions")}
+    assert {"embedding", "input_hash", "centroid_distance", "runner_up_cluster", "runner_up_distance"} <= columns
+    assert "ix_predictions_lookup" in [index["name"] for index in inspect(engine).get_indexes("predictions")]
+    with sessionmaker(bind=engine)() as db:
+        create_db_predictions([{"incident_number": "inc1", "model": "test_model", "input_hash": "hash1", "centroid_distance": 0.5}], db)
+        assert len(find_db_predictions(["inc1"], "test_model", db)) == 1
+
+
+def test_find_predictions(session:Session) -> None: 
+    create_db_predictions([
+        {"incident_number": f"inc{i}", "cluster_number": i, "problem_title": f"title {i}", "model": "test_model", "input_hash": f"hash{i}",
+         "centroid_distance": 0.5, "runner_up_cluster": i + 1, "runner_up_distance": 0.75}
+        for i in range(3000)
+    ] + [{"incident_number": "other", "cluster_number": 1, "problem_title": "title", "model": "other_model", "input_hash": "hash"}], session)
+
+    stored = find_db_predictions([f"inc{i}" for i in range(2500)] + ["inc1", "other", "unknown"], "test_model", session)
+
+    assert len(stored) == 2500
+    assert stored["inc42"]["cluster_number"] == 42
+    assert stored["inc42"]["problem_title"] == "title 42"
+    assert stored["inc42"]["input_hash"] == "hash42"
+    assert stored["inc42"]["runner_up_cluster"] == 43
+    assert stored["inc42"]["runner_up_distance"] == 0.75
+    assert "other" not in stored
+    assert find_db_predictions([], "test_model", session) == {}
@@ -0,0 +1,72 @@
+import numpy as np
+from api_ia.api.embedding_cache import EmbeddingCache, DiskEmbeddingStore
+from api_ia.embeddings.keys import embedding_key
+
+
+def fake_encode(calls):
+    def encode(docs):
+        calls.append(list(docs))
+        return np.array([[len(doc), 1.0, 2.0] for doc in docs], dtype=np.float32)
+    return encode
+
+
+def test_embedding_key_normalizes_whitespace():
+    """
+    Test that the cache key ignores whitespace differences but depends on the encoder model.
+    """
+    assert embedding_key("host  restarted\n", "model") == embedding_key("host restarted", "model")
+    assert embedding_key("host restarted", "model") != embedding_key("host restarted", "other_model")
+
+
+def test_cache_skips_encoding_of_known_docs():
+    """
+    Test that only unseen documents are encoded, once each, and that hits and misses are counted.
+    """
+    calls = []
+    cache = EmbeddingCache("model", max_entries=10)
+
+    first = cache.encode(["a", "bb", "a"], fake_encode(calls))
+    second = cache.encode(["bb", "ccc"], fake_encode(calls))
+
+    assert calls == [["a", "bb"], ["ccc"]]
+    assert first.dtype == np.float32
+    assert first[:, 0].tolist() == [1, 2, 1]
+    assert second[:, 0].tolist() == [2, 3]
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 3
+
+
+def test_memory_tier_is_bounded_and_disk_tier_survives_restart(tmp_path):
+    """
+    Test that the LRU evicts old entries and that the on-disk tier is reloaded by a new cache.
+    """
+    calls = []
+    cache = EmbeddingCache("model", max_entries=1, disk_path=str(tmp_path))
+    cache.encode(["a", "bb"], fake_encode(calls))
+    assert cache.stats()["memory_entries"] == 1
+    assert cache.stats()["disk_entries"] == 2
+
+    restarted = EmbeddingCache("model", max_entries=1, disk_path=str(tmp_path))
+    embeddings = restarted.encode(["bb", "a"], fake_encode(calls))
+
+    assert calls == [["a", "bb"]]
+    assert embeddings[:, 0].tolist() == [2, 1]
+    assert restarted.stats()["hits"] == 2
+
+
+def test_disk_store_drops_orphan_vector_after_crash(tmp_path):
+    """
+    Test that a vector written without its key (crash between the two writes) is dropped on reopening,
+    so that the next embedding stored is read back at the right row.
+    """
+    store = DiskEmbeddingStore(str(tmp_path))
+    store.put("a", [1.0, 1.0])
+    with open(tmp_path / "vectors.f32", "ab") as f:
+        f.write(np.array([9.0, 9.0], dtype=np.float32).tobytes())
+
+    reopened = DiskEmbeddingStore(str(tmp_path))
+    reopened.put("b", [2.0, 2.0])
+
+    assert reopened.get("a").tolist() == [1.0, 1.0]
+    assert reopened.get("b").tolist() == [2.0, 2.0]
+    assert DiskEmbeddingStore(str(tmp_path)).get("b").tolist() == [2.0, 2.0]
@@ -0,0 +1,45 @@
+import os
+import subprocess
+import sys
+
+# Budget (in seconds) of the cumulative `python -X importtime` cost of api_ia.api.main. The default leaves a wide
+# margin over the ~0.8 s measured on a developer machine, so that slow CI runners do not fail it; a runner
+# with known timings can tighten it (e.g. IMPORT_TIME_BUDGET_SECONDS=1.5).
+IMPORT_TIME_BUDGET_SECONDS = float(os.getenv("IMPORT_TIME_BUDGET_SECONDS", 5))
+# Dependencies only needed on first use (model loading, MLflow, SQL Server driver, training)
+LAZY_MODULES = ("pandas", "mlflow", "torch", "sentence_transformers", "langchain_openai", "pyodbc", "sklearn")
+
+_CHECK_LAZY_MODULES = f"""
+import sys
+import api_ia.api.main
+print(",".join(module for module in {LAZY_MODULES!r} if module in sys.modules))
+"""
+
+
+def _import_main():
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _CHECK_LAZY_MODULES],
+        capture_output=True, text=True, check=True,
+    )
+    cumulative_us = None
+    for line in result.stderr.splitlines():
+        fields = line.split("|")
+        if len(fields) == 3 and fields[2].strip() == "api_ia.api.main":
+            cumulative_us = int(fields[1])
+    return cumulative_us / 1e6, result.stdout.strip()
+
+
+def test_main_does_not_import_heavy_dependencies():
+    """
+    Test that importing the API loads no heavy or optional dependency (they are imported on first use).
+    """
+    _, imported = _import_main()
+    assert imported == ""
+
+
+def test_main_import_time_budget():
+    """
+    Test that the `python -X importtime` cost of api_ia.api.main stays within IMPORT_TIME_BUDGET_SECONDS (best of 3 runs).
+    """
+    import_time = min(_import_main()[0] for _ in range(3))
+    assert import_time < IMPORT_TIME_BUDGET_SECONDS, f"api_ia.api.main imports in {import_time:.3f} s"
@@ -0,0 +1,56 @@
+import pytest
+from api_ia.api.metrics import StageMetrics
+
+
+def test_stages_are_rendered_as_prometheus_histograms():
+    """
+    Test that each timed stage produces cumulative buckets, a sum and a count, and that failures are counted.
+    """
+    metrics = StageMetrics(enabled=True)
+    with metrics.stage("encode"):
+        pass
+    with metrics.stage("encode"):
+        pass
+    with pytest.raises(RuntimeError):
+        with metrics.stage("db_write"):
+            raise RuntimeError("database down")
+    metrics.increment("predicted_incidents", 3)
+    metrics.register_gauge("queue_depth", lambda: 7)
+
+    text = metrics.render_prometheus()
+
+    assert 'api_ia_stage_latency_seconds_count{stage="encode"} 2' in text
+    assert 'api_ia_stage_latency_seconds_bucket{stage="encode",le="+Inf"} 2' in text
+    assert 'api_ia_stage_errors_total{stage="db_write"} 1' in text
+    assert 'api_ia_stage_errors_total{stage="encode"} 0' in text
+    assert "api_ia_predicted_incidents_total 3" in text
+    assert "api_ia_queue_depth 7" in text
+
+
+def test_disabled_metrics_record_nothing():
+    """
+    Test that disabled metrics return a no-op context manager and render no stage.
+    """
+    metrics = StageMetrics(enabled=False)
+    with metrics.stage("encode"):
+        pass
+    metrics.increment("predicted_incidents")
+
+    assert "api_ia_stage_latency_seconds" not in metrics.render_prometheus()
+
+
+def test_callback_metrics_are_typed_and_guarded():
+    """
+    Test that callback counters are rendered as counters, and that a failing callback renders NaN instead of
+    failing the whole rendering.
+    """
+    metrics = StageMetrics(enabled=True)
+    metrics.register_counter("embedding_cache_hits", lambda: 12)
+    metrics.register_gauge("similar_index_size", lambda: 1 / 0)
+    metrics.register_gauge("queue_depth", lambda: 2.5)
+
+    text = metrics.render_prometheus()
+
+    assert "# TYPE api_ia_embedding_cache_hits_total counter\napi_ia_embedding_cache_hits_total 12" in text
+    assert "api_ia_similar_index_size NaN" in text
+    assert "api_ia_queue_depth 2.5" in text
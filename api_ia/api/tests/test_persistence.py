@@ -0,0 +1,35 @@
+from api_ia.api.persistence import PredictionWriter
+
+
+def test_writer_flushes_by_size_and_on_stop():
+    """
+    Test that queued predictions are written in batches of at most `batch_size`, and that stop() flushes the rest.
+    """
+    batches = []
+    writer = PredictionWriter(batches.append, batch_size=2, flush_interval=60).start()
+
+    assert writer.submit([{"incident_number": str(i)} for i in range(5)]) == []
+    writer.stop()
+
+    assert [len(batch) for batch in batches][:2] == [2, 2]
+    assert sum(len(batch) for batch in batches) == 5
+    metrics = writer.metrics()
+    assert metrics["written"] == 5
+    assert metrics["queue_depth"] == 0
+    assert not metrics["running"]
+
+
+def test_writer_returns_records_it_cannot_queue():
+    """
+    Test that records are handed back to the caller when the writer is stopped, and that failed batches are counted.
+    """
+    writer = PredictionWriter(lambda batch: None)
+    assert writer.submit([{"incident_number": "1"}]) == [{"incident_number": "1"}]
+
+    def failing_write(batch):
+        raise ConnectionError("database unreachable")
+
+    writer = PredictionWriter(failing_write, flush_interval=0.01, max_retries=1).start()
+    writer.submit([{"incident_number": "1"}])
+    writer.stop()
+    assert writer.metrics()["failed"] == 1
@@ -0,0 +1,56 @@
+import threading
+import time
+from api_ia.api.registry import ModelRegistry
+
+
+def test_registry_loads_each_uri_once():
+    """
+    Test that the registry loads a given model URI only once, even with concurrent callers.
+    """
+    calls = []
+
+    def loader(uri):
+        calls.append(uri)
+        time.sleep(0.05)
+        return f"model:{uri}"
+
+    registry = ModelRegistry(loader=loader)
+    threads = [threading.Thread(target=registry.get, args=("uri_1",)) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert registry.get("uri_1") == "model:uri_1"
+    assert calls == ["uri_1"]
+
+
+def test_registry_activate_swaps_active_model():
+    """
+    Test that activating a new version switches the active model, keeps the previous one until the
+    following switch and evicts the older ones.
+    """
+    calls = []
+
+    def loader(uri):
+        calls.append(uri)
+        return f"model:{uri}"
+
+    registry = ModelRegistry(loader=loader)
+    assert registry.active is None
+
+    registry.activate("uri_1")
+    assert registry.active == ("uri_1", "model:uri_1")
+
+    registry.activate_in_background("uri_2").join()
+    assert registry.active == ("uri_2", "model:uri_2")
+
+    # uri_1 is kept for the requests still holding it
+    registry.get("uri_1")
+    assert calls == ["uri_1", "uri_2"]
+
+    # uri_1 is evicted on the following switch, so it is loaded again
+    registry.activate("uri_3")
+    registry.get("uri_2")
+    registry.get("uri_1")
+    assert calls == ["uri_1", "uri_2", "uri_3", "uri_1"]
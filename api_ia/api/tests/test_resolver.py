@@ -0,0 +1,93 @@
+import threading
+import pytest
+from api_ia.api.resolver import ModelPathResolver
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_resolver_serves_cached_uri_and_refreshes_in_background():
+    """
+    Test that the resolver only resolves once per TTL, refreshes in the background and notifies URI changes.
+    """
+    clock = FakeClock()
+    uris = iter(["uri_1", "uri_2"])
+    release = threading.Event()
+    changes = []
+
+    def resolve():
+        uri = next(uris)
+        if uri == "uri_2":
+            release.wait(timeout=5)
+        return uri
+
+    resolver = ModelPathResolver(resolve=resolve, ttl=10, on_change=changes.append, clock=clock)
+
+    assert resolver.get() == "uri_1"
+    clock.now = 5
+    assert resolver.get() == "uri_1"
+
+    # Stale: the cached URI is still served while the refresh runs in the background
+    clock.now = 11
+    thread = resolver.refresh_in_background()
+    assert resolver.get() == "uri_1"
+    assert resolver.refresh_in_background() is None
+    release.set()
+    thread.join()
+    assert resolver.get() == "uri_2"
+    assert changes == ["uri_1", "uri_2"]
+
+
+def test_resolver_keeps_last_good_uri_when_mlflow_fails():
+    """
+    Test that a failing refresh keeps serving the last known good URI and is retried later.
+    """
+    clock = FakeClock()
+    responses = ["uri_1"]
+
+    def resolve():
+        if not responses:
+            raise ConnectionError("MLflow unreachable")
+        return responses.pop(0)
+
+    resolver = ModelPathResolver(resolve=resolve, ttl=10, retry_interval=2, clock=clock)
+    assert resolver.get() == "uri_1"
+
+    clock.now = 20
+    assert resolver.refresh() == "uri_1"
+    assert resolver.get() == "uri_1"
+
+    responses.append("uri_2")
+    clock.now = 22
+    resolver.refresh_in_background().join()
+    assert resolver.model_uri == "uri_2"
+
+
+def test_select_best_run_compares_runs_of_the_latest_silhouette_mode():
+    """
+    Test that the best run is selected among the runs of the silhouette mode of the latest run, on the metric
+    of this mode, and that runs without any silhouette metric fall back to the latest one.
+    """
+    import numpy as np
+    import pandas as pd
+    from api_ia.api.utils import select_best_run
+
+    runs = pd.DataFrame({
+        'run_id': ['exact_old', 'sampled_best', 'sampled_new', 'other'],
+        'tags.mlflow.runName': ['kmeans_40', 'kmeans_40', 'kmeans_40', 'kmeans_41'],
+        'start_time': pd.to_datetime(['2024-01-01', '2024-02-01', '2024-03-01', '2024-04-01']),
+        'params.silhouette_mode': [None, 'sampled', 'sampled', 'centroid'],
+        'metrics.silhouette score': [0.9, 0.5, 0.4, np.nan],
+        'metrics.simplified silhouette score': [np.nan, np.nan, np.nan, 0.7],
+    })
+
+    assert select_best_run(runs, 'kmeans_40')['run_id'] == 'sampled_best'
+    assert select_best_run(runs, 'kmeans_41')['run_id'] == 'other'
+    assert select_best_run(runs[['run_id', 'tags.mlflow.runName', 'start_time']], 'kmeans_40')['run_id'] == 'sampled_new'
+    with pytest.raises(KeyError):
+        select_best_run(runs, 'kmeans_50')
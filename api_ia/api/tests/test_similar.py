@@ -0,0 +1,37 @@
+import threading
+import numpy as np
+import pytest
+from api_ia.api.similar import SimilarIncidentIndex, IndexNotReady
+
+CENTERS = np.array([[0.0, 0.0], [10.0, 10.0]], dtype=np.float32)
+
+
+def test_index_built_in_background_and_kept_until_the_next_one_is_built():
+    """
+    Test that a search never builds the index on the request path: it fails until the first index is built,
+    then uses the index of the previous model version while the new one is built.
+    """
+    release = threading.Event()
+    calls = []
+
+    def loader(model_run):
+        calls.append(model_run)
+        release.wait(5)
+        return [f"{model_run}_1", f"{model_run}_2"], np.array([[0.0, 1.0], [10.0, 9.0]], dtype=np.float32)
+
+    index = SimilarIncidentIndex(loader)
+    with pytest.raises(IndexNotReady):
+        index.search("uri_1", "kmeans_40", CENTERS, [0.0, 0.0])
+    # The search started the build; a prediction made meanwhile is added once it is published
+    index.add("uri_1", ["INC_NEW"], [[0.0, 0.5]])
+    release.set()
+    index.build("uri_1", "kmeans_40", CENTERS)
+    assert [number for number, _ in index.search("uri_1", "kmeans_40", CENTERS, [0.0, 0.0], k=2)] == ["INC_NEW", "kmeans_40_1"]
+
+    release.clear()
+    thread = index.build_in_background("uri_2", "kmeans_41", CENTERS)
+    assert index.search("uri_2", "kmeans_41", CENTERS, [10.0, 10.0], k=1)[0][0] == "kmeans_40_2"
+    release.set()
+    thread.join()
+    assert index.search("uri_2", "kmeans_41", CENTERS, [10.0, 10.0], k=1)[0][0] == "kmeans_41_2"
+    assert calls == ["kmeans_40", "kmeans_41"]
@@ -0,0 +1,53 @@
+from api_ia.api.titles import ClusterTitleMap
+
+
+def test_titles_reloaded_only_when_model_changes():
+    """
+    Test that the title map hits the loader once per model version, and again on an explicit refresh.
+    """
+    calls = []
+
+    def loader(table):
+        calls.append(table)
+        return {0: f"{table} title 0", 1: f"{table} title 1"}
+
+    titles = ClusterTitleMap(loader)
+    assert titles.refresh() is None
+
+    assert titles.ensure("uri_1", "kmeans_40_clusters_title")[1] == "kmeans_40_clusters_title title 1"
+    titles.ensure("uri_1", "kmeans_40_clusters_title")
+    assert calls == ["kmeans_40_clusters_title"]
+
+    titles.ensure("uri_2", "kmeans_40_clusters_title")
+    assert len(calls) == 2
+    assert titles.model_uri == "uri_2"
+
+    titles.refresh()
+    assert len(calls) == 3
+
+
+def test_titles_kept_per_model_version():
+    """
+    Test that activating a new model version keeps the titles of the previous one until the following
+    switch, so that requests on either version never reload them.
+    """
+    calls = []
+
+    def loader(table):
+        calls.append(table)
+        return {0: f"{table} title 0"}
+
+    titles = ClusterTitleMap(loader)
+    titles.activate("uri_1", "kmeans_40_clusters_title")
+    titles.activate("uri_2", "kmeans_41_clusters_title")
+
+    for _ in range(2):
+        assert titles.ensure("uri_1", "kmeans_40_clusters_title")[0] == "kmeans_40_clusters_title title 0"
+        assert titles.ensure("uri_2", "kmeans_41_clusters_title")[0] == "kmeans_41_clusters_title title 0"
+    assert calls == ["kmeans_40_clusters_title", "kmeans_41_clusters_title"]
+    assert titles.model_uri == "uri_2"
+
+    titles.activate("uri_3", "kmeans_42_clusters_title")
+    titles.ensure("uri_2", "kmeans_41_clusters_title")
+    titles.ensure("uri_1", "kmeans_40_clusters_title")
+    assert calls == ["kmeans_40_clusters_title", "kmeans_41_clusters_title", "kmeans_42_clusters_title", "kmeans_40_clusters_title"]
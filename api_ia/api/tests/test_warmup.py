@@ -0,0 +1,31 @@
+from api_ia.api.warmup import WarmUp
+
+
+def test_warm_up_reports_phases_and_readiness():
+    """
+    Test that the warm-up runs its phases in order, records their durations and becomes ready.
+    """
+    calls = []
+    warm_up = WarmUp([("encoder", lambda: calls.append("encoder")), ("model", lambda: calls.append("model"))])
+    assert not warm_up.ready
+
+    warm_up.start_in_background()
+
+    assert warm_up.wait(timeout=5)
+    assert calls == ["encoder", "model"]
+    assert set(warm_up.status()["phases"]) == {"encoder", "model"}
+
+
+def test_warm_up_stays_not_ready_on_failure():
+    """
+    Test that a failing phase stops the warm-up and is reported.
+    """
+    def failing_phase():
+        raise ConnectionError("MLflow unreachable")
+
+    warm_up = WarmUp([("model", failing_phase), ("titles", lambda: None)])
+
+    assert not warm_up.run()
+    assert not warm_up.ready
+    assert "model" in warm_up.status()["error"]
+    assert "titles" not in warm_up.status()["phases"]
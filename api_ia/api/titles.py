@@ -0,0 +1,97 @@
+import threading
+
+
+class ClusterTitleMap:
+    """
+    In-memory maps of cluster number to problem title, one per model version (model URI).
+
+    The titles of a version are read once from its `<model>_clusters_title` table and kept as a dict. They
+    are reloaded only when `refresh()` is called explicitly (e.g. from the admin endpoint), so predictions
+    no longer query the database. When a new version is activated, the titles of the previous active
+    version are kept until the following switch: requests still running on the previous model URI keep
+    reading its titles instead of reloading them.
+
+    Args:
+        loader (callable): Function taking a table name and returning a dict {cluster number: problem title}.
+    """
+
+    def __init__(self, loader):
+        self._loader = loader
+        self._lock = threading.Lock()
+        # {model_uri: (table, titles)}, each entry replaced as a whole on reload
+        self._titles = {}
+        self._active = None
+        self._previous = None
+
+    def ensure(self, model_uri, table):
+        """
+        Returns the titles for the given model version, loading them if they are not in memory.
+
+        Args:
+            model_uri (str): The URI of the model the titles belong to.
+            table (str): The SQL table holding the titles of this model.
+
+        Returns:
+            dict: The mapping {cluster number: problem title}.
+        """
+        entry = self._titles.get(model_uri)
+        if entry is not None and entry[0] == table:
+            return entry[1]
+        with self._lock:
+            entry = self._titles.get(model_uri)
+            if entry is None or entry[0] != table:
+                entry = (table, self._loader(table))
+                self._titles[model_uri] = entry
+        return entry[1]
+
+    def activate(self, model_uri, table):
+        """
+        Loads the titles of a new model version if needed and makes it the active one.
+
+        The titles of the previously active version are kept, those of any older version are dropped.
+
+        Args:
+            model_uri (str): The URI of the model the titles belong to.
+            table (str): The SQL table holding the titles of this model.
+
+        Returns:
+            dict: The mapping {cluster number: problem title}.
+        """
+        titles = self.ensure(model_uri, table)
+        with self._lock:
+            if model_uri != self._active:
+                self._previous, self._active = self._active, model_uri
+            for uri in list(self._titles):
+                if uri not in (self._active, self._previous):
+                    self._titles.pop(uri, None)
+        return titles
+
+    def refresh(self):
+        """
+        Reloads the titles of the active model version from the database.
+
+        Returns:
+            dict: The reloaded mapping {cluster number: problem title}, or None if no titles were loaded yet.
+        """
+        with self._lock:
+            model_uri = self.model_uri
+            entry = self._titles.get(model_uri)
+            if entry is None:
+                return None
+            titles = self._loader(entry[0])
+            self._titles[model_uri] = (entry[0], titles)
+        return titles
+
+    @property
+    def model_uri(self):
+        """
+        Returns the URI of the active model version, or of the last version loaded if none was activated.
+        """
+        if self._active is not None:
+            return self._active
+        return next(reversed(self._titles), None)
+
+    @property
+    def table(self):
+        entry = self._titles.get(self.model_uri)
+        return entry[0] if entry is not None else None
@@ -1,18 +1,23 @@
-import pandas as pd 
 from dotenv import load_dotenv
 import os 
-from langchain_openai import AzureOpenAIEmbeddings
-import pyodbc
-import pickle
-import mlflow
 from pydantic import BaseModel
 import string
-from datetime import datetime
-from typing import List 
-from sentence_transformers import SentenceTransformer
-import numpy as np 
-import json
-import ast 
+from typing import List, Optional, TYPE_CHECKING
+from api_ia.api.registry import model_registry
+from api_ia.api.encoder import get_encoder
+from api_ia.api.embedding_cache import get_embedding_cache
+from api_ia.embeddings.keys import embedding_key
+from api_ia.api.titles import ClusterTitleMap
+from api_ia.api.resolver import ModelPathResolver
+from api_ia.api.batcher import MicroBatcher
+from api_ia.api.metrics import stage_metrics
+from api_ia.api.similar import SimilarIncidentIndex
+from api_ia.embeddings.codec import decode_embedding
+import numpy as np
+import threading
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 
 class PredictionInput(BaseModel):
@@ -28,9 +33,24 @@ class PredictionOuput(BaseModel):
     cluster_number: int 
     problem_title: str
     resulted_embeddings: List[List[float]]
+    # Euclidean distance to the centroid of the cluster, and second nearest cluster (low-confidence assignments)
+    centroid_distance: Optional[float] = None
+    runner_up_cluster: Optional[int] = None
+    runner_up_distance: Optional[float] = None
+
+class SimilarIncident(BaseModel):
+    incident_number: str
+    distance: float
 
 load_dotenv()
 
+PUNCTUATION_TABLE = str.maketrans("", "", string.punctuation + "“”’")
+ENCODER_BATCH_SIZE = int(os.getenv("ENCODER_BATCH_SIZE", 64))
+# Micro-batching of concurrent single predictions, disabled when the maximum wait is 0
+MICRO_BATCH_MAX_WAIT_MS = float(os.getenv("MICRO_BATCH_MAX_WAIT_MS", 0))
+MICRO_BATCH_MAX_SIZE = int(os.getenv("MICRO_BATCH_MAX_SIZE", 32))
+MICRO_BATCH_TIMEOUT_SECONDS = float(os.getenv("MICRO_BATCH_TIMEOUT_SECONDS", 30))
+
 
 def connect_to_sql_server():
     """
@@ -47,6 +67,8 @@ def connect_to_sql_server():
     Raises:
         pyodbc.Error: If the connection fails.
     """
+    import pyodbc
+
     load_dotenv()
     driver = os.getenv("DRIVER")
     server = os.getenv("AZURE_SERVER_NAME")
@@ -58,22 +80,52 @@ def connect_to_sql_server():
     return conn
 
 
-def predict_cluster(model_path,incident:PredictionInput):
+def build_doc(incident:PredictionInput) -> str:
+    """
+    Combines the incident details into the single text string given to the encoder, without punctuation.
+
+    Args:
+        incident (PredictionInput): An object containing details about the incident.
+
+    Returns:
+        str: The cleaned text of the incident.
+    """
+    docs = incident.description + " " + incident.category_full + " " + incident.location_full + " " + incident.ci_name 
+    return docs.translate(PUNCTUATION_TABLE)
+
+
+def prediction_input_hash(incident:PredictionInput, model_path) -> str:
+    """
+    Computes the hash identifying the inputs of a prediction: the cleaned text of the incident, the encoder and
+    the model version. A stored prediction with the same hash would be predicted again identically.
+
+    Args:
+        incident (PredictionInput): An object containing details about the incident.
+        model_path (str): The URI of the model version.
+
+    Returns:
+        str: The hexadecimal SHA-256 hash.
+    """
+    return embedding_key(build_doc(incident), f"{get_encoder().model_name}\0{model_path}")
+
+
+def predict_cluster(model_path,incident:PredictionInput,titles_table="kmeans_40_clusters_title"):
     """
     Predicts the cluster and problem title for a given incident using a pre-trained model.
 
     This function:
-    1. Loads a machine learning model from the specified path using `mlflow`.
+    1. Gets the machine learning model for the specified path from the process-wide model registry (loaded once per version).
     2. Combines the incident details into a single text string.
     3. Cleans the text by removing punctuation.
     4. Converts the cleaned text into embeddings.
     5. Uses the model to predict the cluster based on the embeddings.
-    6. Retrieves the problem title corresponding to the predicted cluster.
-    7. Returns a `PredictionOuput` object containing the cluster number, problem title, and embeddings.
+    6. Retrieves the problem title corresponding to the predicted cluster from the in-memory title map of the model.
+    7. Returns a `PredictionOuput` object containing the cluster number, problem title, embeddings, distance to the centroid and runner-up cluster.
 
     Args:
         model_path (str): The file path to the pre-trained ML model.
         incident (PredictionInput): An object containing details about the incident.
+        titles_table (str): The SQL table containing the problem titles of the model's clusters.
 
     Returns:
         PredictionOuput: An object containing the predicted cluster number, problem title, and embeddings.
@@ -81,17 +133,134 @@ def predict_cluster(model_path,incident:PredictionInput):
     Raises:
         Exception: If there's an error during model loading, text processing, or prediction.
     """
-    loaded_model = mlflow.pyfunc.load_model(model_path)
-    docs = incident.description + " " + incident.category_full + " " + incident.location_full + " " + incident.ci_name 
-    punctuation_table = str.maketrans("", "", string.punctuation + "“”’")
-    docs = docs.translate(punctuation_table)
-    input_series = pd.Series({"docs":docs})
-    embeddings = get_embeddings(input_series)
-    prediction = loaded_model.predict(embeddings)
-    problem_title = get_problem_title(prediction[0])
-    output = PredictionOuput(cluster_number=prediction[0],problem_title=problem_title, resulted_embeddings=embeddings)
+    if MICRO_BATCH_MAX_WAIT_MS > 0:
+        # Concurrent calls are grouped into a single batched encoding and assignment
+        return micro_batcher.submit((model_path,incident,titles_table))
+    return predict_clusters(model_path,[incident],titles_table=titles_table)[0]
+
+
+def _predict_micro_batch(items:list) -> List[PredictionOuput]:
+    """
+    Predicts a micro-batch of (model_path, incident, titles_table) items, with one call to `predict_clusters`
+    per model.
+    """
+    groups = {}
+    for i, (model_path, incident, titles_table) in enumerate(items):
+        groups.setdefault((model_path, titles_table), []).append(i)
+
+    outputs = [None] * len(items)
+    for (model_path, titles_table), indices in groups.items():
+        predictions = predict_clusters(model_path,[items[i][1] for i in indices],titles_table=titles_table)
+        for i, prediction in zip(indices, predictions):
+            outputs[i] = prediction
+    return outputs
 
-    return output 
+
+micro_batcher = MicroBatcher(_predict_micro_batch, max_batch_size=MICRO_BATCH_MAX_SIZE, max_wait_ms=MICRO_BATCH_MAX_WAIT_MS, timeout=MICRO_BATCH_TIMEOUT_SECONDS)
+
+
+def predict_clusters(model_path,incidents:List[PredictionInput],titles_table="kmeans_40_clusters_title",batch_size=None) -> List[PredictionOuput]:
+    """
+    Predicts the clusters and problem titles for a list of incidents in one pass.
+
+    This function:
+    1. Gets the cluster assignment engine (centroids) for the specified path from the process-wide model registry.
+    2. Builds the cleaned text of every incident.
+    3. Gets the embeddings of texts already seen from the embedding cache, and encodes the others with a single call to the encoder.
+    4. Assigns the whole embedding matrix to the nearest centroids with a single matrix product, which also gives
+       the distance to the assigned centroid and the runner-up cluster.
+    5. Retrieves the problem titles from the in-memory title map of the model.
+    Each step is timed in the per-stage latency metrics.
+
+    Args:
+        model_path (str): The file path to the pre-trained ML model.
+        incidents (List[PredictionInput]): The incidents to predict.
+        titles_table (str): The SQL table containing the problem titles of the model's clusters.
+        batch_size (int): Number of texts encoded per forward pass. Defaults to ENCODER_BATCH_SIZE.
+
+    Returns:
+        List[PredictionOuput]: One prediction per incident, in the same order.
+    """
+    if not incidents:
+        return []
+    with stage_metrics.stage("model_load"):
+        loaded_model = model_registry.get(model_path)
+    embeddings = embed_incidents(incidents, batch_size=batch_size)
+    with stage_metrics.stage("assign"):
+        clusters, distances, runner_ups, runner_up_distances = loaded_model.assign(embeddings)
+
+    outputs = []
+    with stage_metrics.stage("titles"):
+        for cluster_number, distance, runner_up, runner_up_distance, embedding in zip(clusters, distances.tolist(), runner_ups.tolist(), runner_up_distances.tolist(), embeddings.tolist()):
+            problem_title = get_problem_title(cluster_number,table=titles_table,model_uri=model_path)
+            outputs.append(PredictionOuput(
+                cluster_number=cluster_number,
+                problem_title=problem_title,
+                resulted_embeddings=[embedding],
+                centroid_distance=distance,
+                runner_up_cluster=runner_up if runner_up >= 0 else None,
+                runner_up_distance=runner_up_distance if runner_up >= 0 else None,
+            ))
+    stage_metrics.increment("predicted_incidents", len(incidents))
+
+    return outputs
+
+
+def embed_incidents(incidents:List[PredictionInput],batch_size=None) -> np.ndarray:
+    """
+    Computes the embeddings of incidents, reusing those of already seen texts from the embedding cache.
+
+    Args:
+        incidents (List[PredictionInput]): The incidents to encode.
+        batch_size (int): Number of texts encoded per forward pass. Defaults to ENCODER_BATCH_SIZE.
+
+    Returns:
+        np.ndarray: The float32 (n, dim) embedding matrix, in the same order as the incidents.
+    """
+    docs = [build_doc(incident) for incident in incidents]
+    encoder = get_encoder()
+    with stage_metrics.stage("encode"):
+        return get_embedding_cache().encode(docs, lambda missing_docs: encoder.encode(missing_docs, batch_size=batch_size or ENCODER_BATCH_SIZE))
+
+
+def select_best_run(runs, model_run):
+    """
+    Selects the best MLflow run of a model run name.
+
+    This function:
+    1. Keeps the runs named `model_run`.
+    2. Keeps the runs evaluated with the same silhouette estimator as the latest of them (`params.silhouette_mode`,
+       'exact' for the runs logged before it existed): exact, sampled and centroid silhouettes are not comparable.
+    3. Returns the run with the highest silhouette metric of this mode (see `SILHOUETTE_METRICS`), or the latest
+       run if none of them logged it.
+
+    Args:
+        runs (pd.DataFrame): The runs of the experiment, as returned by `mlflow.search_runs`.
+        model_run (str): The name of the model run.
+
+    Returns:
+        pd.Series: The selected run.
+
+    Raises:
+        KeyError: If no run is named `model_run`.
+    """
+    from api_ia.clustering_model.silhouette import SILHOUETTE_METRICS
+
+    filtered_runs = runs[runs['tags.mlflow.runName'] == model_run]
+    if filtered_runs.empty:
+        raise KeyError(f"No MLflow run named '{model_run}'")
+    if 'start_time' in filtered_runs:
+        filtered_runs = filtered_runs.sort_values(by='start_time', ascending=False)
+    mode = 'exact'
+    if 'params.silhouette_mode' in filtered_runs:
+        modes = filtered_runs['params.silhouette_mode'].fillna('exact')
+        mode = modes.iloc[0]
+        filtered_runs = filtered_runs[modes == mode]
+    score_column = f"metrics.{SILHOUETTE_METRICS.get(mode, 'silhouette score')}"
+    scores = filtered_runs[score_column] if score_column in filtered_runs else None
+    if scores is None or scores.isna().all():
+        return filtered_runs.iloc[0]
+    return filtered_runs.loc[scores.idxmax()]
 
 
 def get_model_path(model_run):
@@ -101,10 +270,10 @@ def get_model_path(model_run):
     This function:
     1. Sets the MLflow tracking URI from environment variables.
     2. Retrieves the experiment by its name.
-    3. Searches for runs associated with the specified model run name.
-    4. Sorts the runs by silhouette score in descending order.
-    5. Gets the artifact URI of the best run.
-    6. Constructs and returns the URI for the model artifact.
+    3. Selects the best run of the specified model run name with `select_best_run`, on the silhouette metric
+       of the silhouette mode of its latest run.
+    4. Gets the artifact URI of the best run.
+    5. Constructs and returns the URI for the model artifact.
 
     Args:
         model_run (str): The name of the model run for which to retrieve the model path.
@@ -114,15 +283,14 @@ def get_model_path(model_run):
 
     Raises:
         ValueError: If the artifact URI does not start with 'azureml://'.
-        KeyError: If no runs match the specified model run name or if the expected columns are not found in the DataFrame.
+        KeyError: If no runs match the specified model run name.
     """
+    import mlflow
+
     mlflow.set_tracking_uri(os.getenv('MLFLOW_TRACKING_URI'))
-    print(os.getenv('MLFLOW_TRACKING_URI'))
     experiment = mlflow.get_experiment_by_name("incidents_clustering")
     runs = mlflow.search_runs(experiment_ids=experiment.experiment_id)
-    filtered_runs = runs[runs['tags.mlflow.runName'] == model_run]
-    filtered_runs = filtered_runs.sort_values(by='metrics.silhouette score', ascending=False)
-    run_id = filtered_runs.iloc[0]['run_id']
+    run_id = select_best_run(runs, model_run)['run_id']
     run = mlflow.get_run(run_id)
     artifact_uri = run.info.artifact_uri
     
@@ -136,12 +304,60 @@ def get_model_path(model_run):
     return model_uri
 
 
-def get_embeddings(input:pd.Series)-> pd.DataFrame:
+MODEL_URI_TTL_SECONDS = float(os.getenv("MODEL_URI_TTL_SECONDS", 600))
+
+_model_path_resolvers = {}
+_model_path_resolvers_lock = threading.Lock()
+
+
+def _load_model_version(model_run, model_uri):
+    """
+    Loads a new model version and its cluster titles, so that they are ready before the new URI is served.
+
+    The previous version and its titles stay in memory until the following switch, for the requests still
+    holding the previous URI. The similar-incident index of the new version is built in the background.
+    """
+    loaded_model = model_registry.activate(model_uri)
+    cluster_titles.activate(model_uri, f"{model_run}_clusters_title")
+    similar_incidents.build_in_background(model_uri, model_run, loaded_model.cluster_centers)
+
+
+def get_cached_model_path(model_run):
+    """
+    Returns the URI of the model artifact for the specified model run name, without querying MLflow on every call.
+
+    This function:
+    1. Gets (or creates) the resolver caching the model URI of this model run.
+    2. Returns the cached URI. Once it is older than MODEL_URI_TTL_SECONDS, it is refreshed in the background
+       with `get_model_path`, and the last known good URI keeps being served if MLflow is slow or unreachable.
+    3. When the refresh finds a new best run, the new model version and its titles are loaded before the new URI is served.
+
+    Args:
+        model_run (str): The name of the model run for which to retrieve the model path.
+
+    Returns:
+        str: The URI of the model artifact.
+    """
+    resolver = _model_path_resolvers.get(model_run)
+    if resolver is None:
+        with _model_path_resolvers_lock:
+            resolver = _model_path_resolvers.get(model_run)
+            if resolver is None:
+                resolver = ModelPathResolver(
+                    resolve=lambda: get_model_path(model_run),
+                    ttl=MODEL_URI_TTL_SECONDS,
+                    on_change=lambda model_uri: _load_model_version(model_run, model_uri),
+                )
+                _model_path_resolvers[model_run] = resolver
+    return resolver.get()
+
+
+def get_embeddings(input:"pd.Series")-> "pd.DataFrame":
     """
-    Generates embeddings for a given input using a pre-trained SentenceTransformer model.
+    Generates embeddings for a given input using the shared SentenceTransformer encoder.
 
     This function:
-    1. Loads a pre-trained SentenceTransformer model for generating embeddings.
+    1. Gets the process-wide encoder (the model is loaded once, at API startup).
     2. Encodes the input text into embeddings.
     3. Converts the embeddings from a NumPy array to a list.
 
@@ -154,48 +370,136 @@ def get_embeddings(input:pd.Series)-> pd.DataFrame:
     Raises:
         ValueError: If the input is not a Pandas Series or does not contain text data.
     """
-    model_paraphrase = SentenceTransformer("sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
-    embeddings = model_paraphrase.encode(input)
-    embeddings_np = np.array(embeddings)
+    embeddings_np = get_encoder().encode(input)
     embeddings_list = embeddings_np.tolist()
     
     return embeddings_list
 
 
-def get_problem_title(cluster_number:int,table="kmeans_40_clusters_title") -> str:
+def load_cluster_titles(table="kmeans_40_clusters_title") -> dict:
     """
-    Retrieves the problem title associated with a given cluster number from a SQL table.
-
-    This function:
-    1. Connects to a SQL Server database.
-    2. Executes a query to fetch data from the specified table.
-    3. Filters the data for the given cluster number.
-    4. Returns the problem title associated with the cluster number, if found.
+    Reads the problem titles of every cluster from a SQL table.
 
     Args:
-        cluster_number (int): The cluster number for which to retrieve the problem title.
-        table (str): The name of the SQL table containing cluster information. Defaults to "kmeans_30_clusters_title".
+        table (str): The name of the SQL table containing cluster information.
 
     Returns:
-        str: The problem title associated with the cluster number, or an error message if no title is found for the given cluster number.
+        dict: A mapping {cluster number: problem title}.
 
     Raises:
-        ValueError: If there is an issue with the SQL query or connection.
+        pyodbc.Error: If there is an issue with the SQL query or connection.
     """
-    modelisation_query = f"""
-    SELECT *
+    titles_query = f"""
+    SELECT cluster, problem_title
     FROM {table}
     """
 
     conn = connect_to_sql_server()
-    df = pd.read_sql_query(modelisation_query,conn)
-    row = df[df['cluster'] == cluster_number]
-    # Vérifier si le numéro de cluster est présent dans le DataFrame
-    if not row.empty:
-        # Récupérer le nom du problème associé
-        problem_title = row.iloc[0]['problem_title']
+    try:
+        cursor = conn.cursor()
+        cursor.execute(titles_query)
+        rows = cursor.fetchall()
+    finally:
+        conn.close()
+
+    return {int(cluster): problem_title for cluster, problem_title in rows}
+
+
+cluster_titles = ClusterTitleMap(load_cluster_titles)
+
+
+def get_problem_title(cluster_number:int,table="kmeans_40_clusters_title",model_uri=None) -> str:
+    """
+    Retrieves the problem title associated with a given cluster number.
+
+    This function:
+    1. Gets the in-memory title map of the model version, loading it from the SQL table only if it is not in memory.
+    2. Looks up the given cluster number in the map.
+    3. Returns the problem title associated with the cluster number, if found.
+
+    Args:
+        cluster_number (int): The cluster number for which to retrieve the problem title.
+        table (str): The name of the SQL table containing cluster information. Defaults to "kmeans_40_clusters_title".
+        model_uri (str): The URI of the model the clusters come from. Each model version has its own titles.
+
+    Returns:
+        str: The problem title associated with the cluster number, or an error message if no title is found for the given cluster number.
+
+    Raises:
+        pyodbc.Error: If the titles have to be loaded and there is an issue with the SQL query or connection.
+    """
+    titles = cluster_titles.ensure(model_uri, table)
+    problem_title = titles.get(int(cluster_number))
+    # Vérifier si le numéro de cluster est présent dans la table des titres
+    if problem_title is not None:
         return problem_title
     else:
         # Si le numéro de cluster n'est pas trouvé, retourner un message d'erreur
         return f"No problem title found for cluster {cluster_number}"
 
+
+def load_indexed_incidents(model_run) -> tuple:
+    """
+    Reads the embeddings of the past incidents of a model, indexed for the similar-incident search.
+
+    This function:
+    1. Reads the incident numbers and embeddings of the training dataset of the model (`<model_run>_trainingdataset_clusters`).
+    2. Reads those of the predictions made by the model, which replace the training embedding of the same incident.
+    3. Decodes the stored embeddings (binary or legacy JSON).
+
+    Args:
+        model_run (str): The name of the model run.
+
+    Returns:
+        tuple: The list of incident numbers and the float32 (n, dim) embedding matrix, in the same order.
+
+    Raises:
+        pyodbc.Error: If there is an issue with the SQL query or connection.
+    """
+    conn = connect_to_sql_server()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT incident_number, resulted_embeddings FROM {model_run}_trainingdataset_clusters")
+        rows = cursor.fetchall()
+        cursor.execute("SELECT incident_number, embedding, resulted_embeddings FROM predictions WHERE model = ?", model_run)
+        rows += [(incident_number, embedding if embedding is not None else json_embedding) for incident_number, embedding, json_embedding in cursor.fetchall()]
+    finally:
+        conn.close()
+
+    embeddings = {incident_number: decode_embedding(embedding) for incident_number, embedding in rows if embedding is not None}
+    if not embeddings:
+        return [], np.empty((0, 0), dtype=np.float32)
+    return list(embeddings), np.vstack(list(embeddings.values()))
+
+
+similar_incidents = SimilarIncidentIndex.from_env(load_indexed_incidents)
+
+
+def find_similar_incidents(model_path,model_run,incident:PredictionInput,k=10,n_probe=None) -> list:
+    """
+    Finds the past incidents most similar to an incident.
+
+    This function:
+    1. Computes the embedding of the incident (from the embedding cache if its text was already seen).
+    2. Gets the IVF index of the model, built in the background from its training dataset and past predictions
+       when the model version is activated (the index of the previous version is used until it is built).
+    3. Scans the incidents of the `n_probe` clusters nearest to the embedding and keeps the `k` nearest, leaving out the incident itself.
+
+    Args:
+        model_path (str): The URI of the model artifact.
+        model_run (str): The name of the model run.
+        incident (PredictionInput): The incident.
+        k (int): Number of similar incidents to return.
+        n_probe (int): Number of clusters scanned. Defaults to SIMILAR_N_PROBE.
+
+    Returns:
+        list: Up to `k` (incident number, squared L2 distance) pairs, most similar first.
+
+    Raises:
+        IndexNotReady: If no similar-incident index is built yet.
+    """
+    embedding = embed_incidents([incident])[0]
+    loaded_model = model_registry.get(model_path)
+    with stage_metrics.stage("similar_search"):
+        neighbours = similar_incidents.search(model_path, model_run, loaded_model.cluster_centers, embedding, k=k + 1, n_probe=n_probe)
+    return [(incident_number, distance) for incident_number, distance in neighbours if incident_number != incident.incident_number][:k]
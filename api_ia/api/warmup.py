@@ -0,0 +1,79 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class WarmUp:
+    """
+    Runs the warm-up phases of the API (preloading models, dummy inference...) and tracks readiness.
+
+    The phases run in order, in a background thread, so that the liveness probe answers during the warm-up.
+    The API is ready once every phase succeeded. The duration of each phase is recorded.
+
+    Args:
+        phases (list): List of (name, callable) pairs, run in order.
+    """
+
+    def __init__(self, phases):
+        self.phases = phases
+        self.durations = {}
+        self.error = None
+        self._ready = threading.Event()
+        self._thread = None
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def run(self):
+        """
+        Runs every phase in order, stopping at the first failure.
+
+        Returns:
+            bool: True if the API is ready.
+        """
+        self.error = None
+        for name, phase in self.phases:
+            start = time.perf_counter()
+            try:
+                phase()
+            except Exception as exc:
+                self.error = f"{name}: {exc!r}"
+                logger.error("Warm-up phase '%s' failed", name, exc_info=True)
+                return False
+            finally:
+                self.durations[name] = round(time.perf_counter() - start, 3)
+            logger.info("Warm-up phase '%s' done in %.3f s", name, self.durations[name])
+        self._ready.set()
+        return True
+
+    def start_in_background(self):
+        """
+        Runs the phases in a daemon thread.
+
+        Returns:
+            threading.Thread: The started thread.
+        """
+        self._thread = threading.Thread(target=self.run, name="warm-up", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def wait(self, timeout=None):
+        """
+        Waits until the API is ready.
+
+        Returns:
+            bool: True if the API is ready.
+        """
+        return self._ready.wait(timeout)
+
+    def status(self):
+        """
+        Returns the readiness, the duration of each phase run so far and the error of the failed phase, if any.
+
+        Returns:
+            dict: The warm-up status.
+        """
+        return {"ready": self.ready, "phases": dict(self.durations), "error": self.error}
@@ -0,0 +1,141 @@
+import json
+import os
+import numpy as np
+
+CENTROIDS_FORMAT_VERSION = 1
+CENTROIDS_FILE = "centroids.npy"
+METADATA_FILE = "centroids.json"
+
+
+def save_centroids(cluster_centers, path, **metadata):
+    """
+    Saves KMeans centroids as a small versioned artifact: a float32 `.npy` matrix and a JSON metadata file.
+
+    Args:
+        cluster_centers (np.ndarray): The (n_clusters, dim) centroid matrix, e.g. `KMeans.cluster_centers_`.
+        path (str): Directory where the artifact is written. Created if it does not exist.
+        **metadata: Additional metadata to record (run name, encoder model...).
+
+    Returns:
+        str: The artifact directory.
+    """
+    centers = np.asarray(cluster_centers, dtype=np.float32)
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, CENTROIDS_FILE), centers)
+    with open(os.path.join(path, METADATA_FILE), "w") as f:
+        json.dump({
+            "format_version": CENTROIDS_FORMAT_VERSION,
+            "n_clusters": int(centers.shape[0]),
+            "dim": int(centers.shape[1]),
+            "dtype": "float32",
+            **metadata,
+        }, f)
+    return path
+
+
+def load_centroids(path):
+    """
+    Loads a centroid artifact written by `save_centroids`.
+
+    Args:
+        path (str): Directory of the artifact.
+
+    Returns:
+        CentroidAssigner: The assignment engine built from the centroids.
+
+    Raises:
+        ValueError: If the artifact format version is unknown or the matrix does not match the metadata.
+    """
+    with open(os.path.join(path, METADATA_FILE)) as f:
+        metadata = json.load(f)
+    if metadata.get("format_version") != CENTROIDS_FORMAT_VERSION:
+        raise ValueError(f"Unknown centroids format version {metadata.get('format_version')}")
+    centers = np.load(os.path.join(path, CENTROIDS_FILE))
+    if centers.shape != (metadata["n_clusters"], metadata["dim"]):
+        raise ValueError(f"Centroids shape {centers.shape} does not match the metadata")
+    return CentroidAssigner(centers, metadata=metadata)
+
+
+class CentroidAssigner:
+    """
+    Pure NumPy KMeans cluster assignment: `argmin_k ||x - c_k||`.
+
+    The squared norms of the centroids are computed once, so assigning a batch is a single float32 matrix
+    product: `||x - c||² = ||x||² - 2 x·c + ||c||²`. It replaces the sklearn model behind MLflow pyfunc at
+    serving time and gives the same assignments.
+
+    Args:
+        cluster_centers (np.ndarray): The (n_clusters, dim) centroid matrix.
+        metadata (dict): Optional metadata of the artifact.
+    """
+
+    def __init__(self, cluster_centers, metadata=None):
+        self.cluster_centers = np.ascontiguousarray(cluster_centers, dtype=np.float32)
+        self.centers_sq_norms = np.einsum("ij,ij->i", self.cluster_centers, self.cluster_centers)
+        self.metadata = metadata or {}
+
+    @property
+    def n_clusters(self):
+        return self.cluster_centers.shape[0]
+
+    @property
+    def dim(self):
+        return self.cluster_centers.shape[1]
+
+    def distances(self, embeddings):
+        """
+        Computes the squared Euclidean distances between embeddings and every centroid.
+
+        Args:
+            embeddings (array-like): A (n, dim) matrix, or a single vector.
+
+        Returns:
+            np.ndarray: A float32 (n, n_clusters) matrix of squared distances.
+
+        Raises:
+            ValueError: If the embedding dimension does not match the centroids.
+        """
+        embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        if embeddings.shape[1] != self.dim:
+            raise ValueError(f"Embedding dimension {embeddings.shape[1]} does not match the centroids dimension {self.dim}")
+        sq_norms = np.einsum("ij,ij->i", embeddings, embeddings)
+        distances = sq_norms[:, None] - 2 * (embeddings @ self.cluster_centers.T) + self.centers_sq_norms[None, :]
+        # Rounding can make the distance of a point to itself slightly negative
+        return np.maximum(distances, 0, out=distances)
+
+    def predict(self, embeddings):
+        """
+        Assigns each embedding to its nearest centroid.
+
+        Args:
+            embeddings (array-like): A (n, dim) matrix, or a single vector.
+
+        Returns:
+            np.ndarray: The (n,) array of cluster numbers.
+        """
+        return self.distances(embeddings).argmin(axis=1)
+
+    def assign(self, embeddings):
+        """
+        Assigns each embedding to its nearest centroid and also returns the runner-up cluster, from the same
+        distance matrix.
+
+        Args:
+            embeddings (array-like): A (n, dim) matrix, or a single vector.
+
+        Returns:
+            tuple: Four (n,) arrays: the cluster numbers, the Euclidean distances to their centroid, the runner-up
+                cluster numbers and the Euclidean distances to the runner-up centroid (-1 and inf for a
+                single-cluster model).
+        """
+        distances = self.distances(embeddings)
+        rows = np.arange(distances.shape[0])
+        if self.n_clusters == 1:
+            clusters = np.zeros(distances.shape[0], dtype=np.int64)
+            return clusters, np.sqrt(distances[:, 0]), np.full_like(clusters, -1), np.full(distances.shape[0], np.inf, dtype=np.float32)
+        # The two nearest centroids, in any order
+        nearest = np.argpartition(distances, 1, axis=1)[:, :2]
+        swap = distances[rows, nearest[:, 0]] > distances[rows, nearest[:, 1]]
+        nearest[swap] = nearest[swap][:, ::-1]
+        clusters, runner_up = nearest[:, 0], nearest[:, 1]
+        return clusters, np.sqrt(distances[rows, clusters]), runner_up, np.sqrt(distances[rows, runner_up])
@@ -1,7 +1,6 @@
 import pandas as pd 
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
 import mlflow
-from sklearn.metrics import silhouette_score
 import sys
 import ast
 import numpy as np 
@@ -10,26 +9,159 @@ from sqlalchemy import create_engine
 sys.path.append("/home/utilisateur/DevIA/prbmg")
 from config import cfg
 import json
-from api_ia.clustering_model.utils import create_sql_server_conn, create_sql_server_engine
+from api_ia.clustering_model.utils import create_sql_server_conn, create_sql_server_engine, bulk_load
+from api_ia.embeddings.codec import decode_embeddings, encode_embeddings
+from sqlalchemy import LargeBinary
+from api_ia.clustering_model.centroids import save_centroids
+from api_ia.clustering_model.silhouette import estimate_silhouette, stratified_sample, simplified_silhouette, SILHOUETTE_METRICS
+import tempfile
 from dotenv import load_dotenv
 
 load_dotenv()
 
 
-def modelisation(df,run_name):
+def iter_embedding_chunks(values, chunk_size, order=None):
+    """
+    Reads embeddings chunk by chunk, so that only one chunk is held as a float32 matrix at a time.
+
+    Args:
+        values (np.ndarray | pd.Series | list): The embedding matrix (e.g. memory-mapped, see
+            `api_ia.embeddings.matrix`), whose chunks are sliced without copy, or the stored embeddings, in binary
+            or legacy JSON format, which are decoded.
+        chunk_size (int): Number of embeddings per chunk.
+        order (np.ndarray): Optional order in which the chunks are read (chunk numbers).
+
+    Yields:
+        tuple: The position of the first embedding of the chunk and the float32 (chunk_size, dim) matrix.
+    """
+    if not isinstance(values, np.ndarray):
+        values = values.tolist() if hasattr(values, "tolist") else list(values)
+    n_chunks = (len(values) + chunk_size - 1) // chunk_size
+    for chunk in (order if order is not None else range(n_chunks)):
+        start = int(chunk) * chunk_size
+        if isinstance(values, np.ndarray):
+            yield start, values[start:start + chunk_size]
+        else:
+            yield start, decode_embeddings(values[start:start + chunk_size])
+
+
+def take_embeddings(values, indices):
+    """
+    Reads the embeddings at the given positions as a float32 matrix.
+
+    Args:
+        values (np.ndarray | pd.Series): The embedding matrix, or the stored embeddings, which are decoded.
+        indices (np.ndarray): The positions of the embeddings.
+
+    Returns:
+        np.ndarray: The (len(indices), dim) float32 matrix.
+    """
+    if isinstance(values, np.ndarray):
+        return np.asarray(values[indices], dtype=np.float32)
+    return decode_embeddings(values.iloc[indices])
+
+
+def fit_minibatch_kmeans(values, model_cfg):
+    """
+    Fits a MiniBatchKMeans model by streaming the embeddings into `partial_fit`, with bounded memory.
+
+    This function:
+    1. Reads the embeddings `chunk_size` at a time, in a shuffled chunk order, for `max_epochs` epochs.
+    2. Feeds each chunk to `partial_fit` in mini-batches of `batch_size` embeddings. Clusters with few
+       assignments are reassigned according to `reassignment_ratio` (0 disables it).
+    3. Assigns every embedding to its cluster, chunk by chunk.
+
+    Args:
+        values (np.ndarray | pd.Series): The embedding matrix, or the stored embeddings (see `iter_embedding_chunks`).
+        model_cfg (DictConfig): The `model` configuration (see `configs/model/minibatch_kmeans.yaml`).
+
+    Returns:
+        tuple: The fitted model and the (n,) array of cluster labels.
+    """
+    # The first call to partial_fit initializes the centroids on its batch, which needs at least n_clusters samples
+    batch_size = max(model_cfg.batch_size, model_cfg.n_clusters)
+    chunk_size = max(model_cfg.chunk_size, batch_size)
+    model = MiniBatchKMeans(
+        n_clusters=model_cfg.n_clusters,
+        init=model_cfg.init,
+        n_init=model_cfg.n_init,
+        batch_size=batch_size,
+        reassignment_ratio=model_cfg.reassignment_ratio,
+        random_state=model_cfg.random_state,
+    )
+    n_chunks = (len(values) + chunk_size - 1) // chunk_size
+    rng = np.random.RandomState(model_cfg.random_state)
+    for epoch in range(model_cfg.max_epochs):
+        for _, chunk in iter_embedding_chunks(values, chunk_size, order=rng.permutation(n_chunks)):
+            for start in range(0, len(chunk), batch_size):
+                model.partial_fit(chunk[start:start + batch_size])
+        print(f"Epoch {epoch + 1}/{model_cfg.max_epochs} done, inertia of the last mini-batch : {model.inertia_}")
+
+    labels = np.empty(len(values), dtype=np.int32)
+    for start, chunk in iter_embedding_chunks(values, chunk_size):
+        labels[start:start + len(chunk)] = model.predict(chunk)
+    return model, labels
+
+
+def compute_silhouette(values, embeddings_np, labels, cluster_centers, model_cfg):
+    """
+    Estimates the silhouette of a clustering with the mode of the model configuration (see `estimate_silhouette`).
+
+    The mode defaults to `exact` for the full KMeans and `sampled` for the streaming MiniBatchKMeans. When the
+    embedding matrix was not decoded (streaming mode), only the sampled embeddings are read, or the
+    embeddings are read chunk by chunk for the centroid silhouette.
+
+    Args:
+        values (np.ndarray | pd.Series): The embedding matrix, or the stored embeddings (see `iter_embedding_chunks`).
+        embeddings_np (np.ndarray): The decoded embedding matrix, or None if it was not decoded.
+        labels (np.ndarray): The cluster labels.
+        cluster_centers (np.ndarray): The centroid matrix.
+        model_cfg (DictConfig): The `model` configuration.
+
+    Returns:
+        dict: The silhouette estimate.
+    """
+    mode = model_cfg.get("silhouette_mode") or ("exact" if embeddings_np is not None else "sampled")
+    sample_size = model_cfg.get("silhouette_sample_size", 20000)
+    random_state = model_cfg.get("random_state", 0)
+    if embeddings_np is not None:
+        return estimate_silhouette(embeddings_np, labels, mode=mode, sample_size=sample_size, random_state=random_state, cluster_centers=cluster_centers)
+
+    labels = np.asarray(labels)
+    if mode == "sampled":
+        sample = stratified_sample(labels, sample_size, random_state) if sample_size < len(labels) else np.arange(len(labels))
+        return estimate_silhouette(take_embeddings(values, sample), labels[sample], mode="sampled", sample_size=len(sample), random_state=random_state)
+    if mode == "centroid":
+        chunk_size = model_cfg.get("chunk_size", 50000)
+        scores = np.concatenate([
+            simplified_silhouette(chunk, labels[start:start + len(chunk)], cluster_centers)
+            for start, chunk in iter_embedding_chunks(values, chunk_size)
+        ])
+        return {"mode": "centroid", "metric": SILHOUETTE_METRICS["centroid"], "score": float(scores.mean()), "sample_size": len(labels)}
+    return estimate_silhouette(take_embeddings(values, np.arange(len(labels))), labels, mode=mode)
+
+
+def modelisation(df,run_name,embeddings=None,write_results=True):
     """
     Trains a KMeans clustering model on embeddings, logs the model and metrics to MLflow, and stores the results in a SQL database.
 
     This function performs the following steps:
     1. Configures MLflow tracking.
-    2. Parses and converts the `resulted_embeddings` column from string to list of embeddings.
-    3. Trains a KMeans clustering model on the embeddings.
-    4. Logs the model, hyperparameters, and metrics to MLflow.
-    5. Stores the clustering results in a SQL database.
+    2. Reads the embedding matrix, memory-mapped from the `.npy` file written by `make_embeddings` (see
+       `api_ia.embeddings.matrix`), or decodes it from the `resulted_embeddings` column (binary or legacy JSON).
+    3. Trains a KMeans clustering model on the embeddings, or, with the `minibatch_kmeans` model configuration,
+       streams them chunk by chunk into a MiniBatchKMeans model (see `fit_minibatch_kmeans`).
+    4. Logs the model, its centroids (used for serving, see `api_ia.clustering_model.centroids`), hyperparameters, and metrics to MLflow.
+    5. Stores the clustering results in a SQL database, unless `write_results` is False (the training pipeline
+       uploads them in its last stage, see `api_ia.model.training`).
 
     Args:
-        df (pd.DataFrame): The DataFrame containing the data to cluster, including a column 'resulted_embeddings' with embeddings.
+        df (pd.DataFrame): The DataFrame containing the data to cluster, including, unless `embeddings` is given, a column 'resulted_embeddings' with embeddings.
         run_name (str): The name to assign to the MLflow run.
+        embeddings (np.ndarray): Optional (n, dim) float32 embedding matrix of the rows of `df`, e.g. loaded with
+            `load_embedding_matrix`. When it is given, the 'resulted_embeddings' column is only used as the export
+            format of the embeddings, and added from the matrix if it is missing.
+        write_results (bool): Whether to append the clustered incidents to the `incidents_clusters` table.
 
     Returns:
         tuple: A tuple containing:
@@ -42,10 +174,12 @@ def modelisation(df,run_name):
         sklearn.exceptions.NotFittedError: If the KMeans model is not fitted properly.
     """
     mlflow.set_tracking_uri(os.environ.get("ML_FLOW_TRACKING_URI"))
-    df["resulted_embeddings"] = df["resulted_embeddings"].apply(lambda x: ast.literal_eval(x))
-    embeddings_np = np.array(df["resulted_embeddings"].tolist())
-
     n_clusters = cfg.model.n_clusters
+    # `model=minibatch_kmeans` streams the embeddings instead of decoding the whole matrix
+    minibatch = cfg.model.get("training_mode") == "minibatch"
+    values = embeddings if embeddings is not None else df["resulted_embeddings"]
+    if not minibatch:
+        embeddings_np = take_embeddings(values, np.arange(len(df))).astype(np.float64)
 
     experiment_name = "incidents_clustering"
     experiment = mlflow.get_experiment_by_name(experiment_name)
@@ -54,25 +188,45 @@ def modelisation(df,run_name):
     else:
         experiment_id = experiment.experiment_id
 
-    engine = create_sql_server_engine()
-
     with mlflow.start_run(experiment_id=experiment_id, run_name=run_name) as run : 
         mlflow.set_tracking_uri(os.getenv('MLFLOW_TRACKING_URI'))
-        init='k-means++'
-        n_init=80
-        algorithm='lloyd'
-        model = KMeans(n_clusters=n_clusters,init=init,n_init=n_init,algorithm=algorithm)
-        model.fit(embeddings_np)
+        if minibatch:
+            model, labels = fit_minibatch_kmeans(values, cfg.model)
+            params = {
+                "n_clusters":n_clusters,"init":cfg.model.init,"n_init":cfg.model.n_init,"algorithm":"minibatch",
+                "batch_size":cfg.model.batch_size,"chunk_size":cfg.model.chunk_size,"max_epochs":cfg.model.max_epochs,
+                "reassignment_ratio":cfg.model.reassignment_ratio,
+            }
+        else:
+            init='k-means++'
+            n_init=80
+            algorithm='lloyd'
+            model = KMeans(n_clusters=n_clusters,init=init,n_init=n_init,algorithm=algorithm)
+            model.fit(embeddings_np)
+            labels = model.labels_
+            params = {"n_clusters":n_clusters,"init":init,"n_init":n_init,"algorithm":algorithm}
         mlflow.sklearn.log_model(model, run_name)
-        mlflow.log_params(({"n_clusters":n_clusters,"init":init,"n_init":n_init,"algorithm":algorithm}))
+        with tempfile.TemporaryDirectory() as centroids_dir:
+            save_centroids(model.cluster_centers_, centroids_dir, run_name=run_name)
+            mlflow.log_artifacts(centroids_dir, artifact_path=f"{run_name}_centroids")
+        mlflow.log_params((params))
         mlflow.set_tag("model","kmeans")
-        labels = model.labels_
         print(labels)
-        silouhette_avg = silhouette_score(embeddings_np, labels)
-        mlflow.log_metric("silhouette score",silouhette_avg)
+        silhouette = compute_silhouette(values, embeddings_np if not minibatch else None, labels, model.cluster_centers_, cfg.model)
+        mlflow.log_param("silhouette_mode", silhouette["mode"])
+        mlflow.log_param("silhouette_sample_size", silhouette["sample_size"])
+        mlflow.log_metric(silhouette["metric"],silhouette["score"])
+        if "ci_low" in silhouette:
+            mlflow.log_metrics({f"{silhouette['metric']} ci low": silhouette["ci_low"], f"{silhouette['metric']} ci high": silhouette["ci_high"]})
         df['clusters'] = labels
-        df['resulted_embeddings'] = [json.dumps(embedding) for embedding in df['resulted_embeddings']]
-        df.to_sql('incidents_clusters',con=engine,if_exists='append',index=False)
+        if embeddings is None or 'resulted_embeddings' not in df:
+            # Export format of the embeddings (legacy JSON rows are converted to the binary format)
+            if minibatch:
+                df['resulted_embeddings'] = [embedding for _, chunk in iter_embedding_chunks(values, cfg.model.chunk_size) for embedding in encode_embeddings(chunk)]
+            else:
+                df['resulted_embeddings'] = encode_embeddings(embeddings_np)
+        if write_results:
+            bulk_load(df,'incidents_clusters',if_exists='append',dtype={'resulted_embeddings': LargeBinary})
         run_id = run.info.run_id
     
     return run_id,df
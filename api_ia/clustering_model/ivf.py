@@ -0,0 +1,208 @@
+import threading
+import time
+import numpy as np
+from api_ia.clustering_model.centroids import CentroidAssigner
+
+INDEX_DTYPES = ("float32", "int8")
+
+
+class _InvertedList:
+    """
+    Contiguous, growable storage of the vectors of one cluster.
+
+    int8 vectors are quantized symmetrically with one scale per vector (`x ≈ q * scale / 127`). The squared
+    norm of each stored vector is kept to compute L2 distances with a single matrix-vector product. Removed
+    rows keep their slot with an infinite norm, so they never come out of a search.
+    """
+
+    def __init__(self, dim, dtype, capacity):
+        self.vectors = np.empty((capacity, dim), dtype=np.int8 if dtype == "int8" else np.float32)
+        self.scales = np.ones(capacity, dtype=np.float32)
+        self.sq_norms = np.empty(capacity, dtype=np.float32)
+        self.ids = []
+        self.size = 0
+
+    def append(self, incident_id, vector):
+        if self.size == self.vectors.shape[0]:
+            self._grow()
+        row = self.size
+        self.set(row, vector)
+        self.ids.append(incident_id)
+        self.size += 1
+        return row
+
+    def set(self, row, vector):
+        if self.vectors.dtype == np.int8:
+            scale = max(float(np.abs(vector).max()), 1e-12) / 127
+            quantized = np.clip(np.rint(vector / scale), -127, 127).astype(np.int8)
+            self.vectors[row] = quantized
+            self.scales[row] = scale
+            stored = quantized.astype(np.float32) * scale
+        else:
+            self.vectors[row] = vector
+            stored = vector
+        self.sq_norms[row] = stored @ stored
+
+    def remove(self, row):
+        self.sq_norms[row] = np.inf
+
+    def _grow(self):
+        capacity = max(2 * self.vectors.shape[0], 1)
+        for name in ("vectors", "scales", "sq_norms"):
+            array = getattr(self, name)
+            grown = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+            grown[:self.size] = array[:self.size]
+            # Searches running concurrently keep the array they already read
+            setattr(self, name, grown)
+
+    def distances(self, query, query_sq_norm):
+        size = self.size
+        dots = self.vectors[:size] @ query
+        if self.vectors.dtype == np.int8:
+            dots *= self.scales[:size]
+        return query_sq_norm - 2 * dots + self.sq_norms[:size], self.ids[:size]
+
+
+class IVFIndex:
+    """
+    In-memory inverted-file (IVF) index of incident embeddings, using the KMeans clusters as coarse lists.
+
+    Each incident is stored in the list of its nearest centroid, as a row of a contiguous float32 or
+    int8-quantized array. A top-k query only scans the lists of the `n_probe` centroids nearest to it, i.e.
+    roughly `n_probe / n_clusters` of the incidents. Incidents can be added one by one as they are predicted;
+    adding an incident already in the index replaces its vector.
+
+    Writes are serialized with a lock; searches do not take it.
+
+    Args:
+        cluster_centers (np.ndarray): The (n_clusters, dim) centroid matrix of the clustering model.
+        dtype (str): Storage type of the vectors, 'float32' or 'int8'.
+        initial_capacity (int): Initial number of rows allocated per list.
+
+    Raises:
+        ValueError: If the storage type is not supported.
+    """
+
+    def __init__(self, cluster_centers, dtype="float32", initial_capacity=64):
+        if dtype not in INDEX_DTYPES:
+            raise ValueError(f"Unsupported index dtype '{dtype}', expected one of {INDEX_DTYPES}")
+        self.assigner = CentroidAssigner(cluster_centers)
+        self.dtype = dtype
+        self._lists = [_InvertedList(self.assigner.dim, dtype, initial_capacity) for _ in range(self.assigner.n_clusters)]
+        # incident id -> (list number, row)
+        self._positions = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._positions)
+
+    def add(self, incident_ids, embeddings):
+        """
+        Adds incidents to the index, or replaces the vectors of incidents already in it.
+
+        Args:
+            incident_ids (list): The incident numbers.
+            embeddings (array-like): The (n, dim) embedding matrix of the incidents, in the same order.
+        """
+        embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        if len(incident_ids) == 0:
+            return
+        clusters = self.assigner.predict(embeddings)
+        with self._lock:
+            for incident_id, cluster, embedding in zip(incident_ids, clusters, embeddings):
+                position = self._positions.get(incident_id)
+                if position is not None and position[0] == cluster:
+                    self._lists[cluster].set(position[1], embedding)
+                    continue
+                if position is not None:
+                    self._lists[position[0]].remove(position[1])
+                self._positions[incident_id] = (int(cluster), self._lists[cluster].append(incident_id, embedding))
+
+    def search(self, query, k=10, n_probe=4):
+        """
+        Finds the stored incidents nearest to a query embedding.
+
+        Args:
+            query (array-like): The query embedding.
+            k (int): Number of incidents to return.
+            n_probe (int): Number of lists (nearest centroids) scanned.
+
+        Returns:
+            list: Up to `k` (incident id, squared L2 distance) pairs, nearest first.
+        """
+        query = np.asarray(query, dtype=np.float32).ravel()
+        n_probe = min(n_probe, self.assigner.n_clusters)
+        centroid_distances = self.assigner.distances(query)[0]
+        probes = np.argpartition(centroid_distances, n_probe - 1)[:n_probe]
+        return self._top_k(query, k, [self._lists[probe] for probe in probes])
+
+    def brute_force_search(self, query, k=10):
+        """
+        Finds the stored incidents nearest to a query embedding by scanning every list (reference for `search`).
+
+        Returns:
+            list: Up to `k` (incident id, squared L2 distance) pairs, nearest first.
+        """
+        query = np.asarray(query, dtype=np.float32).ravel()
+        return self._top_k(query, k, self._lists)
+
+    @staticmethod
+    def _top_k(query, k, lists):
+        query_sq_norm = query @ query
+        all_distances, all_ids = [], []
+        for inverted_list in lists:
+            distances, ids = inverted_list.distances(query, query_sq_norm)
+            all_distances.append(distances)
+            all_ids.extend(ids)
+        if not all_ids:
+            return []
+        distances = np.concatenate(all_distances)
+        k = min(k, int(np.isfinite(distances).sum()))
+        if k == 0:
+            return []
+        nearest = np.argpartition(distances, k - 1)[:k]
+        nearest = nearest[np.argsort(distances[nearest])]
+        return [(all_ids[i], max(float(distances[i]), 0.0)) for i in nearest]
+
+
+def evaluate_index(index, embeddings, queries, k=10, n_probe=4):
+    """
+    Measures the recall and latency of an IVF index against an exact float32 brute-force search.
+
+    The recall is the share of the true `k` nearest neighbours (computed on `embeddings`, the original
+    vectors indexed by their position) returned by `index.search`. It accounts for both the probing and
+    the int8 quantization.
+
+    Args:
+        index (IVFIndex): The index, holding `embeddings` under the ids 0..n-1.
+        embeddings (np.ndarray): The (n, dim) matrix of the indexed embeddings.
+        queries (np.ndarray): The (q, dim) matrix of query embeddings.
+        k (int): Number of neighbours per query.
+        n_probe (int): Number of lists scanned per query.
+
+    Returns:
+        dict: The mean recall@k and the mean latency (in milliseconds) of the IVF and brute-force searches.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+    sq_norms = np.einsum("ij,ij->i", embeddings, embeddings)
+
+    recalls, ivf_seconds, brute_force_seconds = [], 0.0, 0.0
+    for query in queries:
+        start = time.perf_counter()
+        exact = np.argpartition(sq_norms - 2 * (embeddings @ query), k - 1)[:k]
+        brute_force_seconds += time.perf_counter() - start
+
+        start = time.perf_counter()
+        found = index.search(query, k=k, n_probe=n_probe)
+        ivf_seconds += time.perf_counter() - start
+
+        recalls.append(len(set(exact.tolist()) & {incident_id for incident_id, _ in found}) / k)
+
+    return {
+        "recall": float(np.mean(recalls)),
+        "ivf_ms": 1000 * ivf_seconds / len(queries),
+        "brute_force_ms": 1000 * brute_force_seconds / len(queries),
+        "k": k,
+        "n_probe": n_probe,
+    }
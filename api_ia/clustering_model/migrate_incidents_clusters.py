@@ -0,0 +1,71 @@
+import logging
+import pandas as pd
+from sqlalchemy import inspect, MetaData, Table, LargeBinary
+from api_ia.clustering_model.utils import create_sql_server_engine, bulk_load, _python_type, _swap_table
+from api_ia.embeddings.codec import encode_embedding, decode_embedding
+
+logger = logging.getLogger(__name__)
+
+# Number of rows read and converted at a time
+MIGRATION_CHUNK_SIZE = 10000
+
+
+def _encode_stored_embedding(value, dtype):
+    embedding = decode_embedding(value)
+    return encode_embedding(embedding, dtype) if embedding is not None else None
+
+
+def migrate_incidents_clusters(engine=None, table_name="incidents_clusters", chunk_size=MIGRATION_CHUNK_SIZE, dtype=None):
+    """
+    Converts the JSON text embeddings of the `incidents_clusters` table into the binary format.
+
+    The table is only ever appended to, so the rows written before the binary format still hold their
+    embeddings as JSON in a NVARCHAR(max) column, which cannot hold the binary embeddings of the next training
+    runs. This function:
+    1. Returns immediately if the table does not exist or its `resulted_embeddings` column is already binary.
+    2. Copies the table into `<table_name>_migrated`, `chunk_size` rows at a time, with the same column types
+       except for `resulted_embeddings`, which becomes VARBINARY(max) and holds the converted embeddings.
+    3. Replaces the table by the migrated copy in a single transaction.
+
+    The migration can be interrupted and run again: the partial copy is dropped and the table is left unchanged
+    until the last step. Rows appended to the table while it runs are lost, so it must not run at the same time
+    as a training upload.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): The engine of the database. Defaults to `create_sql_server_engine()`.
+        table_name (str): The name of the table.
+        chunk_size (int): Number of rows converted at a time.
+        dtype (str): 'float32' or 'float16'. Defaults to the EMBEDDING_STORAGE_DTYPE environment variable.
+
+    Returns:
+        int: The number of migrated rows, 0 if the table did not need a migration.
+    """
+    engine = engine if engine is not None else create_sql_server_engine()
+    if not inspect(engine).has_table(table_name):
+        return 0
+    existing = Table(table_name, MetaData(), autoload_with=engine)
+    if _python_type(existing.c.resulted_embeddings.type) is bytes:
+        return 0
+
+    migrated_name = f"{table_name}_migrated"
+    columns = [column.name for column in existing.columns]
+    types = {column.name: column.type for column in existing.columns}
+    types["resulted_embeddings"] = LargeBinary()
+    # The copy is created from an empty frame, so that it gets every column type even if the table is empty
+    bulk_load(pd.DataFrame(columns=columns), migrated_name, engine, if_exists="replace", dtype=types)
+
+    n_migrated = 0
+    for chunk in pd.read_sql(existing.select(), engine, chunksize=chunk_size):
+        chunk["resulted_embeddings"] = [_encode_stored_embedding(value, dtype) for value in chunk["resulted_embeddings"]]
+        bulk_load(chunk, migrated_name, engine, if_exists="append", dtype=types)
+        n_migrated += len(chunk)
+        logger.info("%s: %d rows migrated", table_name, n_migrated)
+
+    with engine.begin() as connection:
+        _swap_table(connection, migrated_name, table_name, columns, "replace")
+    return n_migrated
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    migrate_incidents_clusters()
@@ -0,0 +1,114 @@
+import numpy as np
+from sklearn.metrics import silhouette_score, silhouette_samples
+from api_ia.clustering_model.centroids import CentroidAssigner
+
+SILHOUETTE_MODES = ("exact", "sampled", "centroid")
+
+# Name of the MLflow metric of each mode. The simplified silhouette is a different measure, logged under its
+# own name so that runs are only ranked against runs with a comparable score.
+SILHOUETTE_METRICS = {
+    "exact": "silhouette score",
+    "sampled": "silhouette score",
+    "centroid": "simplified silhouette score",
+}
+
+
+def stratified_sample(labels, sample_size, random_state=0):
+    """
+    Draws a sample of indices with the same cluster proportions as the whole dataset.
+
+    Each cluster contributes `sample_size * cluster size / n` indices (at least 2 when the cluster has them,
+    so that every cluster has an intra-cluster distance).
+
+    Args:
+        labels (np.ndarray): The (n,) cluster labels.
+        sample_size (int): The target number of indices.
+        random_state (int): Seed of the sample.
+
+    Returns:
+        np.ndarray: The sorted sampled indices.
+    """
+    labels = np.asarray(labels)
+    rng = np.random.RandomState(random_state)
+    sample = []
+    for cluster in np.unique(labels):
+        members = np.flatnonzero(labels == cluster)
+        n_members = min(len(members), max(2, int(round(sample_size * len(members) / len(labels)))))
+        sample.append(rng.choice(members, n_members, replace=False))
+    return np.sort(np.concatenate(sample))
+
+
+def simplified_silhouette(embeddings, labels, cluster_centers, chunk_size=10000):
+    """
+    Computes the simplified (centroid) silhouette in O(n·k): the distance of each point to its own centroid
+    plays the role of the mean intra-cluster distance, and the distance to the nearest other centroid the
+    role of the mean distance to the nearest other cluster.
+
+    Args:
+        embeddings (array-like): The (n, dim) embedding matrix.
+        labels (np.ndarray): The (n,) cluster labels.
+        cluster_centers (np.ndarray): The (k, dim) centroid matrix.
+        chunk_size (int): Number of points whose distances to the centroids are held in memory at a time.
+
+    Returns:
+        np.ndarray: The (n,) simplified silhouette of each point.
+    """
+    assigner = CentroidAssigner(cluster_centers)
+    labels = np.asarray(labels)
+    values = np.empty(len(labels), dtype=np.float64)
+    for start in range(0, len(labels), chunk_size):
+        distances = np.sqrt(assigner.distances(embeddings[start:start + chunk_size]))
+        rows = np.arange(distances.shape[0])
+        own = distances[rows, labels[start:start + chunk_size]]
+        distances[rows, labels[start:start + chunk_size]] = np.inf
+        other = distances.min(axis=1)
+        denominator = np.maximum(own, other)
+        # A point on its centroid with every other centroid at the same place gets 0, like sklearn
+        denominator[denominator == 0] = np.inf
+        values[start:start + len(rows)] = (other - own) / denominator
+    return values
+
+
+def estimate_silhouette(embeddings, labels, mode="exact", sample_size=20000, random_state=0, cluster_centers=None):
+    """
+    Estimates the silhouette score of a clustering.
+
+    Three modes are available:
+    - `exact`: the silhouette over all the points, O(n²) in time.
+    - `sampled`: the silhouette of a stratified sample of `sample_size` points (same cluster proportions,
+      fixed seed), with a 95% confidence interval computed from the silhouettes of the sampled points.
+    - `centroid`: the simplified silhouette, based on the distances to the centroids, O(n·k).
+
+    Args:
+        embeddings (array-like): The (n, dim) embedding matrix.
+        labels (np.ndarray): The (n,) cluster labels.
+        mode (str): 'exact', 'sampled' or 'centroid'.
+        sample_size (int): Number of sampled points in `sampled` mode.
+        random_state (int): Seed of the sample.
+        cluster_centers (np.ndarray): The centroid matrix, required in `centroid` mode.
+
+    Returns:
+        dict: The `score`, the `mode`, the `metric` name to log it under, the number of points it was computed
+            on (`sample_size`) and, in `sampled` mode, the bounds of its confidence interval (`ci_low`, `ci_high`).
+
+    Raises:
+        ValueError: If the mode is unknown, or if the centroids are missing in `centroid` mode.
+    """
+    if mode not in SILHOUETTE_MODES:
+        raise ValueError(f"Unknown silhouette mode '{mode}', expected one of {SILHOUETTE_MODES}")
+    labels = np.asarray(labels)
+    estimate = {"mode": mode, "metric": SILHOUETTE_METRICS[mode]}
+
+    if mode == "exact":
+        estimate.update(score=float(silhouette_score(embeddings, labels)), sample_size=len(labels))
+    elif mode == "sampled":
+        sample = stratified_sample(labels, sample_size, random_state) if sample_size < len(labels) else np.arange(len(labels))
+        values = silhouette_samples(np.asarray(embeddings[sample]), labels[sample])
+        margin = 1.96 * values.std(ddof=1) / np.sqrt(len(values)) if len(values) > 1 else 0.0
+        score = float(values.mean())
+        estimate.update(score=score, sample_size=len(sample), ci_low=float(score - margin), ci_high=float(score + margin))
+    else:
+        if cluster_centers is None:
+            raise ValueError("The centroid silhouette needs the cluster centers")
+        estimate.update(score=float(simplified_silhouette(embeddings, labels, cluster_centers).mean()), sample_size=len(labels))
+    return estimate
@@ -0,0 +1,70 @@
+import pytest
+import numpy as np
+from sklearn.cluster import KMeans
+from api_ia.clustering_model.ivf import IVFIndex, evaluate_index
+
+
+@pytest.fixture(scope="module")
+def clustered_embeddings():
+    """
+    Fixture that creates 4000 embeddings around 20 centers and the KMeans centroids fitted on them.
+
+    Returns:
+        tuple: The (4000, 32) float32 embeddings and the (20, 32) centroid matrix.
+    """
+    rng = np.random.RandomState(0)
+    centers = rng.normal(size=(20, 32)) * 3
+    embeddings = (centers[rng.randint(0, 20, 4000)] + rng.normal(size=(4000, 32))).astype(np.float32)
+    model = KMeans(n_clusters=20, n_init=1, random_state=0).fit(embeddings)
+    return embeddings, model.cluster_centers_
+
+
+@pytest.mark.parametrize("dtype, min_recall", [("float32", 0.95), ("int8", 0.9)])
+def test_ivf_recall_against_brute_force(clustered_embeddings, dtype, min_recall):
+    """
+    Test that probing a few lists finds the nearest neighbours of a brute-force search.
+
+    Asserts:
+        assert: Ensures the recall@10 of the index is at least `min_recall`.
+    """
+    embeddings, cluster_centers = clustered_embeddings
+    index = IVFIndex(cluster_centers, dtype=dtype, initial_capacity=8)
+    index.add(list(range(len(embeddings))), embeddings)
+
+    queries = embeddings[:100] + 0.1 * np.random.RandomState(1).normal(size=(100, 32)).astype(np.float32)
+    metrics = evaluate_index(index, embeddings, queries, k=10, n_probe=4)
+
+    assert len(index) == len(embeddings)
+    assert metrics["recall"] >= min_recall
+    assert metrics["ivf_ms"] > 0 and metrics["brute_force_ms"] > 0
+
+
+def test_ivf_incremental_inserts(clustered_embeddings):
+    """
+    Test that incidents added one by one are searchable and that adding an incident again replaces its vector.
+
+    Asserts:
+        assert: Ensures the nearest incident of a query is the incident added with this vector.
+    """
+    embeddings, cluster_centers = clustered_embeddings
+    index = IVFIndex(cluster_centers)
+    index.add(["INC1", "INC2"], embeddings[:2])
+
+    assert index.search(embeddings[0], k=1)[0][0] == "INC1"
+
+    index.add(["INC1"], embeddings[500:501])
+
+    assert len(index) == 2
+    assert index.search(embeddings[500], k=1)[0][0] == "INC1"
+    # The replaced vector of INC1 is no longer returned
+    distances = dict(index.brute_force_search(embeddings[0], k=5))
+    assert sorted(distances) == ["INC1", "INC2"]
+    assert distances["INC1"] == pytest.approx(float(np.sum((embeddings[500] - embeddings[0]) ** 2)), rel=1e-3)
+
+
+def test_ivf_rejects_unknown_dtype(clustered_embeddings):
+    """
+    Test that an unsupported storage type raises a ValueError.
+    """
+    with pytest.raises(ValueError):
+        IVFIndex(clustered_embeddings[1], dtype="float16")
@@ -0,0 +1,103 @@
+import os
+import pytest
+import numpy as np
+import pandas as pd
+from api_ia.model.pipeline import StageCheckpoints, input_hash
+
+
+def test_stage_checkpoints_skip_unchanged_inputs(tmp_path):
+    """
+    Test that a stage is read from its checkpoint when its inputs did not change, and recomputed otherwise.
+
+    Asserts:
+        assert: Ensures the stage is computed once per distinct input and returns the same outputs from its checkpoint.
+    """
+    checkpoints = StageCheckpoints("kmeans_test", root=str(tmp_path))
+    calls = []
+
+    def compute(stage_dir):
+        calls.append(stage_dir)
+        np.save(os.path.join(stage_dir, "matrix.npy"), np.ones((3, 2), dtype=np.float32))
+        return {"frame": pd.DataFrame({"a": [1, 2, 3]}), "run_id": "abc"}
+
+    key = input_hash("stage", pd.DataFrame({"x": [1, 2]}))
+    first = checkpoints.run("stage", key, compute)
+    second = checkpoints.run("stage", key, compute)
+
+    assert len(calls) == 1
+    assert second["run_id"] == "abc"
+    pd.testing.assert_frame_equal(second["frame"], first["frame"])
+    assert isinstance(second["matrix"], np.memmap) and second["matrix"].shape == (3, 2)
+
+    checkpoints.run("stage", input_hash("stage", pd.DataFrame({"x": [1, 3]})), compute)
+    assert len(calls) == 2
+
+
+def test_stage_checkpoints_ignore_interrupted_stage(tmp_path):
+    """
+    Test that a stage interrupted by an exception leaves no checkpoint, so that it is computed again.
+
+    Asserts:
+        assert: Ensures no checkpoint is found after a failure and the next run computes the stage.
+    """
+    checkpoints = StageCheckpoints("kmeans_test", root=str(tmp_path))
+
+    def failing(stage_dir):
+        pd.DataFrame({"a": [1]}).to_parquet(os.path.join(stage_dir, "partial.parquet"))
+        raise RuntimeError("naming service unavailable")
+
+    with pytest.raises(RuntimeError):
+        checkpoints.run("naming", "key", failing)
+
+    assert checkpoints.load("naming", "key") is None
+    assert checkpoints.run("naming", "key", lambda stage_dir: {"title": "ok"}) == {"title": "ok"}
+
+
+def test_training_resumes_after_failure(mocker, tmp_path):
+    """
+    Test that a training run resumes from the last completed stage after a failure of the naming stage,
+    and uploads the results once.
+
+    Args:
+        mocker (pytest_mock.MockerFixture): The mocker fixture to mock dependencies.
+        tmp_path (Path): Temporary directory of the checkpoints.
+
+    Asserts:
+        assert: Ensures the embeddings and the clustering are computed once and the naming twice.
+        assert: Ensures the results are uploaded once, after the naming succeeded.
+    """
+    from api_ia.model import training as training_module
+
+    incidents = pd.DataFrame({
+        'incident_number': ['INC1', 'INC2'], 'description': ['d1', 'd2'], 'category_full': ['c1', 'c2'],
+        'ci_name': ['ci1', 'ci2'], 'location_full': ['l1', 'l2'],
+    })
+    mocker.patch.object(training_module, 'get_incidents', return_value=incidents)
+    mocker.patch.object(training_module, 'create_sql_server_engine')
+    mocker.patch.object(training_module, 'EMBEDDING_STORE_TABLE', '')
+    mocker.patch.object(training_module, 'StageCheckpoints', lambda run_name: StageCheckpoints(run_name, root=str(tmp_path)))
+
+    def fake_make_embeddings(df, store=None, matrix_path=None):
+        np.save(matrix_path, np.zeros((len(df), 2), dtype=np.float32))
+        return df.assign(docs=df['description'], resulted_embeddings=[b'', b''])
+    make_embeddings = mocker.patch.object(training_module, 'make_embeddings', side_effect=fake_make_embeddings)
+    modelisation = mocker.patch.object(training_module, 'modelisation', side_effect=lambda df, run_name, **kwargs: ('run-1', df.assign(clusters=[0, 1])))
+    make_naming = mocker.patch.object(training_module, 'make_naming', side_effect=[
+        RuntimeError("naming service unavailable"),
+        (pd.DataFrame({'clusters': [0, 1], 'problem_title': ['t0', 't1']}), pd.DataFrame({'cluster': [0, 1], 'problem_title': ['t0', 't1']})),
+    ])
+    upload_results = mocker.patch.object(training_module, 'upload_results')
+
+    with pytest.raises(RuntimeError):
+        training_module.training('kmeans_test', upload=True)
+    run_id = training_module.training('kmeans_test', upload=True)
+    training_module.training('kmeans_test', upload=True)
+
+    assert run_id == 'run-1'
+    assert make_embeddings.call_count == 1
+    assert modelisation.call_count == 1
+    assert isinstance(modelisation.call_args.kwargs['embeddings'], np.memmap)
+    assert modelisation.call_args.kwargs['write_results'] is False
+    assert make_naming.call_count == 2
+    upload_results.assert_called_once()
+    assert upload_results.call_args[0][1]['cluster_titles']['problem_title'].tolist() == ['t0', 't1']
@@ -2,6 +2,8 @@ import pytest
 import pandas as pd
 from api_ia.embeddings.embeddings import clean_dataset, features_selection
 from api_ia.clustering_model.clustering import modelisation
+from api_ia.clustering_model.centroids import CentroidAssigner, save_centroids, load_centroids
+from sklearn.cluster import KMeans
 from api_ia.api.utils import connect_to_sql_server
 import pytest
 from pandas.testing import assert_frame_equal
@@ -145,6 +147,89 @@ def test_make_embeddings():
     assert result_df.columns.tolist() == expected_columns
 
 
+def test_make_embeddings_reuses_store(mocker, tmp_path):
+    """
+    Test that make_embeddings only encodes the incidents missing from the embedding store or whose text changed.
+
+    Asserts:
+        assert: Ensures the second run encodes only the new and the modified incidents.
+        assert: Ensures the embeddings of the unchanged incidents are read from the store.
+        assert: Ensures an empty DataFrame gives an empty embedding matrix.
+    """
+    from sqlalchemy import create_engine
+    from sqlalchemy.pool import StaticPool
+    from api_ia.embeddings.store import IncidentEmbeddingStore
+    from api_ia.embeddings.codec import decode_embeddings
+    from api_ia.embeddings.matrix import load_embedding_matrix
+
+    encoded_docs = []
+    def fake_encode(docs):
+        encoded_docs.extend(docs)
+        return np.array([[float(len(doc)), 1.0] for doc in docs], dtype=np.float32)
+    mocker.patch('sentence_transformers.SentenceTransformer').return_value.encode.side_effect = fake_encode
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    store = IncidentEmbeddingStore(engine, "incident_embeddings")
+    input_df = pd.DataFrame({
+        'incident_number': ['INC1', 'INC2', 'INC3'],
+        'description': ['Desc1', 'Desc2', 'Desc3'],
+        'category_full': ['Cat1', 'Cat2', 'Cat3'],
+        'ci_name': ['CI1', 'CI2', 'CI3'],
+        'location_full': ['Loc1', 'Loc2', 'Loc3'],
+    })
+    first = make_embeddings(input_df, store=store)
+    assert len(encoded_docs) == 3
+
+    encoded_docs.clear()
+    input_df.loc[1, 'description'] = 'Desc2 updated'
+    input_df.loc[3] = ['INC4', 'Desc4', 'Cat4', 'CI4', 'Loc4']
+    second = make_embeddings(input_df, store=store)
+
+    assert [doc.split("\n")[0] for doc in encoded_docs] == ['Desc2 updated', 'Desc4']
+    assert second['resulted_embeddings'].iloc[0] == first['resulted_embeddings'].iloc[0]
+    assert decode_embeddings(second['resulted_embeddings'])[:, 0].tolist() == [float(len(doc)) for doc in second['docs']]
+
+    empty = make_embeddings(input_df.iloc[:0], store=store, matrix_path=str(tmp_path / "embeddings.npy"))
+    assert empty.empty
+    assert load_embedding_matrix(str(tmp_path / "embeddings.npy")).shape == (0, 0)
+
+
+
+class FakeEncoder:
+    """
+    Encoder whose embedding of a document is its length and the code of its last character.
+    """
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def encode(self, docs):
+        return np.array([[len(doc), ord(doc[-1])] for doc in docs], dtype=np.float64)
+
+
+def test_encode_docs_with_worker_processes(mocker):
+    """
+    Test that encoding the documents in a pool of processes gives the same float32 matrix, in the same order,
+    as encoding them in the current process.
+
+    Args:
+        mocker (pytest_mock.MockerFixture): The mocker fixture to mock dependencies.
+
+    Asserts:
+        assert: Ensures both modes return the same float32 embeddings, one row per document.
+    """
+    from api_ia.embeddings.embeddings import encode_docs
+
+    mocker.patch('sentence_transformers.SentenceTransformer', FakeEncoder)
+    docs = pd.Series([f"incident {i} {'x' * i}{i % 7}" for i in range(23)])
+
+    single = encode_docs(docs, workers=1, batch_size=4)
+    pooled = encode_docs(docs, workers=2, batch_size=4)
+
+    assert pooled.dtype == np.float32 and pooled.shape == (23, 2)
+    assert np.array_equal(pooled, single)
+    assert pooled[:, 0].tolist() == [float(len(doc)) for doc in docs]
+
+
 @pytest.fixture
 def sample_dataframe():
     """
@@ -173,6 +258,7 @@ def test_modelisation(mocker, sample_dataframe):
     # Mock create_sql_server_engine
     mock_engine = mocker.MagicMock()
     mocker.patch('api_ia.api.utils.connect_to_sql_server', return_value=mock_engine)
+    mock_bulk_load = mocker.patch('api_ia.clustering_model.clustering.bulk_load')
     
     # Mock mlflow
     mock_mlflow = mocker.patch('api_ia.clustering_model.clustering.mlflow')
@@ -183,12 +269,13 @@ def test_modelisation(mocker, sample_dataframe):
     mock_mlflow.start_run.return_value.__enter__.return_value = mock_run
     
     # Mock cfg
-    mock_cfg = mocker.MagicMock()
-    mock_cfg.model.n_clusters = 2
+    from omegaconf import OmegaConf
+    mock_cfg = OmegaConf.create({"model": {"n_clusters": 2}})
     mocker.patch('api_ia.clustering_model.clustering.cfg', mock_cfg)
     
     # Call the function
     run_id, df_result = modelisation(sample_dataframe, 'test_run')
+    assert mock_bulk_load.call_args[0][1] == 'incidents_clusters'
     
     # Assertions
     assert 'clusters' in df_result.columns
@@ -202,4 +289,257 @@ def test_modelisation(mocker, sample_dataframe):
     mock_mlflow.sklearn.log_model.assert_called_once()
     mock_mlflow.log_params.assert_called_once_with({'n_clusters': 2, 'init': 'k-means++', 'n_init': 80, 'algorithm': 'lloyd'})
     mock_mlflow.set_tag.assert_called_once_with("model", "kmeans")
-    mock_mlflow.log_metric.assert_called_once()
\ No newline at end of file
+    mock_mlflow.log_metric.assert_called_once()
+    mock_mlflow.log_param.assert_any_call("silhouette_mode", "exact")
+    mock_mlflow.log_artifacts.assert_called_once()
+
+
+def test_centroid_assigner_matches_kmeans(tmp_path):
+    """
+    Test that the NumPy centroid assignment gives the same clusters as the sklearn KMeans model,
+    including after a round trip through the centroid artifact.
+
+    Asserts:
+        assert: Ensures the assignments and the artifact metadata are identical.
+    """
+    rng = np.random.RandomState(0)
+    embeddings = rng.rand(200, 16).astype(np.float32)
+    model = KMeans(n_clusters=5, n_init=2, random_state=0).fit(embeddings.astype(np.float64))
+
+    save_centroids(model.cluster_centers_, str(tmp_path), run_name="kmeans_5")
+    assigner = load_centroids(str(tmp_path))
+
+    assert assigner.metadata["run_name"] == "kmeans_5"
+    assert assigner.n_clusters == 5
+    assert np.array_equal(assigner.predict(embeddings), model.predict(embeddings.astype(np.float64)))
+    assert assigner.predict(embeddings[0]).shape == (1,)
+
+
+def test_centroid_assigner_runner_up():
+    """
+    Test that the assignment returns the two nearest centroids and their Euclidean distances, in order.
+
+    Asserts:
+        assert: Ensures the clusters, runner-ups and distances match a full sort of the distances.
+    """
+    rng = np.random.RandomState(0)
+    cluster_centers = rng.rand(8, 16)
+    embeddings = rng.rand(100, 16).astype(np.float32)
+    assigner = CentroidAssigner(cluster_centers)
+
+    clusters, distances, runner_ups, runner_up_distances = assigner.assign(embeddings)
+
+    exact_distances = np.linalg.norm(embeddings[:, None, :] - cluster_centers[None, :, :], axis=2)
+    order = np.argsort(exact_distances, axis=1)
+    assert np.array_equal(clusters, order[:, 0])
+    assert np.array_equal(clusters, assigner.predict(embeddings))
+    assert np.array_equal(runner_ups, order[:, 1])
+    assert np.allclose(distances, exact_distances[np.arange(100), order[:, 0]], atol=1e-4)
+    assert np.allclose(runner_up_distances, exact_distances[np.arange(100), order[:, 1]], atol=1e-4)
+    assert np.all(distances <= runner_up_distances)
+
+
+@pytest.mark.parametrize("from_matrix", [False, True])
+def test_modelisation_minibatch(mocker, tmp_path, from_matrix):
+    """
+    Test the streaming MiniBatchKMeans mode of the modelisation function, on stored embeddings decoded chunk by
+    chunk and on a memory-mapped embedding matrix.
+
+    Args:
+        mocker (pytest_mock.MockerFixture): The mocker fixture to mock dependencies.
+        tmp_path (Path): Temporary directory of the `.npy` embedding matrix.
+        from_matrix (bool): Whether the embeddings are passed as a memory-mapped matrix.
+
+    Asserts:
+        assert: Ensures every incident gets a cluster and the run logs the same params and metric as a KMeans run.
+    """
+    from omegaconf import OmegaConf
+    from api_ia.embeddings.codec import encode_embedding, decode_embeddings
+    from api_ia.embeddings.matrix import save_embedding_matrix
+
+    rng = np.random.RandomState(0)
+    embeddings = np.vstack([rng.normal(loc, 0.1, size=(50, 8)) for loc in (-2, 0, 2)])
+    if from_matrix:
+        df = pd.DataFrame({"incident_number": range(150)})
+        matrix = save_embedding_matrix(embeddings, str(tmp_path / "embeddings.npy"))
+    else:
+        df = pd.DataFrame({"resulted_embeddings": [encode_embedding(embedding) for embedding in embeddings]})
+        matrix = None
+
+    mock_bulk_load = mocker.patch('api_ia.clustering_model.clustering.bulk_load')
+    mock_mlflow = mocker.patch('api_ia.clustering_model.clustering.mlflow')
+    mock_mlflow.get_experiment_by_name.return_value.experiment_id = 1
+    mock_cfg = OmegaConf.create({"model": {
+        "training_mode": "minibatch", "n_clusters": 3, "init": "k-means++", "n_init": 3, "batch_size": 16,
+        "chunk_size": 40, "max_epochs": 3, "reassignment_ratio": 0.01, "random_state": 0, "silhouette_sample_size": 100,
+    }})
+    mocker.patch('api_ia.clustering_model.clustering.cfg', mock_cfg)
+
+    run_id, df_result = modelisation(df, 'test_run', embeddings=matrix)
+    mock_bulk_load.assert_called_once()
+    assert mock_bulk_load.call_args[0][1] == 'incidents_clusters'
+
+    assert len(df_result) == 150
+    assert np.allclose(decode_embeddings(df_result['resulted_embeddings']), embeddings.astype(np.float32))
+    # Each blob of 50 incidents ends up in its own cluster
+    assert sorted(df_result.groupby('clusters').size().tolist()) == [50, 50, 50]
+    params = mock_mlflow.log_params.call_args[0][0]
+    assert params["algorithm"] == "minibatch"
+    assert params["n_clusters"] == 3
+    mock_mlflow.log_param.assert_any_call("silhouette_mode", "sampled")
+    # Stratified sample: 33 incidents of each cluster
+    mock_mlflow.log_param.assert_any_call("silhouette_sample_size", 99)
+    mock_mlflow.log_metric.assert_called_once()
+    assert mock_mlflow.log_metric.call_args[0][0] == "silhouette score"
+    mock_mlflow.log_artifacts.assert_called_once()
+
+
+def test_sweep_selects_best_n_clusters(mocker):
+    """
+    Test that the n_clusters sweep fits every candidate in worker processes, logs one child run per candidate
+    and selects the number of clusters with the best selection metric.
+
+    Args:
+        mocker (pytest_mock.MockerFixture): The mocker fixture to mock dependencies.
+
+    Asserts:
+        assert: Ensures the 3 well-separated blobs give 3 clusters and every candidate is logged.
+    """
+    from omegaconf import OmegaConf
+    from api_ia.model.sweep import sweep
+    from api_ia.embeddings.codec import encode_embedding
+
+    rng = np.random.RandomState(0)
+    embeddings = np.vstack([rng.normal(loc, 0.1, size=(60, 8)) for loc in (-2, 0, 2)])
+    df = pd.DataFrame({"resulted_embeddings": [encode_embedding(embedding) for embedding in embeddings]})
+    mock_mlflow = mocker.patch('api_ia.model.sweep.mlflow')
+    mock_mlflow.get_experiment_by_name.return_value.experiment_id = 1
+    sweep_cfg = OmegaConf.create({
+        "n_clusters": [2, 3, 5], "n_init": 2, "selection_metric": "silhouette score", "silhouette_mode": "sampled",
+        "max_workers": 2, "silhouette_sample_size": 1000, "random_state": 0,
+    })
+
+    best_n_clusters, df_results = sweep(df, sweep_cfg=sweep_cfg)
+
+    assert best_n_clusters == 3
+    assert sorted(df_results["n_clusters"]) == [2, 3, 5]
+    # One parent run and one child run per candidate
+    assert mock_mlflow.start_run.call_count == 4
+    assert mock_mlflow.sklearn.log_model.call_count == 3
+    mock_mlflow.log_metric.assert_any_call("best n_clusters", 3)
+
+    with pytest.raises(ValueError):
+        sweep(df, sweep_cfg=OmegaConf.merge(sweep_cfg, {"selection_metric": "accuracy"}))
+
+
+@pytest.mark.parametrize("mode", ["exact", "sampled", "centroid"])
+def test_estimate_silhouette(mode):
+    """
+    Test the silhouette estimators against the exact silhouette score.
+
+    Asserts:
+        assert: Ensures the sampled estimate is close to the exact score with a confidence interval around it,
+            and the simplified silhouette is computed on every point.
+    """
+    from sklearn.metrics import silhouette_score
+    from api_ia.clustering_model.silhouette import estimate_silhouette
+
+    rng = np.random.RandomState(0)
+    embeddings = np.vstack([rng.normal(loc, 1.0, size=(400, 8)) for loc in (-2, 0, 2)])
+    model = KMeans(n_clusters=3, n_init=2, random_state=0).fit(embeddings)
+    exact = silhouette_score(embeddings, model.labels_)
+
+    estimate = estimate_silhouette(embeddings, model.labels_, mode=mode, sample_size=300, random_state=0, cluster_centers=model.cluster_centers_)
+
+    assert estimate["mode"] == mode
+    if mode == "exact":
+        assert estimate["score"] == pytest.approx(exact)
+        assert estimate["metric"] == "silhouette score"
+    elif mode == "sampled":
+        assert estimate["sample_size"] == 300
+        assert estimate["ci_low"] < estimate["score"] < estimate["ci_high"]
+        assert abs(estimate["score"] - exact) < 0.05
+        assert estimate == estimate_silhouette(embeddings, model.labels_, mode=mode, sample_size=300, random_state=0)
+    else:
+        assert estimate["sample_size"] == 1200
+        assert estimate["metric"] == "simplified silhouette score"
+        assert -1 <= estimate["score"] <= 1
+
+
+@pytest.mark.parametrize("staging", [False, True])
+def test_bulk_load(staging):
+    """
+    Test that bulk_load loads a DataFrame in chunks with explicit column types, appends to or replaces the
+    table (appending columns in another order, by name), and reports its throughput.
+
+    Args:
+        staging (bool): Whether the rows are loaded through a staging table.
+
+    Asserts:
+        assert: Ensures the table holds the loaded rows, with NULL for missing values and bytes for binary columns.
+        assert: Ensures no staging table is left behind.
+    """
+    from sqlalchemy import create_engine, inspect
+    from sqlalchemy.pool import StaticPool
+    from api_ia.clustering_model.utils import bulk_load, sql_column_types
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    df = pd.DataFrame({
+        "incident_number": ["INC1", "INC2", "INC3", "INC4", "INC5"],
+        "clusters": np.arange(5),
+        "score": [0.5, None, 1.5, 2.0, 2.5],
+        "resulted_embeddings": [bytes([1, 1, i]) for i in range(5)],
+    })
+    types = sql_column_types(df)
+    assert types["incident_number"].length == 4
+    assert type(types["resulted_embeddings"]).__name__ == "LargeBinary"
+
+    report = bulk_load(df, "loaded", engine, chunk_size=2, staging=staging)
+    # Texts of a table created by an append are not sized on the first load
+    assert "VARCHAR(" not in str(inspect(engine).get_columns("loaded")[0]["type"])
+    longer = df.iloc[:2].assign(incident_number=["INC0000001", "INC0000002"])[["clusters", "incident_number", "score", "resulted_embeddings"]]
+    bulk_load(longer, "loaded", engine, if_exists="append", chunk_size=2, staging=staging)
+
+    loaded = pd.read_sql("SELECT * FROM loaded", engine)
+    assert report["rows"] == 5 and report["rows_per_second"] > 0
+    assert len(loaded) == 7
+    assert loaded["incident_number"].tolist()[-2:] == ["INC0000001", "INC0000002"]
+    assert loaded["score"].isna().sum() == 2
+    assert loaded["resulted_embeddings"].iloc[3] == bytes([1, 1, 3])
+
+    bulk_load(df.iloc[:1], "loaded", engine, if_exists="replace")
+    assert pd.read_sql("SELECT * FROM loaded", engine)["incident_number"].tolist() == ["INC1"]
+    assert inspect(engine).get_table_names() == ["loaded"]
+
+
+def test_bulk_load_rejects_conflicting_type_and_migrates_incidents_clusters():
+    """
+    Test that appending binary embeddings to a text column is refused, and that migrating `incidents_clusters`
+    converts its JSON text embeddings to binary so that the append succeeds.
+
+    Asserts:
+        assert: Ensures bulk_load raises a ValueError on the conflicting column.
+        assert: Ensures the migrated table keeps its rows and holds binary embeddings decoding to the same values.
+    """
+    from sqlalchemy import create_engine, LargeBinary, Text
+    from sqlalchemy.pool import StaticPool
+    from api_ia.clustering_model.utils import bulk_load
+    from api_ia.clustering_model.migrate_incidents_clusters import migrate_incidents_clusters
+    from api_ia.embeddings.codec import encode_embedding, decode_embeddings
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    legacy = pd.DataFrame({"incident_number": ["INC1", "INC2", "INC3"], "clusters": [0, 1, 1], "resulted_embeddings": ["[0.5, 1.0]", "[[1.5, 2.0]]", None]})
+    bulk_load(legacy, "incidents_clusters", engine, dtype={"resulted_embeddings": Text})
+    new_rows = pd.DataFrame({"incident_number": ["INC4"], "clusters": [0], "resulted_embeddings": [encode_embedding(np.array([3.0, 4.0]))]})
+
+    with pytest.raises(ValueError, match="resulted_embeddings"):
+        bulk_load(new_rows, "incidents_clusters", engine, dtype={"resulted_embeddings": LargeBinary})
+
+    assert migrate_incidents_clusters(engine, chunk_size=2) == 3
+    assert migrate_incidents_clusters(engine) == 0
+    bulk_load(new_rows, "incidents_clusters", engine, dtype={"resulted_embeddings": LargeBinary})
+
+    migrated = pd.read_sql("SELECT * FROM incidents_clusters", engine)
+    assert migrated["clusters"].tolist() == [0, 1, 1, 0]
+    assert migrated["resulted_embeddings"].isna().tolist() == [False, False, True, False]
+    assert decode_embeddings(migrated["resulted_embeddings"].dropna()).tolist() == [[0.5, 1.0], [1.5, 2.0], [3.0, 4.0]]
@@ -1,9 +1,23 @@
 import os 
+import time
+import logging
 import pyodbc 
 import pandas as pd 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text, MetaData, Table, Column
+from sqlalchemy import BigInteger, Float, Boolean, DateTime, LargeBinary, Unicode, UnicodeText
+from sqlalchemy.types import to_instance
 from dotenv import load_dotenv
 
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Number of rows inserted per transaction by `bulk_load`
+BULK_LOAD_CHUNK_SIZE = int(os.getenv("BULK_LOAD_CHUNK_SIZE", 10000))
+
+# Longest string stored in a NVARCHAR(n) column, longer texts are stored in NVARCHAR(max)
+_MAX_NVARCHAR_LENGTH = 4000
+
 
 def create_sql_server_conn():
     """
@@ -29,13 +43,16 @@ def create_sql_server_conn():
     return conn
 
 
-def create_sql_server_engine(): 
+def create_sql_server_engine(database=None): 
     """
     Creates an SQLAlchemy engine for connecting to an Azure SQL Server database.
 
     This function uses environment variables to retrieve database connection details and constructs
     an SQLAlchemy connection string. It then creates and returns an SQLAlchemy engine for interacting
-    with the Azure SQL Server.
+    with the Azure SQL Server. Inserts of many rows are sent in batches (pyodbc `fast_executemany`).
+
+    Args:
+        database (str): The name of the database. Defaults to the AZURE_DATABASE_NAME environment variable.
 
     Returns:
         sqlalchemy.engine.base.Engine: An SQLAlchemy engine object configured for the Azure SQL Server.
@@ -45,12 +62,12 @@ def create_sql_server_engine():
     """
     load_dotenv()
     server = os.getenv("AZURE_SERVER_NAME")
-    database = os.getenv("AZURE_DATABASE_NAME")
+    database = database or os.getenv("AZURE_DATABASE_NAME")
     username = os.getenv("AZURE_DATABASE_USERNAME")
     password = os.getenv("AZURE_DATABASE_PASSWORD")
     
     azure_connection_string = f"mssql+pyodbc://{username}:{password}@{server}/{database}?driver=ODBC+Driver+17+for+SQL+Server"
-    engine = create_engine(azure_connection_string)
+    engine = create_engine(azure_connection_string, fast_executemany=True)
     return engine
 
 def query_db(query):
@@ -71,4 +88,149 @@ def query_db(query):
     """
     engine = create_sql_server_engine()
     with engine.connect() as connection:
-        return pd.read_sql(query, connection)
\ No newline at end of file
+        return pd.read_sql(query, connection)
+
+
+def sql_column_types(df, dtype=None, sized_texts=True):
+    """
+    Infers an explicit SQL type for each column of a DataFrame.
+
+    Integers are stored as BIGINT, floats as FLOAT, booleans as BIT, dates as DATETIME and bytes as
+    VARBINARY(max). With `sized_texts`, texts are stored as NVARCHAR(n), n being the length of the longest text
+    rounded up to a power of two, or as NVARCHAR(max) above 4000 characters: unlike the NVARCHAR(max) columns
+    created by `DataFrame.to_sql`, they can be bound in batches by `fast_executemany`. Without it, texts are
+    stored as NVARCHAR(max), for tables that later loads append longer texts to.
+
+    Args:
+        df (pd.DataFrame): The DataFrame.
+        dtype (dict): Optional SQLAlchemy types of some columns, overriding the inferred ones.
+        sized_texts (bool): Whether to size the text columns on the texts of the DataFrame.
+
+    Returns:
+        dict: The SQLAlchemy type of each column.
+    """
+    types = {}
+    for column in df.columns:
+        series = df[column]
+        if pd.api.types.is_bool_dtype(series):
+            types[column] = Boolean()
+        elif pd.api.types.is_integer_dtype(series):
+            types[column] = BigInteger()
+        elif pd.api.types.is_float_dtype(series):
+            types[column] = Float()
+        elif pd.api.types.is_datetime64_any_dtype(series):
+            types[column] = DateTime()
+        else:
+            values = series.dropna()
+            if len(values) and all(isinstance(value, (bytes, bytearray, memoryview)) for value in values):
+                types[column] = LargeBinary()
+            elif not sized_texts:
+                types[column] = UnicodeText()
+            else:
+                length = int(values.astype(str).str.len().max()) if len(values) else 1
+                length = 1 << max(length - 1, 0).bit_length()
+                types[column] = Unicode(length) if length <= _MAX_NVARCHAR_LENGTH else UnicodeText()
+    types.update(dtype or {})
+    return types
+
+
+def _python_type(sql_type):
+    """
+    Returns the Python type of the values of a SQL type (class or instance), or None if SQLAlchemy does not know it.
+    """
+    try:
+        return to_instance(sql_type).python_type
+    except NotImplementedError:
+        return None
+
+
+def _swap_table(connection, staging_name, table_name, columns, if_exists):
+    """
+    Replaces a table by its staging table, or appends the staging table to it, then drops the staging table.
+    """
+    preparer = connection.dialect.identifier_preparer
+    staging, table = preparer.quote(staging_name), preparer.quote(table_name)
+    if if_exists == "append" and inspect(connection).has_table(table_name):
+        column_list = ", ".join(preparer.quote(str(column)) for column in columns)
+        connection.execute(text(f"INSERT INTO {table} ({column_list}) SELECT {column_list} FROM {staging}"))
+        connection.execute(text(f"DROP TABLE {staging}"))
+        return
+    if inspect(connection).has_table(table_name):
+        connection.execute(text(f"DROP TABLE {table}"))
+    if connection.dialect.name == "mssql":
+        connection.execute(text("EXEC sp_rename :staging, :table"), {"staging": staging_name, "table": table_name})
+    else:
+        connection.execute(text(f"ALTER TABLE {staging} RENAME TO {table}"))
+
+
+def bulk_load(df, table_name, engine=None, if_exists="append", dtype=None, chunk_size=None, staging=False):
+    """
+    Loads a DataFrame into a SQL table, in batches and with explicit column types.
+
+    This function:
+    1. Types the columns: a table that is appended to keeps the types of its existing columns, a new table gets
+       the types inferred by `sql_column_types` (texts as NVARCHAR(max) when rows will be appended to it later).
+    2. Inserts the rows `chunk_size` at a time, each chunk in its own transaction, with `fast_executemany` on
+       the engines of `create_sql_server_engine`.
+    3. With `if_exists='replace'`, or `staging` when appending, loads the rows into a `<table_name>_staging`
+       table which is then swapped with the table (or appended to it) in a single transaction: readers of the
+       table never see a partial load, and a failed load leaves the table unchanged.
+
+    Args:
+        df (pd.DataFrame): The DataFrame to load.
+        table_name (str): The name of the table.
+        engine (sqlalchemy.engine.Engine): The engine of the database. Defaults to `create_sql_server_engine()`.
+        if_exists (str): 'append' to add the rows to the table, 'replace' to replace its content.
+        dtype (dict): Optional SQLAlchemy types of some columns, overriding the inferred ones.
+        chunk_size (int): Number of rows per transaction. Defaults to the BULK_LOAD_CHUNK_SIZE environment variable (10000).
+        staging (bool): Whether to append the rows through a staging table.
+
+    Returns:
+        dict: The number of rows loaded, the duration in seconds and the number of rows per second.
+
+    Raises:
+        ValueError: If `if_exists` is neither 'append' nor 'replace', or if a type of `dtype` conflicts with the
+            type of an existing column the rows are appended to (e.g. binary embeddings into a text column).
+    """
+    if if_exists not in ("append", "replace"):
+        raise ValueError(f"Unsupported if_exists '{if_exists}', expected 'append' or 'replace'")
+    engine = engine if engine is not None else create_sql_server_engine()
+    chunk_size = chunk_size or BULK_LOAD_CHUNK_SIZE
+    staging = staging or if_exists == "replace"
+    start = time.perf_counter()
+
+    types = sql_column_types(df, dtype, sized_texts=if_exists == "replace")
+    load_name = f"{table_name}_staging" if staging else table_name
+    with engine.begin() as connection:
+        if if_exists == "append" and inspect(connection).has_table(table_name):
+            existing = Table(table_name, MetaData(), autoload_with=connection)
+            for column in existing.columns:
+                if column.name not in types:
+                    continue
+                requested = (dtype or {}).get(column.name)
+                if requested is not None and None not in (_python_type(requested), _python_type(column.type)) \
+                        and _python_type(requested) is not _python_type(column.type):
+                    raise ValueError(
+                        f"Column '{column.name}' of '{table_name}' is {column.type}, which does not hold the "
+                        f"requested {requested}: migrate the column before appending to it"
+                    )
+                types[column.name] = column.type
+        table = Table(load_name, MetaData(), *[Column(str(column), types[column]) for column in df.columns])
+        if staging:
+            table.drop(connection, checkfirst=True)
+        table.create(connection, checkfirst=True)
+
+    # Missing values are inserted as NULL, numpy scalars as Python values
+    records = df.astype(object).where(df.notna(), None).to_dict("records")
+    for chunk_start in range(0, len(records), chunk_size):
+        with engine.begin() as connection:
+            connection.execute(table.insert(), records[chunk_start:chunk_start + chunk_size])
+
+    if staging:
+        with engine.begin() as connection:
+            _swap_table(connection, load_name, table_name, df.columns, if_exists)
+
+    seconds = time.perf_counter() - start
+    rows_per_second = len(df) / seconds if seconds > 0 else float("inf")
+    logger.info("%s: %d rows loaded in %.1fs (%.0f rows/s)", table_name, len(df), seconds, rows_per_second)
+    return {"rows": len(df), "seconds": seconds, "rows_per_second": rows_per_second}
@@ -0,0 +1,116 @@
+import json
+import os
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Binary embedding format, version 1:
+# - byte 0: format version (1)
+# - byte 1: dtype code (1 = float32, 2 = float16)
+# - then the little-endian values of the vector
+EMBEDDING_FORMAT_VERSION = 1
+_DTYPE_CODES = {"float32": 1, "float16": 2}
+_CODE_DTYPES = {code: np.dtype(name).newbyteorder("<") for name, code in _DTYPE_CODES.items()}
+
+EMBEDDING_STORAGE_DTYPE = os.getenv("EMBEDDING_STORAGE_DTYPE", "float32")
+
+
+def encode_embedding(embedding, dtype=None) -> bytes:
+    """
+    Encodes an embedding vector into the compact binary format stored in VARBINARY columns.
+
+    A 384-dimension vector takes 1.5 KB in float32 (768 B in float16) instead of about 8 KB as JSON text.
+
+    Args:
+        embedding (array-like): The embedding vector. Nested lists such as [[...]] are flattened.
+        dtype (str): 'float32' or 'float16'. Defaults to the EMBEDDING_STORAGE_DTYPE environment variable (float32).
+
+    Returns:
+        bytes: The encoded embedding.
+
+    Raises:
+        ValueError: If the dtype is not supported.
+    """
+    dtype = dtype or EMBEDDING_STORAGE_DTYPE
+    if dtype not in _DTYPE_CODES:
+        raise ValueError(f"Unsupported embedding dtype '{dtype}', expected one of {list(_DTYPE_CODES)}")
+    code = _DTYPE_CODES[dtype]
+    values = np.asarray(embedding, dtype=_CODE_DTYPES[code]).ravel()
+    return bytes([EMBEDDING_FORMAT_VERSION, code]) + values.tobytes()
+
+
+def encode_embeddings(embeddings, dtype=None) -> list:
+    """
+    Encodes the rows of an embedding matrix into the binary format, for export to VARBINARY columns.
+
+    The header and the values of all the rows are laid out in one array, which is then split into one
+    `bytes` object per row.
+
+    Args:
+        embeddings (array-like): The (n, dim) embedding matrix.
+        dtype (str): 'float32' or 'float16'. Defaults to the EMBEDDING_STORAGE_DTYPE environment variable (float32).
+
+    Returns:
+        list[bytes]: The encoded embedding of each row.
+
+    Raises:
+        ValueError: If the dtype is not supported.
+    """
+    dtype = dtype or EMBEDDING_STORAGE_DTYPE
+    if dtype not in _DTYPE_CODES:
+        raise ValueError(f"Unsupported embedding dtype '{dtype}', expected one of {list(_DTYPE_CODES)}")
+    code = _DTYPE_CODES[dtype]
+    values = np.ascontiguousarray(np.atleast_2d(np.asarray(embeddings, dtype=_CODE_DTYPES[code])))
+    encoded = np.empty((values.shape[0], 2 + values.shape[1] * values.itemsize), dtype=np.uint8)
+    encoded[:, 0] = EMBEDDING_FORMAT_VERSION
+    encoded[:, 1] = code
+    encoded[:, 2:] = values.view(np.uint8).reshape(encoded.shape[0], encoded.shape[1] - 2)
+    return [row.tobytes() for row in encoded]
+
+
+def decode_embedding(value) -> np.ndarray:
+    """
+    Decodes a stored embedding into a float32 vector.
+
+    Both the binary format and the legacy JSON text (e.g. '[0.1, 0.2]' or '[[0.1, 0.2]]') are accepted, so
+    readers work on migrated and not yet migrated rows alike.
+
+    Args:
+        value (bytes | str | array-like): The stored embedding.
+
+    Returns:
+        np.ndarray: The 1-D float32 embedding, or None if the value is missing.
+
+    Raises:
+        ValueError: If the binary format version or dtype code is unknown.
+    """
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        value = bytes(value)
+        version, code = value[0], value[1]
+        if version != EMBEDDING_FORMAT_VERSION or code not in _CODE_DTYPES:
+            raise ValueError(f"Unknown embedding format (version {version}, dtype code {code})")
+        return np.frombuffer(value, dtype=_CODE_DTYPES[code], offset=2).astype(np.float32)
+    if isinstance(value, str):
+        value = json.loads(value)
+    return np.asarray(value, dtype=np.float32).ravel()
+
+
+def decode_embeddings(values) -> np.ndarray:
+    """
+    Decodes a sequence of stored embeddings into a 2-D float32 matrix.
+
+    Args:
+        values (pd.Series | list): The stored embeddings, in binary or legacy JSON format.
+
+    Returns:
+        np.ndarray: A float32 array of shape (len(values), embedding_dim).
+    """
+    if hasattr(values, "tolist"):
+        # pd.Series or np.ndarray
+        values = values.tolist()
+    if len(values) == 0:
+        return np.empty((0, 0), dtype=np.float32)
+    return np.vstack([decode_embedding(value) for value in values])
@@ -1,12 +1,29 @@
 import pandas as pd 
+import os
 import re
-from langchain_openai import AzureOpenAIEmbeddings
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 import numpy as np
 from dotenv import load_dotenv
 from sqlalchemy import create_engine
 import json
 from api_ia.clustering_model.utils import create_sql_server_conn, create_sql_server_engine
-from sentence_transformers import SentenceTransformer
+from api_ia.embeddings.codec import encode_embeddings, decode_embeddings
+from api_ia.embeddings.matrix import save_embedding_matrix
+from api_ia.embeddings.keys import embedding_key
+
+# Encoder of the training embeddings. Its name is part of the hash of the embedding store, so that changing
+# it re-embeds every incident.
+ENCODER_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+
+# Number of encoding processes of `encode_docs`: 1 encodes in the current process, 0 uses one process per core
+EMBEDDING_WORKERS = int(os.getenv("EMBEDDING_WORKERS", 1))
+
+# Batches submitted to each encoding process ahead of the one it is encoding
+_BATCHES_IN_FLIGHT_PER_WORKER = 2
+
+# Encoder of an encoding process, loaded once by `_init_encoding_worker`
+_worker_model = None
 
 
 
@@ -138,7 +155,80 @@ def features_selection(df:pd.DataFrame) -> pd.DataFrame:
 
 #     return df 
 
-def make_embeddings(df) -> pd.DataFrame:
+def _init_encoding_worker():
+    """
+    Loads the encoder of an encoding process, running torch on a single thread (the processes share the cores).
+    """
+    global _worker_model
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    torch.set_num_threads(1)
+    _worker_model = SentenceTransformer(ENCODER_MODEL)
+
+
+def _encode_batch(batch):
+    """
+    Encodes a batch of documents with the encoder of the encoding process.
+    """
+    return np.asarray(_worker_model.encode(batch), dtype=np.float32)
+
+
+def encode_docs(docs, workers=None, batch_size=250) -> np.ndarray:
+    """
+    Encodes documents with the training encoder, in batches, into a float32 matrix.
+
+    With several workers, the batches are encoded by a pool of processes, each loading its own copy of the
+    encoder and running torch on one thread. At most 2 batches per process are submitted ahead, so that the
+    documents and embeddings waiting in the pool stay bounded. The embeddings of each batch are copied into
+    the preallocated result matrix as soon as they are computed.
+
+    Args:
+        docs (pd.Series | list): The documents to encode.
+        workers (int): Number of encoding processes, 0 for one per core. Defaults to the EMBEDDING_WORKERS
+            environment variable (1, i.e. encoding in the current process).
+        batch_size (int): Number of documents per batch.
+
+    Returns:
+        np.ndarray: The float32 embeddings of the documents, one row per document.
+    """
+    docs = [str(doc) for doc in docs]
+    workers = EMBEDDING_WORKERS if workers is None else workers
+    workers = workers or os.cpu_count()
+    batches = [(start, docs[start:start + batch_size]) for start in range(0, len(docs), batch_size)]
+    embeddings = None
+    start_time = time.perf_counter()
+
+    def store(start, batch_embeddings):
+        nonlocal embeddings
+        if embeddings is None:
+            embeddings = np.empty((len(docs), batch_embeddings.shape[1]), dtype=np.float32)
+        embeddings[start:start + len(batch_embeddings)] = batch_embeddings
+
+    if workers == 1:
+        from sentence_transformers import SentenceTransformer
+
+        model_paraphrase = SentenceTransformer(ENCODER_MODEL)
+        for start, batch in batches:
+            store(start, np.asarray(model_paraphrase.encode(batch), dtype=np.float32))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_encoding_worker) as executor:
+            pending = {}
+            for start, batch in batches:
+                if len(pending) >= workers * _BATCHES_IN_FLIGHT_PER_WORKER:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        store(pending.pop(future), future.result())
+                pending[executor.submit(_encode_batch, batch)] = start
+            for future in list(pending):
+                store(pending.pop(future), future.result())
+
+    seconds = time.perf_counter() - start_time
+    print(f"Encoded {len(docs)} documents in {seconds:.1f}s ({len(docs) / max(seconds, 1e-9):.0f} docs/s, {workers} process(es))")
+    return embeddings if embeddings is not None else np.empty((0, 0), dtype=np.float32)
+
+
+def make_embeddings(df, store=None, matrix_path=None) -> pd.DataFrame:
     """
     Generates embeddings for textual data in the DataFrame.
 
@@ -147,14 +237,23 @@ def make_embeddings(df) -> pd.DataFrame:
     SentenceTransformer model. Results are returned in a DataFrame including the original columns and the computed
     embeddings.
 
+    With `matrix_path`, the float32 embedding matrix is also written to this `.npy` file, from which the next
+    training stages read it through a memory map (see `api_ia.embeddings.matrix`) instead of decoding the
+    'resulted_embeddings' column, which is only kept to export the embeddings to SQL.
+
+    With an embedding store, only the incidents that are new, whose text changed or that were embedded by another
+    encoder are encoded (and added to the store); the embeddings of the other incidents are read from the store.
+
     Args:
         df (pd.DataFrame): The input DataFrame with columns 'incident_number', 'description', 'category_full',
                            'ci_name', and 'location_full'.
+        store (IncidentEmbeddingStore): Optional store of the embeddings of the previous training runs.
+        matrix_path (str): Optional path of the `.npy` file the embedding matrix is written to.
 
     Returns:
         pd.DataFrame: A DataFrame containing the original columns along with new columns:
                       - 'docs': Concatenated text used for embedding generation.
-                      - 'resulted_embeddings': JSON-encoded embeddings for each row.
+                      - 'resulted_embeddings': binary-encoded embeddings for each row (see `api_ia.embeddings.codec`).
     """
     docs = pd.Series(
             df["description"]
@@ -167,27 +266,34 @@ def make_embeddings(df) -> pd.DataFrame:
             + "\n\n"
             + "Location:\n"
             + df['location_full'])
-    
-    model_paraphrase = SentenceTransformer("sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
 
-    batch_size = 250
-    embeddings = []
-    
-    for i in range (0,len(docs), batch_size):
-        start_batch = i 
-        end_batch = i + batch_size
-        batch = docs[start_batch:end_batch]
-
-        batch_df = pd.Series([str (doc) for doc in batch], index=range(len(batch)))
-        batch_embeddings = model_paraphrase.encode(batch_df)
-        embeddings.extend(batch_embeddings)
-        
-    embeddings_np = np.array(embeddings)
-    embeddings_list = embeddings_np.tolist()
-    embeddings_json = [json.dumps(embedding) for embedding in embeddings_list]
+    if store is None:
+        embeddings_np = encode_docs(docs)
+    else:
+        incident_numbers = [str(number) for number in df["incident_number"]]
+        content_hashes = [embedding_key(doc, ENCODER_MODEL) for doc in docs]
+        stored = store.lookup(incident_numbers, content_hashes)
+        missing = [i for i, number in enumerate(incident_numbers) if number not in stored]
+        reused = [i for i, number in enumerate(incident_numbers) if number in stored]
+        parts = []
+        if missing:
+            computed = encode_docs(docs.iloc[missing])
+            store.save([incident_numbers[i] for i in missing], [content_hashes[i] for i in missing], encode_embeddings(computed))
+            parts.append((missing, computed))
+        if reused:
+            parts.append((reused, decode_embeddings([stored[incident_numbers[i]] for i in reused])))
+        embeddings_np = np.empty((len(docs), parts[0][1].shape[1] if parts else 0), dtype=np.float32)
+        for rows, embeddings in parts:
+            embeddings_np[rows] = embeddings
+        print(f"Embeddings: {len(reused)} reused from the store, {len(missing)} computed")
+
+    if matrix_path is not None:
+        save_embedding_matrix(embeddings_np, matrix_path)
+    embeddings_bin = encode_embeddings(embeddings_np)
+
     result_docs = pd.DataFrame()
     result_docs["docs"] = docs
-    result_docs["resulted_embeddings"] = embeddings_json
+    result_docs["resulted_embeddings"] = embeddings_bin
     
 
     df = pd.DataFrame({'incident_number':df['incident_number'],
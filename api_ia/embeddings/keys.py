@@ -0,0 +1,25 @@
+import hashlib
+import re
+
+# Shared by the API embedding cache and the training embedding store, so that both identify a document by the
+# same key.
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def embedding_key(doc, model_id):
+    """
+    Computes the key of a document: a SHA-256 of the encoder model ID and the normalized text.
+
+    The text is normalized by collapsing runs of whitespace and stripping it, which does not change the
+    tokens seen by the encoder.
+
+    Args:
+        doc (str): The document to encode.
+        model_id (str): The identifier of the encoder model.
+
+    Returns:
+        str: The hexadecimal key.
+    """
+    normalized = _WHITESPACE.sub(" ", str(doc)).strip()
+    return hashlib.sha256(f"{model_id}\0{normalized}".encode("utf-8")).hexdigest()
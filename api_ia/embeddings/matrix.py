@@ -0,0 +1,47 @@
+import numpy as np
+
+# Embedding matrices are exchanged between the training stages as float32 `.npy` files, read through a memory
+# map: a stage reads the pages it uses instead of parsing one encoded blob per incident. The binary blobs of
+# `api_ia.embeddings.codec` are only produced to export the embeddings to SQL tables.
+
+
+def save_embedding_matrix(embeddings, path):
+    """
+    Writes an embedding matrix to a float32 `.npy` file.
+
+    Args:
+        embeddings (array-like): The (n, dim) embedding matrix.
+        path (str): The path of the `.npy` file.
+
+    Returns:
+        np.memmap: The matrix, read back from the file as a read-only memory map.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    matrix = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=embeddings.shape)
+    matrix[:] = embeddings
+    matrix.flush()
+    del matrix
+    return load_embedding_matrix(path)
+
+
+def load_embedding_matrix(path, mode="r"):
+    """
+    Opens a float32 `.npy` embedding matrix as a memory map, read-only by default.
+
+    With `mode='c'` (copy-on-write), the matrix can be modified in place: the modified pages become private to
+    the process and the file is left unchanged.
+
+    Args:
+        path (str): The path of the `.npy` file.
+        mode (str): The memory map mode, 'r' (read-only) or 'c' (copy-on-write).
+
+    Returns:
+        np.memmap: The (n, dim) embedding matrix.
+
+    Raises:
+        ValueError: If the file does not hold a 2-D float32 matrix.
+    """
+    matrix = np.load(path, mmap_mode=mode)
+    if matrix.ndim != 2 or matrix.dtype != np.float32:
+        raise ValueError(f"'{path}' does not hold a 2-D float32 embedding matrix ({matrix.ndim}-D {matrix.dtype})")
+    return matrix
@@ -0,0 +1,82 @@
+import os
+import pandas as pd
+from dotenv import load_dotenv
+from sqlalchemy import MetaData, Table, Column, String, LargeBinary, select, delete, bindparam
+from api_ia.clustering_model.utils import bulk_load
+
+load_dotenv()
+
+# Table of the embedding store. An empty value disables the store: training then encodes every incident.
+EMBEDDING_STORE_TABLE = os.getenv("EMBEDDING_STORE_TABLE", "incident_embeddings")
+
+# SQL Server accepts at most 2100 parameters per statement
+_CHUNK_SIZE = 2000
+
+
+class IncidentEmbeddingStore:
+    """
+    Persistent store of the training embeddings, so that a training run only encodes new or changed incidents.
+
+    The store holds one row per incident: its number, the hash of its document and of the encoder that embedded
+    it (see `embedding_key`), and the embedding in the binary format of `api_ia.embeddings.codec`. A stored
+    embedding is reused only when the hash still matches, i.e. when neither the text of the incident nor the
+    encoder changed.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): The engine of the database holding the store.
+        table_name (str): The name of the store table. Created if it does not exist.
+    """
+
+    def __init__(self, engine, table_name=EMBEDDING_STORE_TABLE):
+        self.engine = engine
+        self.table = Table(
+            table_name,
+            MetaData(),
+            Column("incident_number", String(50), primary_key=True),
+            Column("content_hash", String(64), nullable=False),
+            Column("resulted_embeddings", LargeBinary, nullable=False),
+        )
+        self.table.create(engine, checkfirst=True)
+
+    def lookup(self, incident_numbers, content_hashes):
+        """
+        Returns the stored embeddings of the incidents whose hash did not change.
+
+        Args:
+            incident_numbers (list): The incident numbers.
+            content_hashes (list[str]): The current hash of each incident, in the same order.
+
+        Returns:
+            dict: The binary embedding of each incident found with the same hash, by incident number.
+        """
+        expected = {str(number): content_hash for number, content_hash in zip(incident_numbers, content_hashes)}
+        numbers = list(expected)
+        query = select(self.table).where(self.table.c.incident_number.in_(bindparam("numbers", expanding=True)))
+        found = {}
+        with self.engine.connect() as connection:
+            for start in range(0, len(numbers), _CHUNK_SIZE):
+                for row in connection.execute(query, {"numbers": numbers[start:start + _CHUNK_SIZE]}):
+                    if expected[row.incident_number] == row.content_hash:
+                        found[row.incident_number] = row.resulted_embeddings
+        return found
+
+    def save(self, incident_numbers, content_hashes, embeddings):
+        """
+        Stores the embeddings of the given incidents, replacing the rows already stored for them.
+
+        Args:
+            incident_numbers (list): The incident numbers.
+            content_hashes (list[str]): The hash of each incident, in the same order.
+            embeddings (list[bytes]): The binary embedding of each incident, in the same order.
+        """
+        rows = pd.DataFrame({
+            "incident_number": [str(number) for number in incident_numbers],
+            "content_hash": list(content_hashes),
+            "resulted_embeddings": list(embeddings),
+        })
+        query = delete(self.table).where(self.table.c.incident_number.in_(bindparam("numbers", expanding=True)))
+        with self.engine.begin() as connection:
+            for start in range(0, len(rows), _CHUNK_SIZE):
+                connection.execute(query, {"numbers": rows["incident_number"].iloc[start:start + _CHUNK_SIZE].tolist()})
+        # A failure between the deletion and the load only loses cached embeddings, which are computed again
+        bulk_load(rows, self.table.name, self.engine, if_exists="append", dtype={column.name: column.type for column in self.table.columns})
@@ -1,4 +1,6 @@
 from api_ia.clustering_model.utils import create_sql_server_engine, query_db
+from api_ia.embeddings.codec import decode_embeddings
+from api_ia.clustering_model.silhouette import SILHOUETTE_METRICS
 import streamlit as st 
 import pandas as pd 
 import plotly.express as px
@@ -65,7 +67,12 @@ st.markdown("<h1>Clustering Model Monitoring</h1>",unsafe_allow_html=True)
 def get_best_run(experiment_name):
     experiment = mlflow.get_experiment_by_name(experiment_name)
     runs = mlflow.search_runs(experiment_ids=experiment.experiment_id)
-    best_run = runs.loc[runs['metrics.silhouette score'].idxmax()]
+    # Runs evaluated in 'centroid' mode only log the simplified silhouette score
+    silhouette_modes = runs.get('params.silhouette_mode', pd.Series(index=runs.index, dtype=object)).fillna('exact')
+    runs['silhouette_mode'] = silhouette_modes
+    runs['silhouette_metric'] = silhouette_modes.map(SILHOUETTE_METRICS)
+    runs['silhouette'] = [run.get(f"metrics.{run['silhouette_metric']}") for _, run in runs.iterrows()]
+    best_run = runs.loc[runs['silhouette'].astype(float).idxmax()]
     return best_run
 
 experiment_name = "incidents_clustering"  # Remplacez par le nom de votre expérience
@@ -90,8 +97,12 @@ st.markdown(f"""
         <div class="metric-value">{best_run['params.init']}</div>
     </div>
     <div class="metric-container">
-        <div class="metric-name">Silhouette score</div>
-        <div class="metric-value">{best_run['metrics.silhouette score'].round(2)}</div>
+        <div class="metric-name">{best_run['silhouette_metric'].capitalize()}</div>
+        <div class="metric-value">{round(float(best_run['silhouette']), 2)}</div>
+    </div>
+    <div class="metric-container">
+        <div class="metric-name">Silhouette mode</div>
+        <div class="metric-value">{best_run['silhouette_mode']}</div>
     </div>     
             
             """, unsafe_allow_html=True)
@@ -145,9 +156,9 @@ st.markdown('<h2>Incidents Clustering Visualization : Training dataset</h2>',uns
 
 # Affichage du graphique dans Streamlit
 
-data_training['resulted_embeddings'] = data_training['resulted_embeddings'].apply(lambda x: np.array(eval(x)))
+training_embeddings = decode_embeddings(data_training['resulted_embeddings'])
 scaler = StandardScaler()
-scaled_embeddings = scaler.fit_transform(list(data_training['resulted_embeddings']))
+scaled_embeddings = scaler.fit_transform(training_embeddings)
 pca = PCA(n_components=2)
 principal_components = pca.fit_transform(scaled_embeddings)
 df = pd.DataFrame(principal_components, columns=['PC1', 'PC2'])
@@ -162,17 +173,12 @@ fig.update_layout(title='Clusters for training dataset',
 st.plotly_chart(fig)
 
 
-# Convert the embeddings from string to numpy array
-data_predictions['resulted_embeddings'] = data_predictions['resulted_embeddings'].apply(lambda x: np.array(eval(x)))
-
-# Flatten the embeddings if they are multi-dimensional
-# For example, if each embedding is of shape (n, m), you can flatten it to shape (n * m)
-data_predictions['resulted_embeddings'] = data_predictions['resulted_embeddings'].apply(lambda x: x.flatten())
-
-# Stack all embeddings into a single 2D numpy array
-embeddings = np.stack(data_predictions['resulted_embeddings'].values)
+# Decode the embeddings into a single 2D numpy array
+# Rows not migrated yet still hold their embeddings as JSON text in the legacy column
+stored_embeddings = data_predictions['embedding'].where(data_predictions['embedding'].notna(), data_predictions['resulted_embeddings'])
+embeddings = decode_embeddings(stored_embeddings)
 scaler = StandardScaler()
-scaled_embeddings = scaler.fit_transform(list(data_predictions['resulted_embeddings']))
+scaled_embeddings = scaler.fit_transform(embeddings)
 pca = PCA(n_components=2)
 principal_components = pca.fit_transform(scaled_embeddings)
 df = pd.DataFrame(principal_components, columns=['PC1', 'PC2'])
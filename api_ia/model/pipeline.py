@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Directory of the local checkpoints of the training stages
+TRAINING_CHECKPOINT_DIR = os.getenv("TRAINING_CHECKPOINT_DIR", "outputs/checkpoints")
+
+
+def input_hash(*inputs) -> str:
+    """
+    Computes the hash identifying the inputs of a stage.
+
+    DataFrames are hashed on their columns and values, arrays on their shape, dtype and bytes, and any other
+    input (stage name, hash of a previous stage, configuration...) on its text.
+
+    Args:
+        *inputs: The inputs of the stage.
+
+    Returns:
+        str: The hexadecimal SHA-256 hash.
+    """
+    digest = hashlib.sha256()
+    for value in inputs:
+        if isinstance(value, pd.DataFrame):
+            digest.update(json.dumps([str(column) for column in value.columns]).encode("utf-8"))
+            digest.update(pd.util.hash_pandas_object(value, index=False).values.tobytes())
+        elif isinstance(value, np.ndarray):
+            digest.update(f"{value.shape}{value.dtype}".encode("utf-8"))
+            digest.update(np.ascontiguousarray(value).tobytes())
+        else:
+            digest.update(str(value).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class StageCheckpoints:
+    """
+    Local checkpoints of the stages of a training run, so that a run skips the stages whose inputs did not
+    change and resumes from the last completed stage after a failure.
+
+    Each stage has one directory `<root>/<run_name>/<stage>/` holding its outputs: DataFrames as Parquet files,
+    arrays as `.npy` files (read back as memory maps) and other values in `meta.json`, along with the hash of
+    the inputs they were computed from. A stage is written to a temporary directory which is renamed once
+    complete, so an interrupted stage never leaves a checkpoint behind.
+
+    Args:
+        run_name (str): The name of the training run.
+        root (str): The root directory of the checkpoints.
+    """
+
+    def __init__(self, run_name, root=TRAINING_CHECKPOINT_DIR):
+        self.path = os.path.join(root, run_name)
+
+    def load(self, stage, key):
+        """
+        Returns the outputs of a stage if its checkpoint was computed from the given inputs.
+
+        Args:
+            stage (str): The name of the stage.
+            key (str): The hash of the inputs of the stage.
+
+        Returns:
+            dict: The outputs of the stage by name, or None if there is no matching checkpoint.
+        """
+        stage_dir = os.path.join(self.path, stage)
+        meta_path = os.path.join(stage_dir, "meta.json")
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta["key"] != key:
+            return None
+        outputs = dict(meta["values"])
+        for file_name in os.listdir(stage_dir):
+            name, extension = os.path.splitext(file_name)
+            if extension == ".parquet":
+                outputs[name] = pd.read_parquet(os.path.join(stage_dir, file_name))
+            elif extension == ".npy":
+                outputs[name] = np.load(os.path.join(stage_dir, file_name), mmap_mode="r")
+        return outputs
+
+    def run(self, stage, key, compute):
+        """
+        Returns the outputs of a stage, read from its checkpoint or computed and checkpointed.
+
+        Args:
+            stage (str): The name of the stage.
+            key (str): The hash of the inputs of the stage.
+            compute (callable): Function taking the working directory of the stage, where it can write `.npy`
+                files directly, and returning the dict of its other outputs (DataFrames, arrays or JSON values).
+
+        Returns:
+            dict: The outputs of the stage by name.
+        """
+        outputs = self.load(stage, key)
+        if outputs is not None:
+            print(f"Stage '{stage}': inputs unchanged, read from the checkpoint")
+            return outputs
+
+        stage_dir = os.path.join(self.path, stage)
+        work_dir = stage_dir + ".tmp"
+        shutil.rmtree(work_dir, ignore_errors=True)
+        os.makedirs(work_dir)
+        values = {}
+        for name, value in compute(work_dir).items():
+            if isinstance(value, pd.DataFrame):
+                value.to_parquet(os.path.join(work_dir, f"{name}.parquet"))
+            elif isinstance(value, np.ndarray):
+                np.save(os.path.join(work_dir, f"{name}.npy"), value)
+            else:
+                values[name] = value
+        with open(os.path.join(work_dir, "meta.json"), "w") as f:
+            json.dump({"key": key, "values": values}, f)
+
+        shutil.rmtree(stage_dir, ignore_errors=True)
+        os.rename(work_dir, stage_dir)
+        print(f"Stage '{stage}': computed and checkpointed")
+        return self.load(stage, key)
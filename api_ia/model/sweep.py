@@ -0,0 +1,161 @@
+import os
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import mlflow
+from sklearn.cluster import KMeans
+from sklearn.metrics import davies_bouldin_score, calinski_harabasz_score
+from threadpoolctl import threadpool_limits
+from dotenv import load_dotenv
+from config import cfg
+from api_ia.embeddings.codec import decode_embeddings
+from api_ia.embeddings.matrix import save_embedding_matrix, load_embedding_matrix
+from api_ia.clustering_model.centroids import save_centroids
+from api_ia.clustering_model.silhouette import estimate_silhouette, SILHOUETTE_METRICS
+
+load_dotenv()
+
+# Metrics a sweep can select the best number of clusters on, and whether higher is better
+SELECTION_METRICS = {
+    "silhouette score": True,
+    "simplified silhouette score": True,
+    "calinski harabasz score": True,
+    "davies bouldin score": False,
+    "inertia": False,
+}
+
+
+def write_embeddings_matrix(values, path):
+    """
+    Decodes the stored embeddings into a float32 `.npy` file, read by the sweep workers as a memory map.
+
+    Args:
+        values (pd.Series): The stored embeddings, in binary or legacy JSON format.
+        path (str): The path of the `.npy` file.
+
+    Returns:
+        str: The path of the file.
+    """
+    save_embedding_matrix(decode_embeddings(values), path)
+    return path
+
+
+def fit_candidate(matrix_path, n_clusters, n_init, silhouette_mode, silhouette_sample_size, random_state):
+    """
+    Fits a KMeans model with `n_clusters` clusters in a sweep worker and evaluates it.
+
+    The embedding matrix is opened as a memory map of the file written by the parent: it is not pickled to
+    each worker. sklearn's KMeans centers its input in place during the fit, so one private copy of the
+    matrix per worker cannot be avoided: the map is copy-on-write and the model fits it with `copy_x=False`,
+    so that the pages the centering modifies are the only copy (float32, about the size of the matrix),
+    instead of a full copy on top of the mapped pages. Each worker uses a single thread, the sweep running one
+    worker per core.
+
+    Args:
+        matrix_path (str): The `.npy` file of the embedding matrix.
+        n_clusters (int): The number of clusters.
+        n_init (int): The number of KMeans initializations.
+        silhouette_mode (str): The silhouette estimator, 'exact', 'sampled' or 'centroid' (see `estimate_silhouette`).
+        silhouette_sample_size (int): Number of incidents the sampled silhouette is computed on.
+        random_state (int): Seed of the initializations and of the silhouette sample.
+
+    Returns:
+        tuple: The number of clusters, the fitted model and the dict of its metrics.
+    """
+    embeddings = load_embedding_matrix(matrix_path, mode="c")
+    with threadpool_limits(limits=1):
+        model = KMeans(n_clusters=n_clusters, init="k-means++", n_init=n_init, algorithm="lloyd", copy_x=False, random_state=random_state)
+        model.fit(embeddings)
+        labels = model.labels_
+        silhouette = estimate_silhouette(embeddings, labels, mode=silhouette_mode, sample_size=silhouette_sample_size, random_state=random_state, cluster_centers=model.cluster_centers_)
+        metrics = {
+            silhouette["metric"]: silhouette["score"],
+            "calinski harabasz score": calinski_harabasz_score(embeddings, labels),
+            "davies bouldin score": davies_bouldin_score(embeddings, labels),
+            "inertia": model.inertia_,
+        }
+    return n_clusters, model, {name: float(value) for name, value in metrics.items()}
+
+
+def sweep(df, sweep_name="kmeans_sweep", sweep_cfg=None):
+    """
+    Fits KMeans models for several numbers of clusters in parallel and selects the best one.
+
+    This function:
+    1. Decodes the embeddings once into a `.npy` file, memory-mapped by every worker (see `fit_candidate`).
+    2. Fits one candidate per value of `n_clusters` in a process pool (one process per core by default).
+    3. Logs each candidate as a child MLflow run (params, metrics, model and centroids) of a parent sweep run.
+    4. Selects the candidate with the best `selection_metric` and logs it on the parent run.
+
+    The child runs are named `sweep_kmeans_<n_clusters>`, so the API (which serves the best `kmeans_<n>` run)
+    never picks them: the selected number of clusters is then trained with the training pipeline, which also
+    names its clusters.
+
+    Args:
+        df (pd.DataFrame): The DataFrame containing a column 'resulted_embeddings' with embeddings.
+        sweep_name (str): The name of the parent MLflow run.
+        sweep_cfg (DictConfig): The sweep configuration. Defaults to `cfg.sweep` (see `configs/sweep/kmeans_sweep.yaml`).
+
+    Returns:
+        tuple: The selected number of clusters and a DataFrame with the metrics of every candidate.
+
+    Raises:
+        ValueError: If the selection metric is unknown, or is a silhouette score the silhouette mode does not compute.
+    """
+    sweep_cfg = sweep_cfg if sweep_cfg is not None else cfg.sweep
+    selection_metric = sweep_cfg.selection_metric
+    if selection_metric not in SELECTION_METRICS:
+        raise ValueError(f"Unknown selection metric '{selection_metric}', expected one of {list(SELECTION_METRICS)}")
+    if selection_metric in SILHOUETTE_METRICS.values() and selection_metric != SILHOUETTE_METRICS[sweep_cfg.silhouette_mode]:
+        raise ValueError(f"The '{sweep_cfg.silhouette_mode}' silhouette mode does not compute the '{selection_metric}'")
+
+    mlflow.set_tracking_uri(os.getenv('MLFLOW_TRACKING_URI'))
+    experiment = mlflow.get_experiment_by_name("incidents_clustering")
+    experiment_id = experiment.experiment_id if experiment is not None else mlflow.create_experiment("incidents_clustering")
+
+    results = []
+    with tempfile.TemporaryDirectory() as sweep_dir:
+        matrix_path = write_embeddings_matrix(df["resulted_embeddings"], os.path.join(sweep_dir, "embeddings.npy"))
+        with ProcessPoolExecutor(max_workers=sweep_cfg.max_workers or os.cpu_count()) as executor:
+            futures = [
+                executor.submit(fit_candidate, matrix_path, int(n_clusters), sweep_cfg.n_init, sweep_cfg.silhouette_mode, sweep_cfg.silhouette_sample_size, sweep_cfg.random_state)
+                for n_clusters in sweep_cfg.n_clusters
+            ]
+            results = [future.result() for future in futures]
+
+    with mlflow.start_run(experiment_id=experiment_id, run_name=sweep_name):
+        mlflow.set_tag("model", "kmeans_sweep")
+        for n_clusters, model, metrics in results:
+            run_name = f"sweep_kmeans_{n_clusters}"
+            with mlflow.start_run(experiment_id=experiment_id, run_name=run_name, nested=True):
+                mlflow.sklearn.log_model(model, run_name)
+                with tempfile.TemporaryDirectory() as centroids_dir:
+                    save_centroids(model.cluster_centers_, centroids_dir, run_name=run_name)
+                    mlflow.log_artifacts(centroids_dir, artifact_path=f"{run_name}_centroids")
+                mlflow.log_params({
+                    "n_clusters": n_clusters, "init": "k-means++", "n_init": sweep_cfg.n_init, "algorithm": "lloyd",
+                    "silhouette_mode": sweep_cfg.silhouette_mode, "silhouette_sample_size": sweep_cfg.silhouette_sample_size,
+                })
+                mlflow.set_tag("model", "kmeans")
+                mlflow.log_metrics(metrics)
+
+        df_results = pd.DataFrame([{"n_clusters": n_clusters, **metrics} for n_clusters, _, metrics in results])
+        df_results = df_results.sort_values(selection_metric, ascending=not SELECTION_METRICS[selection_metric])
+        best = df_results.iloc[0]
+        mlflow.log_params({"n_clusters_candidates": list(sweep_cfg.n_clusters), "selection_metric": selection_metric})
+        mlflow.log_metric("best n_clusters", int(best["n_clusters"]))
+        mlflow.log_metric(f"best {selection_metric}", float(best[selection_metric]))
+
+    print(df_results.to_string(index=False))
+    return int(best["n_clusters"]), df_results
+
+
+if __name__ == "__main__":
+    from api_ia.clustering_model.utils import create_sql_server_engine
+
+    # Embeddings of the last training dataset, e.g. `python -m api_ia.model.sweep kmeans_40`
+    run_name = sys.argv[1] if len(sys.argv) > 1 else "kmeans_40"
+    df_embeddings = pd.read_sql(f"SELECT resulted_embeddings FROM {run_name}_trainingdataset_embed", create_sql_server_engine())
+    best_n_clusters, _ = sweep(df_embeddings)
+    print(f"Best number of clusters : {best_n_clusters}")
@@ -1,17 +1,30 @@
-from api_ia.embeddings.embeddings import clean_dataset, features_selection, make_embeddings
+from api_ia.embeddings.embeddings import clean_dataset, features_selection, make_embeddings, ENCODER_MODEL
+from api_ia.embeddings.store import IncidentEmbeddingStore, EMBEDDING_STORE_TABLE
+from api_ia.embeddings.codec import EMBEDDING_STORAGE_DTYPE
 from api_ia.clustering_model.clustering import modelisation
 from api_ia.clustering_model.naming import make_naming
-from api_ia.clustering_model.utils import create_sql_server_conn, create_sql_server_engine
+from api_ia.clustering_model.utils import create_sql_server_conn, create_sql_server_engine, bulk_load
+from api_ia.clustering_model.migrate_incidents_clusters import migrate_incidents_clusters
+from api_ia.model.pipeline import StageCheckpoints, input_hash
+from omegaconf import OmegaConf
+from config import cfg
 from dotenv import load_dotenv
 import pandas as pd 
 import os 
 import pyodbc
 import requests
+from sqlalchemy import LargeBinary
 
 load_dotenv()
 
 database_api_key = os.getenv('API_DATABASE_SECRET_KEY')
 
+# Upload the results of the training runs to the SQL database
+TRAINING_UPLOAD_SQL = os.getenv('TRAINING_UPLOAD_SQL', 'true').lower() == 'true'
+
+# Embeddings are stored in the binary format of api_ia.embeddings.codec
+EMBEDDINGS_SQL_DTYPE = {'resulted_embeddings': LargeBinary}
+
 def get_incidents():
     """
     Fetches incident data from a remote API and returns it as a DataFrame.
@@ -35,36 +48,94 @@ def get_incidents():
     return incidents
 
 
-def training(run_name):
+def upload_results(run_name, outputs, engine=None):
+    """
+    Uploads the datasets of a training run to the SQL database.
+
+    This function writes the clean dataset, the training dataset, its embeddings, its clusters and its titles
+    to the `<run_name>_*` tables, which it replaces, and appends the clustered incidents to `incidents_clusters`,
+    with `bulk_load`. The embeddings of `incidents_clusters` are first converted to the binary format if the
+    table still holds them as JSON text (see `migrate_incidents_clusters`).
+
+    Args:
+        run_name (str): Unique identifier for the training run.
+        outputs (dict): The DataFrames of the stages, by name.
+        engine (sqlalchemy.engine.Engine): The engine of the database. Defaults to `create_sql_server_engine()`.
+    """
+    engine = engine if engine is not None else create_sql_server_engine()
+    # The tables of the run are replaced through a staging table: the API never reads a partially loaded table
+    bulk_load(outputs['clean'], run_name +'_cleandataset', engine, if_exists='replace')
+    bulk_load(outputs['features'], run_name +'_trainingdataset', engine, if_exists='replace')
+    bulk_load(outputs['embeddings'], run_name +'_trainingdataset_embed', engine, if_exists='replace', dtype=EMBEDDINGS_SQL_DTYPE)
+    bulk_load(outputs['clusters'], run_name +'_trainingdataset_clusters', engine, if_exists='replace', dtype=EMBEDDINGS_SQL_DTYPE)
+    # incidents_clusters is never replaced: rows appended before the binary format hold JSON text embeddings
+    migrate_incidents_clusters(engine)
+    bulk_load(outputs['clusters'], 'incidents_clusters', engine, if_exists='append', dtype=EMBEDDINGS_SQL_DTYPE)
+    bulk_load(outputs['titles'], run_name +'_trainingdataset_titles', engine, if_exists='replace', dtype=EMBEDDINGS_SQL_DTYPE)
+    bulk_load(outputs['cluster_titles'], run_name +'_clusters_title', engine, if_exists='replace')
+
+
+def training(run_name, upload=None):
     """
     Orchestrates the pipeline for processing incident data and training a clustering model.
 
+    The pipeline is split into stages whose outputs are checkpointed locally (see `StageCheckpoints`), keyed by
+    the hash of their inputs: the incidents, the outputs of the previous stage and the configuration of the
+    stage. A stage whose inputs did not change is read from its checkpoint, so that a run resumes from the last
+    completed stage after a failure (e.g. of the naming stage) and a run on unchanged data is not recomputed.
+
     Parameters:
         run_name (str): Unique identifier for the training run.
+        upload (bool): Whether to upload the results to the SQL database. Defaults to the TRAINING_UPLOAD_SQL
+            environment variable (true).
 
     Returns:
         str: MLflow run ID for the current training session.
 
     Process:
         1. Fetch and clean incident data.
-        2. Select features and create embeddings.
-        3. Train a clustering model and save results.
-        4. Generate and store cluster titles.
+        2. Select features and create embeddings, encoding only the incidents missing from the embedding store.
+        3. Train a clustering model on the embedding matrix, passed as a memory-mapped `.npy` file.
+        4. Generate cluster titles.
+        5. Optionally, upload the results to the SQL database.
     """
+    upload = TRAINING_UPLOAD_SQL if upload is None else upload
     engine = create_sql_server_engine()
+    checkpoints = StageCheckpoints(run_name)
 
     # Exécution de la requête et récupération des données dans un DataFrame Pandas
     df = get_incidents()
-    df_clean = clean_dataset(df)
-    df_clean.to_sql(run_name +'_cleandataset', engine, index=False, if_exists='replace')
-    df_feat = features_selection(df_clean)
-    df_feat.to_sql(run_name +'_trainingdataset', engine, index=False, if_exists='replace')
-    df_embeddings = make_embeddings(df_feat)
-    df_embeddings.to_sql(run_name +'_trainingdataset_embed', engine, index=False, if_exists='replace')
-    run_id,df_clusters = modelisation(df_embeddings,run_name)
-    df_clusters.to_sql(run_name +'_trainingdataset_clusters', engine, index=False, if_exists='replace')
-    df_named, cluster_title = make_naming(df_clusters)
-    df_named.to_sql(run_name +'_trainingdataset_titles', engine, index=False, if_exists='replace')
-    cluster_title.to_sql(run_name +'_clusters_title', engine, index=False, if_exists='replace')
-
-    return run_id
+
+    clean_key = input_hash('clean', df)
+    df_clean = checkpoints.run('clean', clean_key, lambda stage_dir: {'clean': clean_dataset(df)})['clean']
+
+    features_key = input_hash('features', clean_key)
+    df_feat = checkpoints.run('features', features_key, lambda stage_dir: {'features': features_selection(df_clean)})['features']
+
+    def embeddings_stage(stage_dir):
+        store = IncidentEmbeddingStore(engine, EMBEDDING_STORE_TABLE) if EMBEDDING_STORE_TABLE else None
+        return {'embeddings': make_embeddings(df_feat, store=store, matrix_path=os.path.join(stage_dir, 'matrix.npy'))}
+    embeddings_key = input_hash('embeddings', features_key, ENCODER_MODEL, EMBEDDING_STORAGE_DTYPE)
+    embeddings = checkpoints.run('embeddings', embeddings_key, embeddings_stage)
+
+    def clustering_stage(stage_dir):
+        run_id, df_clusters = modelisation(embeddings['embeddings'].copy(), run_name, embeddings=embeddings['matrix'], write_results=False)
+        return {'run_id': run_id, 'clusters': df_clusters}
+    clustering_key = input_hash('clustering', embeddings_key, run_name, OmegaConf.to_yaml(cfg.model))
+    clustering = checkpoints.run('clustering', clustering_key, clustering_stage)
+
+    def naming_stage(stage_dir):
+        df_named, cluster_title = make_naming(clustering['clusters'].copy())
+        return {'titles': df_named, 'cluster_titles': cluster_title}
+    naming_key = input_hash('naming', clustering_key)
+    naming = checkpoints.run('naming', naming_key, naming_stage)
+
+    def upload_stage(stage_dir):
+        outputs = {'clean': df_clean, 'features': df_feat, 'embeddings': embeddings['embeddings'], 'clusters': clustering['clusters'], **naming}
+        upload_results(run_name, outputs, engine)
+        return {'uploaded': True}
+    if upload:
+        # Checkpointed too, so that resuming a run does not append its incidents to `incidents_clusters` twice
+        checkpoints.run('upload', input_hash('upload', naming_key), upload_stage)
+
+    return clustering['run_id']
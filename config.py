@@ -1,4 +1,8 @@
+import os
 from hydra import compose, initialize
 
+# Hydra overrides, e.g. CONFIG_OVERRIDES="model=minibatch_kmeans model.n_clusters=60"
+overrides = os.getenv("CONFIG_OVERRIDES", "").split()
+
 with initialize(version_base="1.2", config_path="./configs/"):
-    cfg = compose(config_name="params.yaml")
\ No newline at end of file
+    cfg = compose(config_name="params.yaml", overrides=overrides)